@@ -0,0 +1,64 @@
+"""Benchmark output throughput of the JumpTheGun clients.
+
+This compares running a tool which writes a lot of output directly, via
+the Bash client (`jumpthegun run`) and via the Python client
+(`jumpthegun-client`, with and without `--pass-fds`), reporting MB/s for each.
+
+Run from the repository root:
+
+    python -m benchmarks.output_throughput [--megabytes N] [--line-length N]
+"""
+
+import argparse
+import json
+import time
+from typing import Dict, List
+
+from tests.testenvs import run, setup_test_project
+
+TOOL_NAME = "__test_write_output"
+
+clients: Dict[str, List[str]] = {
+    "direct": [],
+    "bash_client": ["jumpthegun", "run", "--no-autorun"],
+    "python_client": ["jumpthegun-client", "--no-autorun"],
+    "python_client_pass_fds": ["jumpthegun-client", "--no-autorun", "--pass-fds"],
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--megabytes", type=float, default=5.0)
+    parser.add_argument("--line-length", type=int, default=80)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="Output JSON.")
+    args = parser.parse_args()
+
+    proj_path = setup_test_project("testproj_with_jumpthegun", with_jumpthegun=True)
+    n_bytes = int(args.megabytes * 1024 * 1024)
+    tool_cmd = [TOOL_NAME, str(n_bytes), str(args.line_length)]
+
+    results: Dict[str, float] = {}
+    run(["jumpthegun", "start", TOOL_NAME], proj_path=proj_path, check=True)
+    try:
+        for client_name, client_cmd in clients.items():
+            best_time = float("inf")
+            for _i in range(args.repeat):
+                start_time = time.perf_counter()
+                proc = run([*client_cmd, *tool_cmd], proj_path=proj_path)
+                best_time = min(best_time, time.perf_counter() - start_time)
+                if len(proc.stdout) != n_bytes // args.line_length * args.line_length:
+                    raise Exception(f"Unexpected output length from {client_name}.")
+            results[client_name] = n_bytes / 1024 / 1024 / best_time
+    finally:
+        run(["jumpthegun", "stop", TOOL_NAME], proj_path=proj_path, check=True)
+
+    if args.json:
+        print(json.dumps({"mb_per_second": results}, indent=2))
+    else:
+        for client_name, mb_per_second in results.items():
+            print(f"{client_name:>22}: {mb_per_second:8.2f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+"""Benchmark running tools directly vs. via JumpTheGun.
+
+For each tool, this measures:
+
+* cold_start: `jumpthegun run` with no daemon running, which runs the tool
+  directly and starts a daemon in the background, and the time until that
+  daemon is ready.
+* warm: runs with a daemon already running.
+* output_heavy: runs on a large file, producing a lot of output.
+* stdin_heavy: runs on a large file passed via stdin.
+* concurrent: several runs started at once, timing until all are done.
+
+Separately, client_overhead measures runs of a tool which does nothing, so
+that the time is almost entirely that of the clients and the daemon.  To
+compare the Bash client with another version of it, pass that version's
+script via --bash-client-baseline, e.g. one extracted with
+`git show <rev>:src/jumpthegun.sh`.
+
+Each is measured when running the tool directly and via each client: the
+Bash client (`jumpthegun run`) and the Python client (`jumpthegun-client`,
+with and without `--pass-fds`).  Cold starts are only measured with the
+Bash client, which is what starts daemons.
+
+This uses the same test environment as the tests, and isolated config and
+runtime directories, so that the user's config and daemons don't affect the
+results.  Results are printed as JSON, and a summary is printed to stderr.
+
+Run from the repository root:
+
+    python -m benchmarks.suite [--tools black,flake8] [--repeat N] [--output FILE]
+        [--bash-client-baseline SCRIPT]
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from tests.testenvs import run, setup_test_project
+
+clients: Dict[str, List[str]] = {
+    "direct": [],
+    "bash_client": ["jumpthegun", "run", "--no-autorun"],
+    "python_client": ["jumpthegun-client", "--no-autorun"],
+    "python_client_pass_fds": ["jumpthegun-client", "--no-autorun", "--pass-fds"],
+}
+
+# For each tool: arguments for a typical run on the test project, and
+# arguments for running on a given file, or on stdin when given "-".
+tools: Dict[str, Dict[str, Any]] = {
+    "black": {
+        "args": ["--check", "."],
+        "file_args": lambda file_arg: ["--diff", file_arg],
+    },
+    "isort": {
+        "args": ["--check", "."],
+        "file_args": lambda file_arg: ["--diff", file_arg],
+    },
+    "flake8": {
+        "args": [],
+        "file_args": lambda file_arg: [file_arg],
+    },
+}
+
+
+def summarize(durations: List[float]) -> Dict[str, Any]:
+    return {
+        "n": len(durations),
+        "min": round(min(durations), 6),
+        "median": round(statistics.median(durations), 6),
+        "mean": round(statistics.mean(durations), 6),
+        "max": round(max(durations), 6),
+    }
+
+
+def time_runs(
+    cmd: List[str], proj_path: Path, repeat: int, input: Optional[bytes] = None
+) -> Dict[str, Any]:
+    durations = []
+    for _i in range(repeat):
+        start_time = time.perf_counter()
+        run(cmd, proj_path=proj_path, input=input)
+        durations.append(time.perf_counter() - start_time)
+    return summarize(durations)
+
+
+def time_concurrent_runs(
+    cmd: List[str], proj_path: Path, repeat: int, concurrency: int
+) -> Dict[str, Any]:
+    durations = []
+    for _i in range(repeat):
+        start_time = time.perf_counter()
+        procs = [
+            run(cmd, proj_path=proj_path, background=True) for _j in range(concurrency)
+        ]
+        for proc in procs:
+            assert isinstance(proc, subprocess.Popen)
+            proc.communicate()
+        durations.append(time.perf_counter() - start_time)
+    return summarize(durations)
+
+
+def wait_for_daemon(tool_name: str, proj_path: Path, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if (
+            run(["jumpthegun", "status", tool_name], proj_path=proj_path).returncode
+            == 0
+        ):
+            return
+        time.sleep(0.01)
+    raise Exception(f"Daemon for {tool_name} didn't start.")
+
+
+def stop_daemon(tool_name: str, proj_path: Path) -> None:
+    run(["jumpthegun", "stop", tool_name], proj_path=proj_path)
+
+
+def time_cold_starts(
+    tool_name: str, tool_args: List[str], proj_path: Path, repeat: int
+) -> Dict[str, Any]:
+    run_durations = []
+    ready_durations = []
+    for _i in range(repeat):
+        stop_daemon(tool_name, proj_path)
+        start_time = time.perf_counter()
+        run(["jumpthegun", "run", tool_name, *tool_args], proj_path=proj_path)
+        run_durations.append(time.perf_counter() - start_time)
+        wait_for_daemon(tool_name, proj_path)
+        ready_durations.append(time.perf_counter() - start_time)
+    stop_daemon(tool_name, proj_path)
+    return {
+        "run": summarize(run_durations),
+        "daemon_ready": summarize(ready_durations),
+    }
+
+
+def write_large_file(dir_path: Path, n_copies: int) -> Path:
+    """Write a large Python file with formatting and style issues."""
+    file_path = dir_path / "large.py"
+    file_path.write_text(
+        "".join(
+            f'import sys\nimport os\n\ndef foo_{i}() -> str:\n    return ("foo")\n'
+            for i in range(n_copies)
+        )
+    )
+    return file_path
+
+
+def benchmark_tool(
+    tool_name: str,
+    proj_path: Path,
+    large_file_path: Path,
+    repeat: int,
+    concurrency: int,
+    log: Callable[[str], None],
+) -> Dict[str, Any]:
+    tool = tools[tool_name]
+    scenarios: Dict[str, Dict[str, Any]] = {
+        "warm": {"args": tool["args"]},
+        "output_heavy": {"args": tool["file_args"](str(large_file_path))},
+        "stdin_heavy": {
+            "args": tool["file_args"]("-"),
+            "input": large_file_path.read_bytes(),
+        },
+    }
+
+    results: Dict[str, Any] = {}
+    log(f"{tool_name}: cold_start")
+    results["cold_start"] = {
+        "bash_client": time_cold_starts(tool_name, tool["args"], proj_path, repeat)
+    }
+
+    run(["jumpthegun", "start", tool_name], proj_path=proj_path, check=True)
+    try:
+        wait_for_daemon(tool_name, proj_path)
+        for scenario_name, scenario in scenarios.items():
+            log(f"{tool_name}: {scenario_name}")
+            results[scenario_name] = {}
+            for client_name, client_cmd in clients.items():
+                cmd = [*client_cmd, tool_name, *scenario["args"]]
+                # Don't measure the first run, which may populate caches.
+                run(cmd, proj_path=proj_path, input=scenario.get("input"))
+                results[scenario_name][client_name] = time_runs(
+                    cmd, proj_path, repeat, input=scenario.get("input")
+                )
+
+        log(f"{tool_name}: concurrent")
+        results["concurrent"] = {
+            client_name: time_concurrent_runs(
+                [*client_cmd, tool_name, *tool["args"]],
+                proj_path,
+                max(1, repeat // 2),
+                concurrency,
+            )
+            for client_name, client_cmd in clients.items()
+        }
+    finally:
+        stop_daemon(tool_name, proj_path)
+
+    return results
+
+
+def benchmark_client_overhead(
+    proj_path: Path,
+    repeat: int,
+    bash_client_baseline: Optional[Path],
+    log: Callable[[str], None],
+) -> Dict[str, Any]:
+    # This tool writes the given number of bytes, i.e. nothing.
+    tool_name = "__test_write_output"
+    overhead_clients = {
+        client_name: client_cmd
+        for client_name, client_cmd in clients.items()
+        if client_name != "direct"
+    }
+    if bash_client_baseline is not None:
+        overhead_clients["bash_client_baseline"] = [
+            "bash",
+            str(bash_client_baseline.resolve()),
+            "run",
+            "--no-autorun",
+        ]
+
+    log("client_overhead")
+    results: Dict[str, Any] = {}
+    run(["jumpthegun", "start", tool_name], proj_path=proj_path, check=True)
+    try:
+        wait_for_daemon(tool_name, proj_path)
+        for client_name, client_cmd in overhead_clients.items():
+            cmd = [*client_cmd, tool_name, "0"]
+            run(cmd, proj_path=proj_path, check=True)
+            results[client_name] = time_runs(cmd, proj_path, repeat)
+    finally:
+        stop_daemon(tool_name, proj_path)
+    return results
+
+
+def print_summary(results: Dict[str, Any]) -> None:
+    print("client_overhead:", file=sys.stderr)
+    for client_name, timings in results["client_overhead"].items():
+        print(
+            f"  {client_name:>37}: median {timings['median'] * 1000:9.1f} ms",
+            file=sys.stderr,
+        )
+    for tool_name, tool_results in results["tools"].items():
+        print(f"{tool_name}:", file=sys.stderr)
+        for scenario_name, scenario_results in tool_results.items():
+            for client_name, timings in scenario_results.items():
+                if scenario_name == "cold_start":
+                    timings = timings["run"]
+                print(
+                    f"  {scenario_name:>14} {client_name:>22}:"
+                    f" median {timings['median'] * 1000:9.1f} ms",
+                    file=sys.stderr,
+                )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--tools",
+        default=",".join(tools),
+        help="Comma-separated tool names (default: %(default)s).",
+    )
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--large-file-copies",
+        type=int,
+        default=2000,
+        help="Size of the file used for output- and stdin-heavy runs.",
+    )
+    parser.add_argument("--output", type=Path, help="Write JSON results to a file.")
+    parser.add_argument(
+        "--bash-client-baseline",
+        type=Path,
+        help="A jumpthegun.sh script to compare the Bash client's overhead with.",
+    )
+    args = parser.parse_args()
+
+    tool_names = args.tools.split(",") if args.tools else []
+    for tool_name in tool_names:
+        if tool_name not in tools:
+            parser.error(f"Unknown tool: {tool_name}")
+
+    def log(message: str) -> None:
+        print(message, file=sys.stderr, flush=True)
+
+    proj_path = setup_test_project("testproj_with_jumpthegun", with_jumpthegun=True)
+    results: Dict[str, Any] = {
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "concurrency": args.concurrency,
+        "tools": {},
+    }
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_dir_path = Path(temp_dir)
+        # Isolate from the user's config and daemons; these are passed through
+        # to the commands run.
+        (temp_dir_path / "config").mkdir()
+        os.environ["XDG_CONFIG_HOME"] = str(temp_dir_path / "config")
+        (temp_dir_path / "runtime").mkdir(mode=0o700)
+        os.environ["XDG_RUNTIME_DIR"] = str(temp_dir_path / "runtime")
+
+        results["client_overhead"] = benchmark_client_overhead(
+            proj_path, args.repeat, args.bash_client_baseline, log
+        )
+        large_file_path = write_large_file(temp_dir_path, args.large_file_copies)
+        for tool_name in tool_names:
+            results["tools"][tool_name] = benchmark_tool(
+                tool_name,
+                proj_path,
+                large_file_path,
+                args.repeat,
+                args.concurrency,
+                log,
+            )
+
+    results_json = json.dumps(results, indent=2)
+    if args.output is not None:
+        args.output.write_text(results_json + "\n")
+    print(results_json)
+    print_summary(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 #!/bin/bash
 set -eEu -o pipefail
+client_start_time="${EPOCHREALTIME:-}"
 
 function usage() {
   echo "Usage: $0 command tool_name ..."
@@ -10,6 +11,8 @@ function usage() {
   echo "start tool_name                      Start a daemon for a CLI tool."
   echo "stop tool_name                       Stop a daemon for a CLI tool."
   echo "restart tool_name                    Restart a daemon for a CLI tool."
+  echo "status tool_name                     Show the status of a CLI tool's daemon."
+  echo "stats tool_name [--prometheus]       Show statistics of a CLI tool's daemon."
   echo
 }
 
@@ -19,17 +22,21 @@ function err_exit() {
   exit 1
 }
 
-function get_service_runtime_dir() {
+# Set service_runtime_dir.  This avoids a sub-shell, as do other functions
+# used when running a tool, since forking takes a significant part of the
+# time taken to run a tool via a daemon.
+function find_service_runtime_dir() {
+  service_runtime_dir=""
   runtime_dir="${XDG_RUNTIME_DIR:-}"
   if [ -n "$runtime_dir" ]; then
-    echo -n "$runtime_dir/jumpthegun"
+    service_runtime_dir="$runtime_dir/jumpthegun"
   else
     temp_dir="${TMPDIR:-/tmp}"
     shopt -s nullglob
     service_runtime_dirs=("$temp_dir/jumpthegun-$USER"-??????)
     shopt -u nullglob
     if [[ ${#service_runtime_dirs[@]} -eq 1 ]]; then
-      echo -n "${service_runtime_dirs[0]}"
+      service_runtime_dir="${service_runtime_dirs[0]}"
     elif [[ ${#service_runtime_dirs[@]} -gt 1 ]]; then
       err_exit "Error: Multiple service runtime dirs found."
     fi
@@ -44,11 +51,48 @@ function hash_str() {
   fi
 }
 
+# Trace the phases of running a command, if requested via JUMPTHEGUN_TRACE;
+# see tracing.py.  This requires EPOCHREALTIME, i.e. Bash 5+.
+trace_file="${JUMPTHEGUN_TRACE:-}"
+if [[ -z "$client_start_time" ]]; then
+  trace_file=""
+fi
+trace_marks=()
+
+function trace_mark() {
+  if [[ -n "$trace_file" ]]; then
+    local timestamp="${2:-$EPOCHREALTIME}"
+    # Microseconds, removing the locale-dependent decimal separator.
+    trace_marks+=("$1" "${timestamp/[.,]/}")
+  fi
+}
+
+function write_trace() {
+  if [[ -z "$trace_file" ]]; then
+    return
+  fi
+  local common="\"cat\": \"jumpthegun\", \"pid\": $$, \"tid\": $$"
+  local events="{\"name\": \"process_name\", \"ph\": \"M\", $common, \"args\": {\"name\": \"jumpthegun\"}},"$'\n'
+  events+="{\"name\": \"${trace_marks[0]}\", \"ph\": \"i\", \"s\": \"p\", \"ts\": ${trace_marks[1]}, $common},"$'\n'
+  local i prev_ts ts
+  for (( i=2; i < ${#trace_marks[@]}; i+=2 )); do
+    prev_ts="${trace_marks[i-1]}"
+    ts="${trace_marks[i+1]}"
+    events+="{\"name\": \"${trace_marks[i]}\", \"ph\": \"X\", \"ts\": $prev_ts, \"dur\": $((ts - prev_ts)), $common},"$'\n'
+  done
+  # Whichever process creates the file writes the opening bracket.  Events
+  # are appended with a single write, so those of concurrently running
+  # processes aren't interleaved.
+  if ! ( set -C; printf '%s' "["$'\n'"$events" > "$trace_file" ) 2>/dev/null; then
+    printf '%s' "$events" >> "$trace_file"
+  fi
+}
+
 autorun=1
 case "${1:-}" in
 -h|--help)
   usage && exit 0 ;;
-start|stop|restart|version|--version)
+start|stop|restart|status|stats|version|--version)
   [[ "$2" =~ -h|--help ]] && usage && exit 0
   tool_name="$2"
 
@@ -102,15 +146,45 @@ run)
 esac
 
 # Find service runtime directory.
-service_runtime_dir="$(get_service_runtime_dir)"
+find_service_runtime_dir
 if [[ -z "$service_runtime_dir" ]]; then
   [[ autorun -eq 1 ]] && "${BASH_SOURCE[0]}" start "$tool_name" &>/dev/null &
   exec "$tool_name" "$@"
 fi
 
-# Calculate the isolated path for pid and port files.
-isolated_root="$(dirname "$(command -v -- "$tool_name")")"
-isolated_root_hash="$(hash_str "$isolated_root")"
+# Calculate the isolated path for pid and port files: a directory named by
+# a hash of the directory containing the tool.  The tool is found using the
+# "hash" builtin, which caches lookups in PATH.
+if [[ "$tool_name" != */* ]] && hash -- "$tool_name" 2>/dev/null; then
+  tool_path="${BASH_CMDS[$tool_name]}"
+else
+  tool_path="$(command -v -- "$tool_name")" || true
+fi
+isolated_root="${tool_path%/*}"
+if [[ "$tool_path" != */* ]]; then
+  isolated_root="."
+elif [[ -z "$isolated_root" ]]; then
+  isolated_root="/"
+fi
+# Hashing requires running other processes, so the hash is cached in a file
+# per tool name, along with the directory it is the hash of.
+lookup_cache_file="$service_runtime_dir/$tool_name.lookup"
+isolated_root_hash="" cached_root="" cached_hash=""
+if [[ "$tool_name" != */* && -f "$lookup_cache_file" ]]; then
+  { IFS= read -r cached_root && IFS= read -r cached_hash; } <"$lookup_cache_file" || true
+  if [[ "$cached_root" == "$isolated_root" && ${#cached_hash} -eq 8 ]]; then
+    isolated_root_hash="$cached_hash"
+  fi
+fi
+if [[ -z "$isolated_root_hash" ]]; then
+  isolated_root_hash="$(hash_str "$isolated_root")"
+  if [[ "$tool_name" != */* ]]; then
+    # Written with a single write, so that the file is either complete or
+    # rejected as invalid when read.
+    printf -v lookup_cache '%s\n%s\n' "$isolated_root" "$isolated_root_hash"
+    { printf '%s' "$lookup_cache" >"$lookup_cache_file"; } 2>/dev/null || true
+  fi
+fi
 isolated_path="$service_runtime_dir/$isolated_root_hash"
 
 # Check that port file exists.
@@ -123,7 +197,9 @@ fi
 IFS= read -r port <"$isolated_path/$tool_name.port"
 
 # Open TCP connection.
+trace_mark client_start "$client_start_time"
 exec 3<>"/dev/tcp/127.0.0.1/$port"
+trace_mark connect
 
 # Close TCP connection upon exit.
 function close_connection {
@@ -132,8 +208,16 @@ function close_connection {
 trap close_connection EXIT
 
 
-# Read companion process PID.
-read -r -u 3 pid
+# Read companion process PID, and the hash of the daemon's baseline env.
+read -r -u 3 pid daemon_env_hash
+trace_mark pid_received
+
+# If the daemon is too busy to handle this, run the tool directly.
+if [[ "$pid" == "busy" ]]; then
+  close_connection
+  trap - EXIT
+  exec "$tool_name" "$@"
+fi
 
 # Forward some signals.
 function forward_signal() {
@@ -143,26 +227,89 @@ for sig in INT TERM USR1 USR2; do
   trap "forward_signal $sig" "$sig"
 done
 
-# Send argv and cwd.
+# Send env vars as length-prefixed entries, which requires Bash 4.4+ for
+# checking which variables are exported.  This avoids running any processes
+# or writing temporary files.  If the daemon's baseline env is available,
+# only env vars which differ from it are sent.
+if (( BASH_VERSINFO[0] > 4 || (BASH_VERSINFO[0] == 4 && BASH_VERSINFO[1] >= 4) )); then
+  # Read the daemon's baseline env, if it is the one the daemon uses.
+  declare -A env_baseline=()
+  env_header="e"
+  env_baseline_file="$isolated_path/$tool_name.env"
+  if [[ -n "$daemon_env_hash" && -r "$env_baseline_file" ]]; then
+    {
+      if IFS= read -r -d '' file_hash && [[ "$file_hash" == "$daemon_env_hash" ]]; then
+        env_header="e$daemon_env_hash"
+        while IFS= read -r -d '' entry; do
+          env_baseline["${entry%%=*}"]="${entry#*=}"
+        done
+      fi
+    } <"$env_baseline_file"
+  fi
+
+  # List the names of all variables, without running a sub-shell.
+  all_names_expr=""
+  for prefix in {A..Z} {a..z} _; do
+    all_names_expr+=" \"\${!$prefix@}\""
+  done
+  eval "all_names=($all_names_expr)"
+
+  env_entries=()
+  declare -A exported_names=()
+  for name in "${all_names[@]}"; do
+    [[ "$name" == _ || ! -v "$name" ]] && continue
+    attrs="${!name@a}"
+    [[ "$attrs" != *x* || "$attrs" == *[aA]* ]] && continue
+    exported_names["$name"]=1
+    if [[ "$env_header" == e || "${env_baseline[$name]-}" != "${!name}" || -z "${env_baseline[$name]+x}" ]]; then
+      env_entries+=("$name=${!name}")
+    fi
+  done
+  # Env vars in the baseline which aren't set here are sent without values,
+  # to delete them.  Names which aren't valid in Bash are left as they are.
+  for name in "${!env_baseline[@]}"; do
+    if [[ -z "${exported_names[$name]-}" && "$name" =~ ^[A-Za-z_][A-Za-z0-9_]*$ ]]; then
+      env_entries+=("$name")
+    fi
+  done
+else
+  env_header=""
+fi
+
+# Send the tool name, for daemons serving several tools, then argv, cwd and
+# env vars.  No protocol version is requested, so the daemon will use version
+# 1 of the protocol, which is line-based and simple to handle in Bash.
+# Lengths are in bytes, so they are calculated in the C locale.
 oLang="${LANG-}" oLcAll="${LC_ALL-}"
 LANG=C LC_ALL=C
 # Add an x in front to avoid special-casing having zero arguments.
-argv_str=$(printf ' %q' x "$@")
+printf -v argv_str ' %q' x "$@"
 # Remove the leading " x ".
 argv_str="${argv_str:3}"
-printf '%d\n%s%d\n%s' "${#argv_str}" "$argv_str" "${#PWD}" "$PWD" >&3
-LANG="$oLang" LC_ALL="$oLcAll"
-
-# Send env vars.
-x="$(mktemp)"
-env -0 > "$x" 2>/dev/null
-if [[ $OSTYPE == "darwin"* ]]; then
-  stat -f %z "$x" >&3
+if [[ -n "$env_header" ]]; then
+  request="t${tool_name##*/}"$'\n'"$env_header"$'\n'"${#argv_str}"$'\n'"$argv_str${#PWD}"$'\n'"$PWD${#env_entries[@]}"$'\n'
+  for entry in "${env_entries[@]}"; do
+    request+="${#entry}"$'\n'"$entry"
+  done
+  # Send the request with a single write, avoiding delays due to Nagle's
+  # algorithm.
+  printf '%s' "$request" >&3
+  LANG="$oLang" LC_ALL="$oLcAll"
 else
-  stat -c %s "$x" >&3
+  printf 't%s\n%d\n%s%d\n%s' "${tool_name##*/}" "${#argv_str}" "$argv_str" "${#PWD}" "$PWD" >&3
+  LANG="$oLang" LC_ALL="$oLcAll"
+
+  x="$(mktemp)"
+  env -0 > "$x" 2>/dev/null
+  if [[ $OSTYPE == "darwin"* ]]; then
+    stat -f %z "$x" >&3
+  else
+    stat -c %s "$x" >&3
+  fi
+  cat "$x" >&3
+  rm "$x"
 fi
-cat "$x" >&3
-rm "$x"
+trace_mark request_sent
 
 
 # Read stdout and stderr from connection, line by line, and echo them.
@@ -190,13 +337,24 @@ while read -r -u 3 line; do
       echo -n "$line" >&2
       ;;
     3*)
-      # stdin
-      read -r line2
-      echo "$line2" >&3
+      # stdin: Reply with the length of a line of input followed by the line,
+      # with a length of zero signaling EOF.
+      if read -r line2; then
+        line2+=$'\n'
+      fi
+      LC_ALL=C
+      # Send the reply with a single write: printf writes each part
+      # separately, and over TCP, Nagle's algorithm would then delay the
+      # second part until the first is acknowledged.
+      printf -v reply '%d\n%s' "${#line2}" "$line2"
+      printf '%s' "$reply" >&3
+      LC_ALL="$oLcAll"
       ;;
     rc=*)
       # exit
       rc="${line:3}"
+      trace_mark exit_code_received
+      write_trace
       exit "$rc"
       ;;
     *)
@@ -0,0 +1,351 @@
+"""Running tools via their daemons from Python code.
+
+This is for Python programs which run many tools, e.g. pre-commit, tox or
+nox, so that they needn't run a client process for each tool:
+
+    from jumpthegun.api import BatchJob, run_batch, run_tool, run_tools
+
+    returncode, stdout, stderr = run_tool("flake8", ["src/"])
+    results = run_tools([("black", ["--check", "."]), ("isort", ["--check", "."])])
+    results = run_batch("flake8", [BatchJob(["a.py"]), BatchJob(["b.py"])])
+
+Tools' outputs are captured and returned, and input may be given, as with
+subprocess.run().  Tools without a running daemon are run directly, and
+unless autorun is disabled, a daemon is started for them in the background.
+
+Every run requires a connection of its own, since each is handled by a
+sub-process the daemon forks for it.  What is reused between runs are the
+lookups of where each tool's daemon is and of the daemon's baseline env, so
+that only env vars which differ from it are sent.  run_batch() runs a tool
+several times via a single connection, which the daemon's sub-process uses
+to run them all, each in a process of its own.
+"""
+
+import os
+import socket
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from .client import (
+    OutputRelay,
+    connect,
+    get_daemon_dir,
+    read_env_baseline,
+    read_pid,
+    send_batch_request,
+    send_request,
+)
+from .protocol import EXIT, FRAME_HEADER, I32, STDERR, STDOUT, U32
+from .utils import find_executable
+
+__all__ = [
+    "BatchJob",
+    "ToolResult",
+    "ToolRunner",
+    "run_batch",
+    "run_tool",
+    "run_tools",
+]
+
+
+class ToolResult(NamedTuple):
+    """The exit code and outputs of running a tool."""
+
+    returncode: int
+    stdout: bytes
+    stderr: bytes
+
+
+class BatchJob(NamedTuple):
+    """The args and cwd of a run of a tool in a batch."""
+
+    args: Sequence[str]
+    cwd: Optional[str] = None
+
+
+class ToolRunner:
+    """Run tools via their daemons, reusing lookups between runs.
+
+    Runs may be done concurrently from multiple threads.
+    """
+
+    def __init__(self, autorun: bool = True) -> None:
+        self.autorun = autorun
+        self._daemon_dirs: Dict[Tuple[str, str], str] = {}
+        self._env_baselines: Dict[Tuple[str, str, bytes], Dict[bytes, bytes]] = {}
+        self._started: Set[str] = set()
+
+    def run_tool(
+        self,
+        tool_name: str,
+        args: Sequence[str] = (),
+        cwd: Optional[str] = None,
+        env: Optional[Mapping[str, str]] = None,
+        input: Optional[bytes] = None,
+    ) -> ToolResult:
+        """Run a tool, returning its exit code and outputs.
+
+        The tool is run in this process's cwd and with its env vars, unless
+        cwd or env are given.  Its stdin is the given input, or empty.
+        """
+        if cwd is None:
+            cwd = os.getcwd()
+        connection = self._connect(tool_name, cwd, env)
+        if connection is None:
+            return self._run_directly(tool_name, args, cwd, env, input)
+        sock, env_baseline_hash, env_baseline = connection
+        with sock:
+            send_request(
+                sock,
+                args,
+                cwd=cwd,
+                env=_encode_env(env),
+                env_baseline_hash=env_baseline_hash,
+                env_baseline=env_baseline,
+                tool_name=tool_name,
+            )
+            relay = OutputRelay(sock, capture=True, input=input or b"")
+            returncode = relay.relay()
+        return ToolResult(returncode, bytes(relay.stdout), bytes(relay.stderr))
+
+    def run_batch(
+        self,
+        tool_name: str,
+        jobs: Sequence[Tuple[Sequence[str], Optional[str]]],
+        env: Optional[Mapping[str, str]] = None,
+        max_parallel: Optional[int] = None,
+    ) -> List[ToolResult]:
+        """Run a tool several times via a single connection to its daemon.
+
+        Each run is given as a BatchJob, with its args and cwd.  Runs get no
+        input.  At most max_parallel runs are done at once, by default as
+        many as the daemon allows.  Returns the results in order.
+        """
+        cwd = os.getcwd()
+        connection = self._connect(tool_name, cwd, env)
+        if connection is None:
+            return self.run_tools(
+                [(tool_name, args) for args, _cwd in jobs],
+                env=env,
+                max_workers=max_parallel,
+                cwds=[cwd if job_cwd is None else job_cwd for _args, job_cwd in jobs],
+            )
+        sock, env_baseline_hash, env_baseline = connection
+        with sock:
+            send_batch_request(
+                sock,
+                jobs,
+                env=_encode_env(env),
+                max_parallel=max_parallel or 0,
+                env_baseline_hash=env_baseline_hash,
+                env_baseline=env_baseline,
+                tool_name=tool_name,
+            )
+            return _relay_batch(sock, len(jobs))
+
+    def run_tools(
+        self,
+        runs: Iterable[Tuple[str, Sequence[str]]],
+        cwd: Optional[str] = None,
+        env: Optional[Mapping[str, str]] = None,
+        max_workers: Optional[int] = None,
+        cwds: Optional[Sequence[str]] = None,
+    ) -> List[ToolResult]:
+        """Run tools concurrently, returning their results in order.
+
+        Each run is given as a tool name and its arguments.  At most
+        max_workers runs are done at once, by default the number of CPUs.
+        Runs are done in cwd, or each in the respective item of cwds.
+        """
+        runs = list(runs)
+        if cwds is None:
+            cwds = [cwd or os.getcwd()] * len(runs)
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(self.run_tool, tool_name, args, run_cwd, env)
+                for (tool_name, args), run_cwd in zip(runs, cwds)
+            ]
+            return [future.result() for future in futures]
+
+    def _connect(
+        self, tool_name: str, cwd: str, env: Optional[Mapping[str, str]]
+    ) -> Optional[Tuple[socket.socket, Optional[bytes], Optional[Dict[bytes, bytes]]]]:
+        """Connect to a tool's daemon and read the pid.
+
+        Returns the connection and the daemon's baseline env and its hash,
+        or None if the tool should be run directly.
+        """
+        path = (os.environ if env is None else env).get("PATH", "")
+        daemon_dir = self._get_daemon_dir(tool_name, path)
+        sock = None if daemon_dir is None else connect(daemon_dir, tool_name)
+        if sock is None:
+            if self.autorun:
+                self._start_daemon(tool_name, cwd, env)
+            return None
+        assert daemon_dir is not None
+
+        pid_line = read_pid(sock)
+        if pid_line is None:
+            sock.close()
+            return None
+        _pid, env_baseline_hash = pid_line
+        env_baseline = None
+        if env_baseline_hash is not None:
+            env_baseline = self._get_env_baseline(
+                daemon_dir, tool_name, env_baseline_hash
+            )
+        return sock, env_baseline_hash, env_baseline
+
+    def _get_daemon_dir(self, tool_name: str, path: str) -> Optional[str]:
+        # Not finding it isn't cached, since e.g. the service runtime dir
+        # is created when the first daemon is started.
+        key = (tool_name, path)
+        daemon_dir = self._daemon_dirs.get(key)
+        if daemon_dir is None:
+            daemon_dir = get_daemon_dir(tool_name, path)
+            if daemon_dir is not None:
+                self._daemon_dirs[key] = daemon_dir
+        return daemon_dir
+
+    def _get_env_baseline(
+        self, daemon_dir: str, tool_name: str, env_baseline_hash: bytes
+    ) -> Optional[Dict[bytes, bytes]]:
+        # The baseline is identified by its hash, so it may be cached.
+        key = (daemon_dir, tool_name, env_baseline_hash)
+        env_baseline = self._env_baselines.get(key)
+        if env_baseline is None:
+            env_baseline = read_env_baseline(daemon_dir, tool_name, env_baseline_hash)
+            if env_baseline is not None:
+                self._env_baselines[key] = env_baseline
+        return env_baseline
+
+    def _start_daemon(
+        self, tool_name: str, cwd: str, env: Optional[Mapping[str, str]]
+    ) -> None:
+        """Start a daemon for a tool in the background, once per tool."""
+        if tool_name in self._started:
+            return
+        self._started.add(tool_name)
+        bash_client_path = os.path.join(os.path.dirname(sys.executable), "jumpthegun")
+        if not os.access(bash_client_path, os.X_OK):
+            bash_client_path = find_executable("jumpthegun") or ""
+            if not bash_client_path:
+                return
+        subprocess.Popen(
+            [bash_client_path, "start", tool_name],
+            cwd=cwd,
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+
+    @staticmethod
+    def _run_directly(
+        tool_name: str,
+        args: Sequence[str],
+        cwd: str,
+        env: Optional[Mapping[str, str]],
+        input: Optional[bytes],
+    ) -> ToolResult:
+        proc = subprocess.run(
+            [tool_name, *args],
+            cwd=cwd,
+            env=env,
+            input=input or b"",
+            capture_output=True,
+        )
+        return ToolResult(proc.returncode, proc.stdout, proc.stderr)
+
+
+def _encode_env(env: Optional[Mapping[str, str]]) -> Optional[Dict[bytes, bytes]]:
+    if env is None:
+        return None
+    return {os.fsencode(name): os.fsencode(value) for name, value in env.items()}
+
+
+def _relay_batch(sock: socket.socket, n_jobs: int) -> List[ToolResult]:
+    """Collect the outputs and exit codes of the runs of a batch."""
+    outputs = {STDOUT: [bytearray() for _i in range(n_jobs)]}
+    outputs[STDERR] = [bytearray() for _i in range(n_jobs)]
+    exit_codes: List[Optional[int]] = [None] * n_jobs
+    n_remaining = n_jobs
+    with sock.makefile("rb") as rfile:
+        if rfile.readline() != b"v2\n":
+            raise Exception("Error: Unexpected reply from jumpthegun daemon.")
+        while n_remaining:
+            header = rfile.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                break
+            channel, length = FRAME_HEADER.unpack(header)
+            payload = rfile.read(length)
+            if len(payload) < length:
+                break
+            (index,) = U32.unpack_from(payload)
+            if channel == EXIT:
+                (exit_codes[index],) = I32.unpack_from(payload, U32.size)
+                n_remaining -= 1
+            elif channel in outputs:
+                outputs[channel][index] += payload[U32.size :]
+
+    results = []
+    for index, exit_code in enumerate(exit_codes):
+        stderr = outputs[STDERR][index]
+        if exit_code is None:
+            exit_code = 1
+            stderr += b"Error: Connection to jumpthegun daemon lost.\n"
+        results.append(
+            ToolResult(exit_code, bytes(outputs[STDOUT][index]), bytes(stderr))
+        )
+    return results
+
+
+_default_runner = ToolRunner()
+
+
+def run_tool(
+    tool_name: str,
+    args: Sequence[str] = (),
+    cwd: Optional[str] = None,
+    env: Optional[Mapping[str, str]] = None,
+    input: Optional[bytes] = None,
+) -> ToolResult:
+    """Run a tool, returning its exit code and outputs; see ToolRunner."""
+    return _default_runner.run_tool(tool_name, args, cwd=cwd, env=env, input=input)
+
+
+def run_tools(
+    runs: Iterable[Tuple[str, Sequence[str]]],
+    cwd: Optional[str] = None,
+    env: Optional[Mapping[str, str]] = None,
+    max_workers: Optional[int] = None,
+) -> List[ToolResult]:
+    """Run tools concurrently, returning their results; see ToolRunner."""
+    return _default_runner.run_tools(runs, cwd=cwd, env=env, max_workers=max_workers)
+
+
+def run_batch(
+    tool_name: str,
+    jobs: Sequence[Tuple[Sequence[str], Optional[str]]],
+    env: Optional[Mapping[str, str]] = None,
+    max_parallel: Optional[int] = None,
+) -> List[ToolResult]:
+    """Run a tool several times via a single connection; see ToolRunner."""
+    return _default_runner.run_batch(
+        tool_name, jobs, env=env, max_parallel=max_parallel
+    )
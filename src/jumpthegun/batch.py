@@ -0,0 +1,169 @@
+"""Running a batch of commands sent over a single connection.
+
+The daemon's sub-process handling the connection forks a process per
+command, running up to a limit of them at once.  Each command's process
+writes its outputs and exit code as protocol version 2 frames to a socket
+pair, and the sub-process relays them to the client, prefixed by the
+command's index in the batch (see protocol.py).
+"""
+
+import os
+import signal
+import socket
+import sys
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .event_loop import EventLoop
+from .protocol import EXIT, FRAME_HEADER, I32, encode_batch_frame
+
+__all__ = [
+    "BatchRunner",
+]
+
+
+class _Job:
+    def __init__(self, index: int, pid: int, sock: socket.socket) -> None:
+        self.index = index
+        self.pid = pid
+        self.sock = sock
+        self.buf = bytearray()
+        self.exit_code_sent = False
+
+
+class BatchRunner:
+    """Run a batch's commands in forked processes, relaying their outputs."""
+
+    recv_size = 256 * 1024
+
+    def __init__(
+        self,
+        conn: socket.socket,
+        jobs: Sequence[Tuple[bytes, bytes]],
+        max_parallel: int,
+    ) -> None:
+        self._conn = conn
+        self._jobs = jobs
+        self._max_parallel = max(1, max_parallel)
+        self._next_index = 0
+        self._running: Dict[int, _Job] = {}
+        self._exited_pids: List[int] = []
+        self._loop = EventLoop()
+
+    def run(self) -> Optional[Tuple[socket.socket, bytes, bytes]]:
+        """Run the commands.
+
+        In the commands' forked processes, returns the socket to write
+        frames to, and the command's argv and cwd.  In this process, returns
+        None once all commands are done.
+        """
+        try:
+            while self._next_index < len(self._jobs) and len(self._running) < (
+                self._max_parallel
+            ):
+                result = self._start_next()
+                if result is not None:
+                    return result
+            if not self._running:
+                return None
+            return self._loop.run()
+        finally:
+            self._loop.close()
+
+    def _start_next(self) -> Optional[Tuple[socket.socket, bytes, bytes]]:
+        index = self._next_index
+        self._next_index += 1
+        sock, child_sock = socket.socketpair()
+        pid = os.fork()
+        if pid == 0:
+            sock.close()
+            for job in self._running.values():
+                job.sock.close()
+            self._conn.close()
+            argv_bytes, cwd_bytes = self._jobs[index]
+            return child_sock, argv_bytes, cwd_bytes
+        child_sock.close()
+        sock.setblocking(False)
+        job = _Job(index, pid, sock)
+        self._running[index] = job
+        self._loop.add_reader(sock, lambda: self._relay(job))
+        return None
+
+    def _relay(self, job: _Job) -> None:
+        try:
+            data = job.sock.recv(self.recv_size)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        job.buf += data
+        out = bytearray()
+        pos = 0
+        while len(job.buf) - pos >= FRAME_HEADER.size:
+            channel, length = FRAME_HEADER.unpack_from(job.buf, pos)
+            payload_start = pos + FRAME_HEADER.size
+            if len(job.buf) - payload_start < length:
+                break
+            pos = payload_start + length
+            out += encode_batch_frame(
+                channel, job.index, memoryview(job.buf)[payload_start:pos]
+            )
+            if channel == EXIT:
+                job.exit_code_sent = True
+        del job.buf[:pos]
+        if not data:
+            self._job_done(job, out)
+        elif out:
+            self._send(out)
+
+    def _job_done(self, job: _Job, out: bytearray) -> None:
+        self._loop.remove_reader(job.sock)
+        job.sock.close()
+        del self._running[job.index]
+        if job.exit_code_sent:
+            # The process may still be finishing up, so it is reaped later.
+            self._exited_pids.append(job.pid)
+        else:
+            # The process exited without sending its exit code, e.g. since it
+            # was killed, so send the exit code it exited with.
+            _pid, status = os.waitpid(job.pid, 0)
+            exit_code = (
+                -os.WTERMSIG(status)
+                if os.WIFSIGNALED(status)
+                else os.WEXITSTATUS(status) or 1
+            )
+            out += encode_batch_frame(EXIT, job.index, I32.pack(exit_code))
+        self._send(out)
+
+        if self._next_index < len(self._jobs):
+            result = self._start_next()
+            if result is not None:
+                self._loop.stop(result)
+                return
+        if not self._running:
+            for pid in self._exited_pids:
+                os.waitpid(pid, 0)
+            self._loop.stop(None)
+
+    def _send(self, data: bytearray) -> None:
+        try:
+            self._conn.sendall(data)
+        except OSError:
+            # The client is gone, so stop the commands and exit quietly.
+            self._stop_jobs()
+            self._conn.close()
+            sys.exit(0)
+
+    def _stop_jobs(self) -> None:
+        for job in self._running.values():
+            # Closing the socket first means the process can't block writing
+            # outputs while handling the signal.
+            self._loop.remove_reader(job.sock)
+            job.sock.close()
+            try:
+                os.kill(job.pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in [*(job.pid for job in self._running.values()), *self._exited_pids]:
+            os.waitpid(pid, 0)
+        self._running.clear()
+        self._exited_pids.clear()
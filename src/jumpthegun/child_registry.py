@@ -0,0 +1,215 @@
+import json
+import os
+import select
+import signal
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional
+
+__all__ = [
+    "ChildInfo",
+    "ChildRegistry",
+]
+
+
+@dataclass
+class ChildInfo:
+    """Information about a sub-process of the daemon."""
+
+    pid: int
+    start_time: float
+    args: Optional[List[str]] = None
+    exit_code: Optional[int] = None
+    end_time: Optional[float] = None
+    # Seconds taken by os.fork() in the daemon process.
+    fork_seconds: Optional[float] = None
+    # Reported by the sub-process: seconds from accepting the connection until
+    # the first output and until sending the exit code, the number of bytes
+    # relayed via the connection per channel, and if requested, its memory
+    # usage by kind ("rss", "pss", "shared" and "private").
+    time_to_first_output: Optional[float] = None
+    time_to_exit: Optional[float] = None
+    relayed_bytes: Optional[Dict[str, int]] = None
+    memory_bytes: Optional[Dict[str, int]] = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+
+def _ignore_signal(signum: int, frame: Any) -> None:
+    pass
+
+
+def _exit_code_from_status(status: int) -> int:
+    """Like os.waitstatus_to_exitcode(), which requires Python 3.9+."""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+class ChildRegistry:
+    """Keep track of the daemon's sub-processes, reaping them as they exit.
+
+    Exits are signaled by SIGCHLD, upon which Python writes to a pipe (see
+    signal.set_wakeup_fd()).  The daemon waits for the pipe to be readable
+    along with its sockets, and then calls .reap(), which only does work
+    for sub-processes which have exited.
+
+    Sub-processes report the arguments they are run with and statistics
+    about their run via another pipe, using .report_args() and
+    .report_stats().  Information about exited sub-processes is kept
+    for the most recent .history_size of them.
+    """
+
+    history_size = 1000
+    _report_fields = (
+        "args",
+        "time_to_first_output",
+        "time_to_exit",
+        "relayed_bytes",
+        "memory_bytes",
+    )
+
+    def __init__(self) -> None:
+        self.running: Dict[int, ChildInfo] = {}
+        self.finished: Deque[ChildInfo] = deque(maxlen=self.history_size)
+        self.n_started = 0
+        self._reports_buf = bytearray()
+
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self._reports_r, self._reports_w = os.pipe()
+        for fd in (self._wakeup_r, self._wakeup_w, self._reports_r):
+            os.set_blocking(fd, False)
+
+        # A handler must be set for the wakeup fd to be written to.
+        self._prev_sigchld_handler = signal.signal(signal.SIGCHLD, _ignore_signal)
+        self._prev_wakeup_fd = signal.set_wakeup_fd(self._wakeup_w)
+
+    def filenos(self) -> List[int]:
+        """File descriptors which become readable when .reap() has work."""
+        return [self._wakeup_r, self._reports_r]
+
+    def add(self, pid: int, fork_seconds: Optional[float] = None) -> ChildInfo:
+        """Register a newly forked sub-process."""
+        info = ChildInfo(pid=pid, start_time=time.time(), fork_seconds=fork_seconds)
+        self.running[pid] = info
+        self.n_started += 1
+        return info
+
+    def reap(self) -> List[ChildInfo]:
+        """Reap exited sub-processes and read their reports.
+
+        Returns the information of the sub-processes which exited.
+        """
+        try:
+            while os.read(self._wakeup_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        exited: Dict[int, ChildInfo] = {}
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            info = self.running.pop(pid, None)
+            if info is None:
+                continue
+            info.exit_code = _exit_code_from_status(status)
+            info.end_time = time.time()
+            self.finished.append(info)
+            exited[pid] = info
+
+        # Sub-processes report before exiting, so this is done after reaping
+        # to also get the reports of those which just exited.
+        self._read_reports(exited)
+
+        return list(exited.values())
+
+    def report_args(self, args: List[str]) -> None:
+        """Report a sub-process's arguments to the daemon.
+
+        This is called in the sub-process, after .after_fork_in_child().
+        """
+        # Writes of up to PIPE_BUF bytes to a pipe are atomic, so reports from
+        # concurrently running sub-processes aren't interleaved.
+        args = list(args)
+        report = self._encode_report({"args": args})
+        while len(report) > select.PIPE_BUF and args:
+            args.pop()
+            report = self._encode_report({"args": args})
+        self._write_report(report)
+
+    def report_stats(
+        self,
+        time_to_first_output: Optional[float],
+        time_to_exit: float,
+        relayed_bytes: Dict[str, int],
+        memory_bytes: Optional[Dict[str, int]] = None,
+    ) -> None:
+        """Report statistics about a sub-process's run to the daemon.
+
+        This is called in the sub-process, after .after_fork_in_child().
+        """
+        self._write_report(
+            self._encode_report(
+                {
+                    "time_to_first_output": time_to_first_output,
+                    "time_to_exit": time_to_exit,
+                    "relayed_bytes": relayed_bytes,
+                    "memory_bytes": memory_bytes,
+                }
+            )
+        )
+
+    def after_fork_in_child(self) -> None:
+        """Stop tracking sub-processes, in a forked sub-process."""
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, self._prev_sigchld_handler)
+        for fd in (self._wakeup_r, self._wakeup_w, self._reports_r):
+            os.close(fd)
+
+    def close(self) -> None:
+        """Stop tracking sub-processes, in the daemon process."""
+        signal.set_wakeup_fd(self._prev_wakeup_fd)
+        signal.signal(signal.SIGCHLD, self._prev_sigchld_handler)
+        for fd in (self._wakeup_r, self._wakeup_w, self._reports_r, self._reports_w):
+            os.close(fd)
+
+    @staticmethod
+    def _encode_report(fields: Dict[str, Any]) -> bytes:
+        return json.dumps([os.getpid(), fields]).encode() + b"\n"
+
+    def _write_report(self, report: bytes) -> None:
+        try:
+            os.write(self._reports_w, report)
+        except OSError:
+            pass
+
+    def _read_reports(self, exited: Dict[int, ChildInfo]) -> None:
+        try:
+            while True:
+                data = os.read(self._reports_r, 65536)
+                if not data:
+                    break
+                self._reports_buf += data
+        except BlockingIOError:
+            pass
+        end = self._reports_buf.rfind(b"\n") + 1
+        lines = self._reports_buf[:end].splitlines()
+        del self._reports_buf[:end]
+        for line in lines:
+            pid, fields = json.loads(line)
+            info = self.running.get(pid) or exited.get(pid)
+            if info is None:
+                continue
+            for name in self._report_fields:
+                if name in fields:
+                    setattr(info, name, fields[name])
@@ -0,0 +1,608 @@
+"""A JumpTheGun client, written in Python.
+
+This is an alternative to the `jumpthegun run` command implemented in
+Bash.  It supports connecting to daemons via Unix domain sockets, avoiding
+the overhead of TCP and issues caused by firewalls, VPNs etc.
+
+With --pass-fds, when connected via a Unix domain socket, this passes its
+stdin, stdout and stderr to the daemon, so that the command reads and writes
+them directly instead of its input and output being relayed.  Besides being
+faster, this lets tools detect when they are writing to a terminal, e.g. for
+coloring their output.
+
+If no daemon is running for the tool, this falls back to running the Bash
+client, which takes care of starting a daemon and running the tool directly.
+If the daemon is too busy to handle the connection, this runs the tool
+directly.
+
+This module is run for every invocation of a tool, so it deliberately
+imports as little as possible.
+"""
+
+import hashlib
+import os
+import select
+import shlex
+import signal
+import socket
+import sys
+from typing import Dict, List, Mapping, NoReturn, Optional, Sequence, Tuple
+
+from .protocol import (
+    BUSY,
+    EXIT,
+    FRAME_HEADER,
+    I32,
+    PROTOCOL_VERSION,
+    STDERR,
+    STDIN,
+    STDOUT,
+    U32,
+    encode_batch_jobs,
+    encode_env_entries,
+    send_fds,
+)
+from .tracing import TRACE_ENV_VAR, Trace
+from .utils import find_executable
+
+__all__ = [
+    "main",
+]
+
+
+def usage() -> str:
+    return f"Usage: {os.path.basename(sys.argv[0])} [--no-autorun] [--pass-fds] tool_name [arg ...]"
+
+
+def get_service_runtime_dir() -> Optional[str]:
+    """Find the service runtime directory, without creating it."""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "jumpthegun")
+
+    temp_dir = os.environ.get("TMPDIR") or "/tmp"
+    prefix = f"jumpthegun-{os.getenv('USER')}-"
+    try:
+        names = os.listdir(temp_dir)
+    except OSError:
+        return None
+    service_runtime_dirs = [
+        name
+        for name in names
+        if name.startswith(prefix) and len(name) == len(prefix) + 6
+    ]
+    if len(service_runtime_dirs) != 1:
+        return None
+    return os.path.join(temp_dir, service_runtime_dirs[0])
+
+
+def get_isolated_path(tool_path: str) -> Optional[str]:
+    """Find the directory of a tool's daemon files."""
+    service_runtime_dir = get_service_runtime_dir()
+    if service_runtime_dir is None:
+        return None
+    isolation_hash = hashlib.sha256(
+        os.fsencode(os.path.dirname(tool_path))
+    ).hexdigest()[:8]
+    return os.path.join(service_runtime_dir, isolation_hash)
+
+
+def get_daemon_dir(tool_name: str, path: Optional[str] = None) -> Optional[str]:
+    """Find the directory of a tool's daemon files.
+
+    If path is given, the tool is searched for there instead of in PATH.
+    """
+    tool_path = find_executable(tool_name, path)
+    if tool_path is None:
+        return None
+    return get_isolated_path(tool_path)
+
+
+def connect(isolated_path: str, tool_name: str) -> Optional[socket.socket]:
+    """Connect to a tool's daemon, preferring a Unix domain socket."""
+    if hasattr(socket, "AF_UNIX"):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(os.path.join(isolated_path, f"{tool_name}.sock"))
+        except OSError:
+            sock.close()
+        else:
+            return sock
+
+    try:
+        with open(os.path.join(isolated_path, f"{tool_name}.port"), "rb") as f:
+            port = int(f.readline())
+    except (OSError, ValueError):
+        return None
+    try:
+        sock = socket.create_connection(("127.0.0.1", port))
+    except OSError:
+        return None
+    # Send small messages, e.g. input, immediately.
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def read_env_baseline(
+    isolated_path: str, tool_name: str, env_baseline_hash: bytes
+) -> Optional[Dict[bytes, bytes]]:
+    """Read a daemon's baseline env, if it has the given hash."""
+    try:
+        with open(os.path.join(isolated_path, f"{tool_name}.env"), "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    file_hash, *entries = data.split(b"\0")
+    if file_hash != env_baseline_hash:
+        return None
+    return dict(entry.split(b"=", 1) for entry in entries if b"=" in entry)
+
+
+def fall_back(tool_name: str, args: List[str], autorun: bool) -> NoReturn:
+    """Run the tool via the Bash client, or directly if that isn't found."""
+    bash_client_path = os.path.join(
+        os.path.dirname(os.path.abspath(sys.argv[0])), "jumpthegun"
+    )
+    if not os.access(bash_client_path, os.X_OK):
+        run_directly(tool_name, args)
+    options = [] if autorun else ["--no-autorun"]
+    os.execv(bash_client_path, [bash_client_path, "run", *options, tool_name, *args])
+
+
+def run_directly(tool_name: str, args: List[str]) -> NoReturn:
+    """Run the tool directly, without a daemon."""
+    os.execvp(tool_name, [tool_name, *args])
+
+
+def read_pid(sock: socket.socket) -> Optional[Tuple[int, Optional[bytes]]]:
+    """Read the pid of the daemon's process handling the connection.
+
+    Returns the pid and the hash of the daemon's baseline env, if sent, or
+    None if the daemon is too busy to handle the connection.
+    """
+    line = sock.makefile("rb", 0).readline()
+    if line == BUSY:
+        return None
+    pid, *env_baseline_hash = line.split()
+    return int(pid), (env_baseline_hash[0] if env_baseline_hash else None)
+
+
+def encode_env_delta(
+    env_baseline: Dict[bytes, bytes], env: Optional[Mapping[bytes, bytes]] = None
+) -> bytes:
+    """Encode the env vars which differ from a daemon's baseline env.
+
+    The env vars are those of this process, unless env is given.
+    """
+    if env is None:
+        env = os.environb
+    entries = [
+        b"%b=%b" % (name, value)
+        for name, value in env.items()
+        if env_baseline.get(name) != value
+    ]
+    entries.extend(name for name in env_baseline if name not in env)
+    return encode_env_entries(entries)
+
+
+def run(
+    sock: socket.socket,
+    pid: int,
+    args: List[str],
+    pass_fds: bool = False,
+    trace: Optional[Trace] = None,
+    env_baseline_hash: Optional[bytes] = None,
+    env_baseline: Optional[Dict[bytes, bytes]] = None,
+    tool_name: Optional[str] = None,
+) -> int:
+    """Run a command via a connection to a daemon, returning its exit code.
+
+    The pid must have been read via read_pid() beforehand.
+
+    If pass_fds is true and the connection is via a Unix domain socket, the
+    command will use this process's stdin, stdout and stderr directly.
+
+    If the daemon's baseline env is given, only env vars which differ from
+    it are sent.
+
+    If a tool name is given, the daemon runs that tool, if it serves several.
+    """
+
+    # Forward some signals.
+    def forward_signal(signum, frame):
+        os.kill(pid, signum)
+
+    for signum in [signal.SIGINT, signal.SIGTERM, signal.SIGUSR1, signal.SIGUSR2]:
+        signal.signal(signum, forward_signal)
+
+    send_request(
+        sock,
+        args,
+        pass_fds=pass_fds,
+        env_baseline_hash=env_baseline_hash,
+        env_baseline=env_baseline,
+        tool_name=tool_name,
+    )
+
+    if trace is not None:
+        trace.mark("request_sent")
+
+    # Read stdout and stderr from connection and write them.
+    exit_code = OutputRelay(sock).relay()
+    if trace is not None:
+        trace.mark("exit_code_received")
+    return exit_code
+
+
+def send_request(
+    sock: socket.socket,
+    args: Sequence[str],
+    cwd: Optional[str] = None,
+    env: Optional[Mapping[bytes, bytes]] = None,
+    pass_fds: bool = False,
+    env_baseline_hash: Optional[bytes] = None,
+    env_baseline: Optional[Dict[bytes, bytes]] = None,
+    tool_name: Optional[str] = None,
+) -> None:
+    """Send the request to run a command, after reading the pid.
+
+    The command is run in this process's cwd and with its env vars, unless
+    cwd or env are given.  See run() for the other arguments.
+    """
+    # Request a protocol version, and pass stdin, stdout and stderr if
+    # possible.
+    sock.sendall(encode_headers(env_baseline_hash, env_baseline, tool_name))
+    if pass_fds and sock.family == getattr(socket, "AF_UNIX", None):
+        sock.sendall(b"f\n")
+        try:
+            send_fds(sock, [0, 1, 2])
+        except OSError:
+            # E.g. stdin is closed; send the byte without the file
+            # descriptors, so the daemon relays input and output as usual.
+            sock.sendall(b"\0")
+
+    # Send argv, cwd and env vars.
+    argv_bytes = " ".join(map(shlex.quote, args)).encode()
+    cwd_bytes = os.fsencode(os.getcwd() if cwd is None else cwd)
+    sock.sendall(
+        b"%d\n%b%d\n%b%b"
+        % (
+            len(argv_bytes),
+            argv_bytes,
+            len(cwd_bytes),
+            cwd_bytes,
+            encode_env(env, env_baseline),
+        )
+    )
+
+
+def send_batch_request(
+    sock: socket.socket,
+    jobs: Sequence[Tuple[Sequence[str], Optional[str]]],
+    env: Optional[Mapping[bytes, bytes]] = None,
+    max_parallel: int = 0,
+    env_baseline_hash: Optional[bytes] = None,
+    env_baseline: Optional[Dict[bytes, bytes]] = None,
+    tool_name: Optional[str] = None,
+) -> None:
+    """Send the request to run a batch of commands, after reading the pid.
+
+    Each command is given by its args and cwd, with None for this process's
+    cwd.  At most max_parallel of them are run at once, or with 0, as many
+    as the daemon allows.  See send_request() for the other arguments.
+    """
+    headers = encode_headers(env_baseline_hash, env_baseline, tool_name)
+    encoded_jobs = encode_batch_jobs(
+        [
+            (
+                " ".join(map(shlex.quote, args)).encode(),
+                os.fsencode(os.getcwd() if cwd is None else cwd),
+            )
+            for args, cwd in jobs
+        ]
+    )
+    sock.sendall(
+        b"%bb%d\n%b%b"
+        % (headers, max_parallel, encoded_jobs, encode_env(env, env_baseline))
+    )
+
+
+def encode_headers(
+    env_baseline_hash: Optional[bytes],
+    env_baseline: Optional[Dict[bytes, bytes]],
+    tool_name: Optional[str],
+) -> bytes:
+    """Encode the header lines common to all requests."""
+    headers = b"v%d\n" % PROTOCOL_VERSION
+    if env_baseline is not None:
+        assert env_baseline_hash is not None
+        headers += b"e%b\n" % env_baseline_hash
+    if tool_name is not None:
+        headers += b"t%b\n" % os.fsencode(os.path.basename(tool_name))
+    return headers
+
+
+def encode_env(
+    env: Optional[Mapping[bytes, bytes]], env_baseline: Optional[Dict[bytes, bytes]]
+) -> bytes:
+    """Encode env vars, relative to the daemon's baseline env if given."""
+    if env is None:
+        env = os.environb
+    if env_baseline is not None:
+        return encode_env_delta(env_baseline, env)
+    env_bytes = b"\0".join(b"%b=%b" % item for item in env.items())
+    return b"%d\n%b" % (len(env_bytes), env_bytes)
+
+
+class OutputRelay:
+    """Relay output from a daemon connection to stdout and stderr.
+
+    Data is received in large chunks, and all complete messages in each
+    chunk are handled together.  Consecutive outputs to the same stream are
+    combined and written together, when switching streams or before waiting
+    to receive more data.  This keeps the number of system calls low when a
+    tool writes a lot of output in small pieces, e.g. line by line.
+
+    With protocol version 2, output frames are written as their data
+    arrives, without waiting for entire frames to be received.  Once the
+    daemon grants credit for sending input, stdin is read and sent as it
+    becomes available, while relaying outputs.
+
+    If capture is true, outputs are collected in .stdout and .stderr rather
+    than written.  If input is given, it is sent as the command's stdin
+    rather than reading this process's stdin.
+    """
+
+    recv_size = 256 * 1024
+    stdin_chunk_size = 64 * 1024
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        capture: bool = False,
+        input: Optional[bytes] = None,
+    ) -> None:
+        self._sock = sock
+        self._capture = capture
+        self.stdout = bytearray()
+        self.stderr = bytearray()
+        self._input = input
+        self._input_pos = 0
+        self._buf = bytearray()
+        self._pos = 0
+        self._out_fd = 1
+        self._out_buf = bytearray()
+        self._stdin_eof = False
+        self._stdin_credit = 0
+        self._protocol_version: Optional[int] = None
+        self._frame_remaining = 0
+
+    def relay(self) -> int:
+        """Relay outputs until the command is done, returning its exit code."""
+        while True:
+            if self._input is not None:
+                # Given input is always available, so send as much as allowed.
+                while self._stdin_credit and not self._stdin_eof:
+                    self._send_stdin_chunk()
+            elif self._stdin_credit and not self._stdin_eof:
+                readable, _, _ = select.select([self._sock.fileno(), 0], [], [])
+                if 0 in readable:
+                    self._send_stdin_chunk()
+                if self._sock.fileno() not in readable:
+                    continue
+            chunk = self._sock.recv(self.recv_size)
+            if not chunk:
+                self._print_error("Error: Connection to jumpthegun daemon lost.")
+                return 1
+            self._buf += chunk
+            if self._protocol_version is None:
+                exit_code = self._handle_version()
+            elif self._protocol_version >= 2:
+                exit_code = self._handle_frames()
+            else:
+                exit_code = self._handle_messages()
+            if exit_code is not None:
+                return exit_code
+            del self._buf[: self._pos]
+            self._pos = 0
+            self._flush()
+
+    def _handle_version(self) -> Optional[int]:
+        """Handle the daemon's reply with the protocol version to be used."""
+        header_end = self._buf.find(b"\n", self._pos)
+        if header_end < 0:
+            return None
+        if self._buf[self._pos] != 118:  # ord("v")
+            self._error()
+            return 1
+        self._protocol_version = int(self._buf[self._pos + 1 : header_end])
+        self._pos = header_end + 1
+        if self._protocol_version >= 2:
+            return self._handle_frames()
+        return self._handle_messages()
+
+    def _handle_frames(self) -> Optional[int]:
+        """Handle all frames in the buffer (protocol version 2).
+
+        Returns the exit code if it was received, and None otherwise.
+        """
+        buf = self._buf
+        while True:
+            if self._frame_remaining:
+                # Output the available part of an output frame's data.
+                end = min(len(buf), self._pos + self._frame_remaining)
+                if end == self._pos:
+                    return None
+                self._out_buf += buf[self._pos : end]
+                self._frame_remaining -= end - self._pos
+                self._pos = end
+                continue
+
+            if len(buf) - self._pos < FRAME_HEADER.size:
+                return None
+            channel, length = FRAME_HEADER.unpack_from(buf, self._pos)
+            if channel == STDOUT or channel == STDERR:
+                self._pos += FRAME_HEADER.size
+                self._output(1 if channel == STDOUT else 2, bytearray())
+                self._frame_remaining = length
+                continue
+
+            payload_start = self._pos + FRAME_HEADER.size
+            if len(buf) - payload_start < length:
+                return None
+            payload = bytes(buf[payload_start : payload_start + length])
+            self._pos = payload_start + length
+            self._flush()
+            if channel == STDIN:
+                (credit,) = U32.unpack(payload)
+                self._stdin_credit += credit
+            elif channel == EXIT:
+                (exit_code,) = I32.unpack(payload)
+                return exit_code
+            else:
+                self._error()
+                return 1
+
+    def _handle_messages(self) -> Optional[int]:
+        """Handle all complete messages in the buffer (protocol version 1).
+
+        Returns the exit code if it was received, and None otherwise.
+        """
+        buf = self._buf
+        while True:
+            header_end = buf.find(b"\n", self._pos)
+            if header_end < 0:
+                return None
+            channel = buf[self._pos]
+            if channel == 49 or channel == 50:  # ord("1"), ord("2")
+                # The data is followed by a newline, and any newlines in it
+                # are counted in the header.
+                n_newlines = int(buf[self._pos + 1 : header_end])
+                if buf.count(b"\n", header_end + 1) <= n_newlines:
+                    return None
+                data_end = header_end
+                for _i in range(n_newlines + 1):
+                    data_end = buf.find(b"\n", data_end + 1)
+                self._output(channel - 48, buf[header_end + 1 : data_end])
+                self._pos = data_end + 1
+            elif channel == 51:  # ord("3")
+                self._pos = header_end + 1
+                self._flush()
+                self._send_stdin_line()
+            elif buf.startswith(b"rc=", self._pos):
+                self._flush()
+                return int(buf[self._pos + 3 : header_end])
+            else:
+                self._error()
+                return 1
+
+    def _error(self) -> None:
+        self._print_error("Error: Unexpected output from jumpthegun daemon.")
+
+    def _print_error(self, message: str) -> None:
+        self._flush()
+        if self._capture:
+            self.stderr += message.encode() + b"\n"
+        else:
+            print(message, file=sys.stderr)
+
+    def _output(self, fd: int, data: bytearray) -> None:
+        if fd != self._out_fd:
+            self._flush()
+            self._out_fd = fd
+        self._out_buf += data
+
+    def _flush(self) -> None:
+        if self._capture:
+            (self.stdout if self._out_fd == 1 else self.stderr).extend(self._out_buf)
+            del self._out_buf[:]
+            return
+        n_written = 0
+        with memoryview(self._out_buf) as view:
+            while n_written < len(view):
+                n_written += os.write(self._out_fd, view[n_written:])
+        del self._out_buf[:]
+
+    def _send_stdin_line(self) -> None:
+        if self._stdin_eof:
+            input_line = b""
+        elif self._input is not None:
+            end = self._input.find(b"\n", self._input_pos) + 1 or len(self._input)
+            input_line = self._input[self._input_pos : end]
+            self._input_pos = end
+        else:
+            input_line = sys.stdin.buffer.readline()
+        if not input_line:
+            self._stdin_eof = True
+        self._sock.sendall(b"%d\n%b" % (len(input_line), input_line))
+
+    def _send_stdin_chunk(self) -> None:
+        size = min(self._stdin_credit, self.stdin_chunk_size)
+        if self._input is not None:
+            data = self._input[self._input_pos : self._input_pos + size]
+            self._input_pos += len(data)
+        else:
+            data = os.read(0, size)
+        if not data:
+            self._stdin_eof = True
+        self._stdin_credit -= len(data)
+        self._sock.sendall(U32.pack(len(data)) + data)
+
+
+def main() -> NoReturn:
+    args = sys.argv[1:]
+    autorun = True
+    pass_fds = False
+    while args and args[0] in ("--no-autorun", "--pass-fds"):
+        if args[0] == "--no-autorun":
+            autorun = False
+        else:
+            pass_fds = True
+        args = args[1:]
+    if not args or args[0] in ("-h", "--help"):
+        print(usage())
+        sys.exit(0 if args else 1)
+    tool_name, *tool_args = args
+
+    trace_file_path = os.environ.get(TRACE_ENV_VAR)
+    trace = Trace("jumpthegun-client") if trace_file_path else None
+    if trace is not None:
+        trace.mark("client_start")
+
+    isolated_path = get_daemon_dir(tool_name)
+    sock = None if isolated_path is None else connect(isolated_path, tool_name)
+    if sock is None:
+        fall_back(tool_name, tool_args, autorun)
+    assert isolated_path is not None
+    if trace is not None:
+        trace.mark("connect")
+    with sock:
+        pid_line = read_pid(sock)
+        if pid_line is None:
+            sock.close()
+            run_directly(tool_name, tool_args)
+        pid, env_baseline_hash = pid_line
+        if trace is not None:
+            trace.mark("pid_received")
+        env_baseline = None
+        if env_baseline_hash is not None:
+            env_baseline = read_env_baseline(
+                isolated_path, tool_name, env_baseline_hash
+            )
+        exit_code = run(
+            sock,
+            pid,
+            tool_args,
+            pass_fds=pass_fds,
+            trace=trace,
+            env_baseline_hash=env_baseline_hash,
+            env_baseline=env_baseline,
+            tool_name=tool_name,
+        )
+    if trace is not None and trace_file_path:
+        trace.write(trace_file_path)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
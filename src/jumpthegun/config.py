@@ -1,13 +1,36 @@
 import json
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, List, NamedTuple, Optional, Union
+
+SHARDING_EXIT_CODE_RULES = ("max", "any_nonzero")
+
+
+class ShardingOptions(NamedTuple):
+    """How to split a tool's file arguments between processes."""
+
+    shards: int
+    exit_code: str
+    file_suffixes: List[str]
+    value_options: Optional[List[str]]
 
 
 @dataclass(frozen=True)
 class JumpTheGunConfig:
     idle_timeout_seconds: Optional[int] = 4 * 60 * 60  # 4 hours
+    pool_size: int = 0
+    unix_socket: bool = True
+    import_training: bool = False
+    warm_ups: Dict[str, Optional[Union[str, List[str]]]] = field(default_factory=dict)
+    gc_freeze: bool = True
+    gc_thresholds: Optional[List[int]] = None
+    max_concurrent_children: Optional[Union[int, str]] = None
+    max_queued_connections: Optional[int] = None
+    code_check_interval_seconds: Optional[int] = None
+    zygote: bool = False
+    tool_groups: Dict[str, Optional[List[str]]] = field(default_factory=dict)
+    sharding: Dict[str, Dict[str, Any]] = field(default_factory=dict)
 
     def __post_init__(self):
         if self.idle_timeout_seconds is None:
@@ -18,6 +41,165 @@ class JumpTheGunConfig:
         else:
             raise TypeError("idle_timeout_seconds must be an int or None.")
 
+        if not isinstance(self.pool_size, int) or isinstance(self.pool_size, bool):
+            raise TypeError("pool_size must be an int.")
+        elif self.pool_size < 0:
+            raise ValueError("pool_size must not be negative.")
+
+        if not isinstance(self.unix_socket, bool):
+            raise TypeError("unix_socket must be a bool.")
+
+        if not isinstance(self.import_training, bool):
+            raise TypeError("import_training must be a bool.")
+
+        if not isinstance(self.warm_ups, dict):
+            raise TypeError("warm_ups must be a dict.")
+        for tool_name, warm_up in self.warm_ups.items():
+            if warm_up is None or isinstance(warm_up, str):
+                continue
+            if not (
+                isinstance(warm_up, list)
+                and all(isinstance(arg, str) for arg in warm_up)
+            ):
+                raise TypeError(
+                    f"warm_ups[{tool_name!r}] must be a string, a list of strings"
+                    " or None."
+                )
+
+        if not isinstance(self.gc_freeze, bool):
+            raise TypeError("gc_freeze must be a bool.")
+
+        if self.gc_thresholds is None:
+            pass
+        elif isinstance(self.gc_thresholds, list) and all(
+            isinstance(x, int) and not isinstance(x, bool) for x in self.gc_thresholds
+        ):
+            if not 1 <= len(self.gc_thresholds) <= 3:
+                raise ValueError("gc_thresholds must have between 1 and 3 items.")
+            if any(x < 0 for x in self.gc_thresholds):
+                raise ValueError("gc_thresholds must not be negative.")
+        else:
+            raise TypeError("gc_thresholds must be a list of ints or None.")
+
+        if self.max_concurrent_children is None:
+            pass
+        elif isinstance(self.max_concurrent_children, str):
+            if self.max_concurrent_children != "cpu_count":
+                raise ValueError(
+                    'max_concurrent_children must be an int, "cpu_count" or None.'
+                )
+        elif isinstance(self.max_concurrent_children, int) and not isinstance(
+            self.max_concurrent_children, bool
+        ):
+            if self.max_concurrent_children <= 0:
+                raise ValueError("max_concurrent_children must be positive.")
+        else:
+            raise TypeError(
+                'max_concurrent_children must be an int, "cpu_count" or None.'
+            )
+
+        if self.max_queued_connections is None:
+            pass
+        elif isinstance(self.max_queued_connections, int) and not isinstance(
+            self.max_queued_connections, bool
+        ):
+            if self.max_queued_connections < 0:
+                raise ValueError("max_queued_connections must not be negative.")
+        else:
+            raise TypeError("max_queued_connections must be an int or None.")
+
+        if self.code_check_interval_seconds is None:
+            pass
+        elif isinstance(self.code_check_interval_seconds, int) and not isinstance(
+            self.code_check_interval_seconds, bool
+        ):
+            if self.code_check_interval_seconds <= 0:
+                raise ValueError("code_check_interval_seconds must be positive.")
+        else:
+            raise TypeError("code_check_interval_seconds must be an int or None.")
+
+        if not isinstance(self.zygote, bool):
+            raise TypeError("zygote must be a bool.")
+
+        if not isinstance(self.tool_groups, dict):
+            raise TypeError("tool_groups must be a dict.")
+        for tool_name, other_tool_names in self.tool_groups.items():
+            if other_tool_names is None:
+                continue
+            if not (
+                isinstance(other_tool_names, list)
+                and all(isinstance(name, str) for name in other_tool_names)
+            ):
+                raise TypeError(
+                    f"tool_groups[{tool_name!r}] must be a list of strings or None."
+                )
+
+        if not isinstance(self.sharding, dict):
+            raise TypeError("sharding must be a dict.")
+        for tool_name, options in self.sharding.items():
+            name = f"sharding[{tool_name!r}]"
+            if not isinstance(options, dict):
+                raise TypeError(f"{name} must be a dict.")
+            unknown_keys = set(options) - {
+                "shards",
+                "exit_code",
+                "file_suffixes",
+                "value_options",
+            }
+            if unknown_keys:
+                raise ValueError(f"{name} has unknown keys: {sorted(unknown_keys)}")
+            shards = options.get("shards", "cpu_count")
+            if isinstance(shards, str):
+                if shards != "cpu_count":
+                    raise ValueError(f'{name}["shards"] must be an int or "cpu_count".')
+            elif isinstance(shards, int) and not isinstance(shards, bool):
+                if shards <= 0:
+                    raise ValueError(f'{name}["shards"] must be positive.')
+            else:
+                raise TypeError(f'{name}["shards"] must be an int or "cpu_count".')
+            if options.get("exit_code", "max") not in SHARDING_EXIT_CODE_RULES:
+                raise ValueError(
+                    f'{name}["exit_code"] must be one of: '
+                    + ", ".join(map(repr, SHARDING_EXIT_CODE_RULES))
+                )
+            file_suffixes = options.get("file_suffixes", [])
+            if not (
+                isinstance(file_suffixes, list)
+                and all(isinstance(suffix, str) for suffix in file_suffixes)
+            ):
+                raise TypeError(f'{name}["file_suffixes"] must be a list of strings.')
+            value_options = options.get("value_options")
+            if not (
+                value_options is None
+                or (
+                    isinstance(value_options, list)
+                    and all(isinstance(option, str) for option in value_options)
+                )
+            ):
+                raise TypeError(
+                    f'{name}["value_options"] must be a list of strings or None.'
+                )
+
+    def get_max_concurrent_children(self) -> Optional[int]:
+        """Get the limit on concurrently running sub-processes, if any."""
+        if self.max_concurrent_children == "cpu_count":
+            return os.cpu_count() or 1
+        assert not isinstance(self.max_concurrent_children, str)
+        return self.max_concurrent_children
+
+    def get_sharding_options(self, tool_name: str) -> Optional[ShardingOptions]:
+        """Get how to split a tool's file arguments, if configured to."""
+        options = self.sharding.get(tool_name)
+        if options is None:
+            return None
+        shards = options.get("shards", "cpu_count")
+        return ShardingOptions(
+            shards=(os.cpu_count() or 1) if shards == "cpu_count" else shards,
+            exit_code=options.get("exit_code", "max"),
+            file_suffixes=options.get("file_suffixes", [".py", ".pyi"]),
+            value_options=options.get("value_options"),
+        )
+
 
 def read_config() -> JumpTheGunConfig:
     config_dir = get_xdg_config_dir()
@@ -1,11 +1,15 @@
+import hashlib
 import os
 from dataclasses import dataclass
-from typing import Dict, Set
+from typing import Dict, Iterable, List, Set, Tuple
 
 all = [
     "EnvVarsDiff",
+    "EnvBaseline",
     "apply_env_with_diff",
+    "apply_env_delta",
     "calc_env_diff",
+    "parse_env_entries",
 ]
 
 
@@ -27,4 +31,74 @@ def apply_env_with_diff(env: Dict[str, str], diff: EnvVarsDiff) -> None:
     env.update(diff.changed)
     for env_var_name in set(os.environ) - set(env):
         del os.environ[env_var_name]
-    os.environ.update(env)
+    # Only set env vars whose values differ, since each is set separately.
+    for env_var_name, value in env.items():
+        if os.environ.get(env_var_name) != value:
+            os.environ[env_var_name] = value
+
+
+def apply_env_delta(
+    changed: Dict[str, str], deleted: Iterable[str], diff: EnvVarsDiff
+) -> None:
+    """Apply env vars sent relative to the baseline env.
+
+    This assumes that os.environ is the baseline env with the diff applied,
+    as it is in the daemon's sub-processes.  Env vars in the diff, i.e.
+    those set or deleted upon importing the tool, are kept as they are.
+    """
+    for env_var_name, value in changed.items():
+        if env_var_name in diff.changed or env_var_name in diff.deleted:
+            continue
+        if os.environ.get(env_var_name) != value:
+            os.environ[env_var_name] = value
+    for env_var_name in deleted:
+        if env_var_name in diff.changed:
+            continue
+        os.environ.pop(env_var_name, None)
+
+
+def parse_env_entries(entries: List[bytes]) -> Tuple[Dict[str, str], Set[str]]:
+    """Parse env var entries, returning those set and those deleted.
+
+    "NAME=value" entries set env vars, while "NAME" entries delete them.
+    """
+    changed: Dict[str, str] = {}
+    deleted: Set[str] = set()
+    for entry in entries:
+        name, sep, value = os.fsdecode(entry).partition("=")
+        if name == "_":
+            continue
+        if sep:
+            changed[name] = value
+        else:
+            deleted.add(name)
+    return changed, deleted
+
+
+@dataclass
+class EnvBaseline:
+    """The env a daemon started with.
+
+    Clients may send their env vars as a delta from this, identified by its
+    hash.  It is written to a file, as the NUL-terminated hash followed by
+    NUL-terminated "NAME=value" entries.
+    """
+
+    env: Dict[str, str]
+    hash: str
+
+    @classmethod
+    def from_env(cls, env: Dict[str, str]) -> "EnvBaseline":
+        return cls(
+            env=dict(env), hash=hashlib.sha256(cls._encode_env(env)).hexdigest()[:16]
+        )
+
+    def encode(self) -> bytes:
+        return self.hash.encode() + b"\0" + self._encode_env(self.env)
+
+    @staticmethod
+    def _encode_env(env: Dict[str, str]) -> bytes:
+        return b"".join(
+            b"%b=%b\0" % (os.fsencode(name), os.fsencode(value))
+            for name, value in sorted(env.items())
+        )
@@ -0,0 +1,90 @@
+import heapq
+import itertools
+import selectors
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+__all__ = [
+    "EventLoop",
+    "Timer",
+]
+
+
+class Timer:
+    """A handle for a callback scheduled with EventLoop.call_later()."""
+
+    def __init__(self, callback: Callable[[], None]) -> None:
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class EventLoop:
+    """A minimal single-threaded event loop, based on selectors.
+
+    Callbacks are called when registered files become readable and when
+    timers expire.
+
+    Unlike asyncio's event loops, this supports forking within callbacks:
+    the callback calls .stop() in the forked sub-process, and then .run()
+    returns there, after which .close() must be called.
+    """
+
+    def __init__(self) -> None:
+        self._selector = selectors.DefaultSelector()
+        self._timers: List[Tuple[float, int, Timer]] = []
+        self._timer_counter = itertools.count()
+        self._stopped = False
+        self._result: Any = None
+
+    def add_reader(self, fileobj: Any, callback: Callable[[], None]) -> None:
+        """Call a callback whenever a file is readable."""
+        self._selector.register(fileobj, selectors.EVENT_READ, callback)
+
+    def remove_reader(self, fileobj: Any) -> None:
+        self._selector.unregister(fileobj)
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> Timer:
+        """Call a callback once, after the given number of seconds."""
+        timer = Timer(callback)
+        heapq.heappush(
+            self._timers, (time.monotonic() + delay, next(self._timer_counter), timer)
+        )
+        return timer
+
+    def stop(self, result: Any = None) -> None:
+        """Make .run() return the given result once the callback returns."""
+        self._stopped = True
+        self._result = result
+
+    def run(self) -> Any:
+        """Run until .stop() is called, returning the result passed to it."""
+        self._stopped = False
+        while not self._stopped:
+            timeout: Optional[float] = None
+            if self._timers:
+                timeout = max(0.0, self._timers[0][0] - time.monotonic())
+            for key, _events in self._selector.select(timeout):
+                key.data()
+                if self._stopped:
+                    return self._result
+
+            now = time.monotonic()
+            while self._timers and self._timers[0][0] <= now:
+                _when, _i, timer = heapq.heappop(self._timers)
+                if not timer.cancelled:
+                    timer.callback()
+                    if self._stopped:
+                        return self._result
+        return self._result
+
+    def close(self) -> None:
+        """Close the selector.
+
+        In a forked sub-process, this doesn't affect the parent process's
+        registrations, even with selectors whose state is in the kernel
+        (e.g. epoll), since nothing is unregistered.
+        """
+        self._selector.close()
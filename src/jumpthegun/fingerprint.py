@@ -0,0 +1,48 @@
+"""Noticing changes to the code a daemon has imported.
+
+Daemons keep running a tool's code as it was when they imported it.  To
+notice when it changes, e.g. upon `pip install -U <tool>`, daemons record
+the modification time, size and inode of the files of all imported modules,
+and check them periodically.  Checking is a batch of os.stat() calls, which
+takes a few milliseconds even for tools importing thousands of modules.
+"""
+
+import os
+import sys
+from typing import Dict, Optional, Tuple
+
+__all__ = [
+    "ModuleFilesFingerprint",
+]
+
+FileStat = Optional[Tuple[int, int, int]]
+
+
+def _stat(file_path: str) -> FileStat:
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+class ModuleFilesFingerprint:
+    """Record the state of the files of imported modules."""
+
+    def __init__(self) -> None:
+        self._file_stats: Dict[str, FileStat] = {}
+        self.update()
+
+    def update(self) -> None:
+        """Record the files of modules imported since the last update."""
+        for module in list(sys.modules.values()):
+            file_path = getattr(module, "__file__", None)
+            if isinstance(file_path, str) and file_path not in self._file_stats:
+                self._file_stats[file_path] = _stat(file_path)
+
+    def changed(self) -> bool:
+        """Whether any recorded file was modified, replaced or removed."""
+        return any(
+            _stat(file_path) != file_stat
+            for file_path, file_stat in self._file_stats.items()
+        )
@@ -0,0 +1,87 @@
+import importlib
+import os
+import sys
+from pathlib import Path
+from typing import List, Set
+
+
+class ImportTrainer:
+    """Learn which modules a tool imports lazily, to pre-import them.
+
+    Sub-processes record the modules newly imported while running the tool,
+    by appending their names to a file.  The daemon process pre-imports the
+    recorded modules upon starting, and periodically checks for more, so that
+    later sub-processes are forked with them already imported.
+    """
+
+    def __init__(self, file_path: Path) -> None:
+        self._file_path = file_path
+        self._read_size = 0
+        # Names of modules which were recorded, whether or not importing
+        # them succeeded.
+        self._known: Set[str] = set()
+        self._modules_before: Set[str] = set()
+
+    def preimport(self) -> bool:
+        """Import modules recorded since the last call.
+
+        Returns whether any modules were imported.
+        """
+        imported = False
+        for module_name in self._read_new_module_names():
+            if module_name in self._known:
+                continue
+            self._known.add(module_name)
+            if module_name in sys.modules:
+                continue
+            try:
+                importlib.import_module(module_name)
+            except Exception:
+                # The module may depend on things only done when the tool
+                # runs; it will just be imported by sub-processes as before.
+                pass
+            else:
+                imported = True
+        return imported
+
+    def snapshot_modules(self) -> None:
+        """Remember which modules are imported before running the tool."""
+        self._modules_before = set(sys.modules)
+
+    def record_imports(self) -> None:
+        """Record modules imported since .snapshot_modules() was called."""
+        new_module_names = [
+            name
+            for name, module in list(sys.modules.items())
+            if module is not None
+            and name != "__main__"
+            and name not in self._modules_before
+            and name not in self._known
+        ]
+        if not new_module_names:
+            return
+        data = "".join(f"{name}\n" for name in new_module_names).encode()
+        # A single write in append mode, so that concurrently running
+        # sub-processes don't interleave their records.
+        try:
+            fd = os.open(self._file_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        except OSError:
+            return
+        try:
+            os.write(fd, data)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _read_new_module_names(self) -> List[str]:
+        try:
+            with self._file_path.open("rb") as f:
+                f.seek(self._read_size)
+                data = f.read()
+        except OSError:
+            return []
+        # Ignore an incomplete last line, which is still being written.
+        data = data[: data.rfind(b"\n") + 1]
+        self._read_size += len(data)
+        return data.decode().split()
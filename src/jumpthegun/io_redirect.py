@@ -1,8 +1,14 @@
 import contextlib
 import io
+import os
+import signal
 import socket
 import sys
-from typing import Any, BinaryIO, Optional, Union, cast
+import threading
+import time
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Union, cast
+
+from .protocol import EXIT, I32, STDIN, U32, encode_frame
 
 
 class SocketOutputRedirector:
@@ -17,10 +23,14 @@ class SocketOutputRedirector:
     Later, use .set_socket() to set the socket to be written to and
     override stdout and stderr in a final manner.  At this point, any
     buffered data will be written to the socket.
+
+    Alternatively, if the client's file descriptors were received, use
+    .set_std_fds() to write to them directly.
     """
 
     _stdout_buffer: io.StringIO
     _stderr_buffer: io.StringIO
+    output_buffer: "OutputBuffer"
 
     def __init__(self):
         self._stdout_buffer = io.StringIO()
@@ -39,9 +49,29 @@ class SocketOutputRedirector:
             sys.stdout = prev_stdout
             sys.stderr = prev_stderr
 
-    def set_socket(self, conn: socket.socket):
-        stdout_socket_writer = SocketWriter(prefix=b"1")
-        stdout_socket_writer.set_socket(conn)
+    @contextlib.contextmanager
+    def discard_outputs(self):
+        """Discard outputs written within this context.
+
+        This is meant to be used within .override_outputs_for_imports().
+        """
+        positions = [
+            (buffer, buffer.tell())
+            for buffer in (self._stdout_buffer, self._stderr_buffer)
+        ]
+        try:
+            yield
+        finally:
+            for buffer, position in positions:
+                buffer.seek(position)
+                buffer.truncate()
+
+    def set_socket(self, conn: socket.socket, protocol_version: int = 1):
+        self.output_buffer = OutputBuffer(conn, protocol_version=protocol_version)
+
+        stdout_socket_writer = SocketWriter(
+            prefix=b"1", output_buffer=self.output_buffer
+        )
         sock_stdout = io.TextIOWrapper(
             cast(BinaryIO, stdout_socket_writer), write_through=True
         )
@@ -49,8 +79,9 @@ class SocketOutputRedirector:
         sys.stdout.flush()
         sys.stdout = sock_stdout
 
-        stderr_socket_writer = SocketWriter(prefix=b"2")
-        stderr_socket_writer.set_socket(conn)
+        stderr_socket_writer = SocketWriter(
+            prefix=b"2", output_buffer=self.output_buffer
+        )
         sock_stderr = io.TextIOWrapper(
             cast(BinaryIO, stderr_socket_writer), write_through=True
         )
@@ -58,20 +89,207 @@ class SocketOutputRedirector:
         sys.stderr.flush()
         sys.stderr = sock_stderr
 
+    def set_std_fds(self, conn: socket.socket, protocol_version: int = 1):
+        """Write to file descriptors 1 and 2, rather than to the socket.
 
-class SocketWriter(io.RawIOBase):
-    """Output adapter implementing the file interface.
+        Anything buffered in the previous stdout and stderr must be flushed
+        before they are replaced via os.dup2().
 
-    This writes lines to a socket in the JumpTheGun protocol.
+        The socket is still used for sending anything else via
+        .output_buffer, e.g. the exit code.
+        """
+        self.output_buffer = OutputBuffer(conn, protocol_version=protocol_version)
 
-    The socket is set after initialization via .set_socket().
+        # These mimic how Python sets up the standard streams.
+        fd_stdout = io.TextIOWrapper(
+            io.open(1, "wb", closefd=False),
+            encoding=sys.stdout.encoding,
+            errors=sys.stdout.errors,
+            line_buffering=os.isatty(1),
+        )
+        fd_stdout.write(self._stdout_buffer.getvalue())
+        sys.stdout = fd_stdout
+
+        fd_stderr = io.TextIOWrapper(
+            io.open(2, "wb", closefd=False),
+            encoding=sys.stderr.encoding,
+            errors="backslashreplace",
+            line_buffering=True,
+            write_through=True,
+        )
+        fd_stderr.write(self._stderr_buffer.getvalue())
+        sys.stderr = fd_stderr
+
+    def flush(self) -> None:
+        """Flush stdout and stderr, sending all buffered output."""
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+        self.output_buffer.flush()
+
+    def flush_on_sigterm(self) -> None:
+        """Send buffered output before being terminated by SIGTERM.
+
+        Output still buffered when the process is killed by SIGKILL or exits
+        via os._exit() is lost.  A handler installed later, e.g. by the tool,
+        replaces this one.
+        """
+
+        def handle_sigterm(signum: int, frame: Any) -> None:
+            try:
+                self.flush()
+            except OSError:
+                pass
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+        signal.signal(signal.SIGTERM, handle_sigterm)
+
+
+class OutputBuffer:
+    """Coalesces outputs before sending them to a socket.
+
+    Stdout and stderr share a single buffer, keeping the order of their
+    outputs.  Consecutive writes to the same output are combined, so that
+    many small writes (e.g. printing line by line) are sent with few system
+    calls and protocol messages.
+
+    Buffered outputs are sent when their size reaches a threshold, shortly
+    after being written, upon .flush(), and before anything else is sent
+    via .send(), e.g. requests for input and the exit code.
+
+    The time of the first output and the number of bytes written to each
+    output are kept, for statistics.
     """
 
-    _sock: Optional[socket.socket]
+    max_size = 64 * 1024
+    flush_delay_seconds = 0.005
+
+    _chunks: List[Tuple[bytes, bytearray]]
+
+    def __init__(self, sock: socket.socket, protocol_version: int = 1) -> None:
+        self._sock = sock
+        self._protocol_version = protocol_version
+        self._chunks = []
+        self._size = 0
+        # This is re-entrant since signal handlers may write outputs.
+        self._lock = threading.RLock()
+        self._has_data = threading.Condition(self._lock)
+        self._flush_thread: Optional[threading.Thread] = None
+        self._write_through = False
+        self._sending = False
+        self.first_output_time: Optional[float] = None
+        self.bytes_written: Dict[bytes, int] = {}
+        os.register_at_fork(
+            before=self._before_fork,
+            after_in_parent=self._after_fork_in_parent,
+            after_in_child=self._after_fork_in_child,
+        )
+
+    def write(self, prefix: bytes, b: Union[bytes, bytearray, memoryview]) -> None:
+        if not b:
+            return
+        with self._lock:
+            if self.first_output_time is None:
+                self.first_output_time = time.monotonic()
+            self.bytes_written[prefix] = self.bytes_written.get(prefix, 0) + len(b)
+            if self._chunks and self._chunks[-1][0] == prefix:
+                self._chunks[-1][1].extend(b)
+            else:
+                self._chunks.append((prefix, bytearray(b)))
+                if len(self._chunks) == 1:
+                    self._has_data.notify()
+            self._size += len(b)
+            if self._size >= self.max_size or self._write_through:
+                self._flush_locked()
+            elif self._flush_thread is None:
+                self._flush_thread = threading.Thread(
+                    target=self._flush_after_delay, daemon=True
+                )
+                self._flush_thread.start()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def send(self, data: bytes) -> None:
+        """Send data after any buffered outputs."""
+        with self._lock:
+            self._flush_locked()
+            self._send_locked(data)
+
+    def fileno(self) -> int:
+        return self._sock.fileno()
+
+    def _flush_locked(self) -> None:
+        # Outputs written while sending, e.g. by signal handlers, are only
+        # buffered, and are sent once sending is done.
+        if self._sending:
+            return
+        while self._chunks:
+            chunks = self._chunks
+            self._chunks = []
+            self._size = 0
+            if self._protocol_version >= 2:
+                data = b"".join(
+                    [encode_frame(prefix, chunk) for prefix, chunk in chunks]
+                )
+            else:
+                data = b"".join(
+                    [
+                        b"%b%d\n" % (prefix, chunk.count(10)) + chunk + b"\n"
+                        for prefix, chunk in chunks
+                    ]
+                )
+            self._send_locked(data)
+
+    def _send_locked(self, data: bytes) -> None:
+        self._sending = True
+        try:
+            self._sock.sendall(data)
+        finally:
+            self._sending = False
+
+    def _flush_after_delay(self) -> None:
+        with self._lock:
+            while True:
+                while not self._chunks:
+                    self._has_data.wait()
+                self._has_data.wait(self.flush_delay_seconds)
+                try:
+                    self._flush_locked()
+                except OSError:
+                    # The connection was closed.
+                    return
+
+    def _before_fork(self) -> None:
+        # Avoid buffered outputs being sent by both processes.
+        self._lock.acquire()
+        self._flush_locked()
+
+    def _after_fork_in_parent(self) -> None:
+        self._lock.release()
+
+    def _after_fork_in_child(self) -> None:
+        # The flushing thread doesn't exist in the child process, so the
+        # child must send outputs immediately.
+        self._lock = threading.RLock()
+        self._has_data = threading.Condition(self._lock)
+        self._write_through = True
+
+
+class SocketWriter(io.RawIOBase):
+    """Output adapter implementing the file interface.
 
-    def __init__(self, prefix: bytes) -> None:
-        self._sock = None
+    This writes to a socket in the JumpTheGun protocol, via an output
+    buffer, which may be shared with other SocketWriters.
+    """
+
+    def __init__(self, prefix: bytes, output_buffer: OutputBuffer) -> None:
         self._prefix = prefix
+        self._output_buffer = output_buffer
 
     def readable(self) -> bool:
         return False
@@ -80,36 +298,51 @@ class SocketWriter(io.RawIOBase):
         return True
 
     def write(self, b: Union[bytes, bytearray]) -> int:  # type: ignore[override]
-        if self._sock is None:
-            raise Exception("SocketWriter socket must be set before calling .write()")
-        n_newlines = b.count(10)
-        # print(b"%b%d\n%b\n" % (self._prefix, n_newlines, b), file=sys.__stderr__)
-        self._sock.sendall(b"%b%d\n%b\n" % (self._prefix, n_newlines, b))
-        # print("DONE WRITING", file=sys.__stderr__)
+        self._output_buffer.write(self._prefix, b)
         with memoryview(b) as view:
             return view.nbytes
 
-    def fileno(self) -> Any:
-        return self._sock.fileno() if self._sock is not None else None
-
-    def set_socket(self, sock: socket.socket):
-        if self._sock is not None:
-            raise Exception("SockerWriter socket may only be set once")
-        self._sock = sock
+    def flush(self) -> None:
+        self._output_buffer.flush()
 
-    def has_socket(self) -> bool:
-        return self._sock is not None
+    def fileno(self) -> Any:
+        return self._output_buffer.fileno()
 
 
 class StdinWrapper(io.RawIOBase):
     """Input adapter implementing the file interface.
 
-    This reads lines from a socket in the JumpTheGun protocol.
+    This reads from a socket in the JumpTheGun protocol.  Input is received
+    into a local buffer, from which all reads are served.
+
+    In version 1, input is requested a line at a time.  In version 2, input
+    is streamed: the client is granted credit to send up to .window_size
+    bytes ahead of them being read, and is granted more as input is read.
+
+    If an output buffer is given, requests for input are sent via it, so
+    that buffered outputs (e.g. prompts) are sent first.
     """
 
-    def __init__(self, sock: socket.socket) -> None:
+    # This is kept small enough for the socket's buffers to hold input sent
+    # ahead, so that the client never blocks sending input while the command
+    # is blocked sending output.
+    window_size = 64 * 1024
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        protocol_version: int = 1,
+        output_buffer: Optional[OutputBuffer] = None,
+    ) -> None:
         self._sock = sock
+        # Only input is received via the socket, so reading ahead is fine.
+        self._rfile = sock.makefile("rb")
         self._buf = bytearray()
+        self._eof = False
+        self._credit = 0
+        self._protocol_version = protocol_version
+        self._output_buffer = output_buffer
+        self.bytes_received = 0
 
     def readable(self) -> bool:
         return True
@@ -120,26 +353,67 @@ class StdinWrapper(io.RawIOBase):
     def readline(self, size: Optional[int] = -1) -> bytes:
         if size is None:
             size = -1
-        self._sock.sendall(b"3\n")
-        buf = self._buf
-        while size:
-            chunk = self._sock.recv(size if size != -1 else 4096)
-            if not chunk:
-                self._buf = bytearray()
-                break
-            idx = chunk.find(10)  # ord("\n") == 10
+        searched = 0
+        while True:
+            idx = self._buf.find(b"\n", searched)
             if idx >= 0:
-                size = idx + 1
-            if len(chunk) >= size:
-                buf.extend(chunk[:size])
-                self._buf = bytearray(chunk[size:])
+                end = idx + 1
                 break
-            buf.extend(chunk)
-            size = size - len(chunk) if size != -1 else -1
-
-        return buf
-
-    read = readline
+            if self._eof or 0 <= size <= len(self._buf):
+                end = len(self._buf)
+                break
+            searched = len(self._buf)
+            self._fill()
+        if size >= 0:
+            end = min(end, size)
+        line = bytes(self._buf[:end])
+        del self._buf[:end]
+        return line
+
+    def readinto(self, b: Any) -> int:
+        if not self._buf and not self._eof:
+            self._fill()
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        del self._buf[:n]
+        return n
 
     def fileno(self) -> Any:
         return self._sock.fileno()
+
+    def _fill(self) -> None:
+        """Receive more input into the buffer, waiting until some arrives."""
+        if self._protocol_version >= 2:
+            if self._credit < self.window_size // 2:
+                grant = self.window_size - self._credit
+                self._send_request(encode_frame(STDIN, U32.pack(grant)))
+                self._credit += grant
+            (length,) = U32.unpack(self._read_exactly(U32.size))
+            self._credit -= length
+        else:
+            self._send_request(b"3\n")
+            length = int(self._rfile.readline())
+        if length == 0:
+            self._eof = True
+        else:
+            self._buf += self._read_exactly(length)
+            self.bytes_received += length
+
+    def _read_exactly(self, size: int) -> bytes:
+        data = self._rfile.read(size)
+        if len(data) < size:
+            raise EOFError("Connection closed.")
+        return data
+
+    def _send_request(self, request: bytes) -> None:
+        if self._output_buffer is not None:
+            self._output_buffer.send(request)
+        else:
+            self._sock.sendall(request)
+
+
+def encode_exit_code(exit_code: int, protocol_version: int) -> bytes:
+    """Encode the message sending a command's exit code to the client."""
+    if protocol_version >= 2:
+        return encode_frame(EXIT, I32.pack(exit_code))
+    return b"rc=%d\n" % exit_code
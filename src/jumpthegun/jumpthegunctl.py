@@ -1,22 +1,69 @@
+import dataclasses
+import gc
 import io
+import json
 import os
 import shlex
 import signal
 import socket
+import subprocess
 import sys
 import time
 import traceback
 from pathlib import Path
-from typing import BinaryIO, Dict, Tuple, cast
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    List,
+    NoReturn,
+    Optional,
+    Sequence,
+    Tuple,
+    cast,
+)
+
+from jumpthegun._vendor.filelock import FileLock
 
 from .__version__ import __version__
+from .batch import BatchRunner
+from .child_registry import ChildRegistry
 from .config import read_config
-from .env_vars import apply_env_with_diff, calc_env_diff
-from .io_redirect import SocketOutputRedirector, StdinWrapper
+from .env_vars import (
+    EnvBaseline,
+    apply_env_delta,
+    apply_env_with_diff,
+    calc_env_diff,
+    parse_env_entries,
+)
+from .fingerprint import ModuleFilesFingerprint
+from .import_training import ImportTrainer
+from .io_redirect import SocketOutputRedirector, StdinWrapper, encode_exit_code
+from .memory import freeze_gc, get_memory_usage
+from .protocol import read_batch_jobs, read_env_entries, read_request_headers
 from .runtime_dir import get_isolated_service_runtime_dir_for_tool
-from .tools import ToolExceptionBase, get_tool_entrypoint
+from .server import DaemonServer
+from .sharding import run_sharded, split_file_args
+from .stats import format_prometheus
+from .tools import (
+    ToolExceptionBase,
+    get_tool_entrypoint,
+    get_tool_group,
+    get_tool_warm_up,
+)
+from .tracing import TRACE_ENV_VAR, Trace, monotonic_to_us, now_us
 from .utils import daemonize as daemonize_func
 from .utils import pid_exists
+from .warm_up import run_warm_up
+from .zygote import (
+    Zygote,
+    get_zygote_name,
+    preimport_common_modules,
+    send_reply,
+    send_start_request,
+    zygote_is_listening,
+)
 
 
 class InvalidCommand(Exception):
@@ -39,16 +86,56 @@ class DaemonDoesNotExistError(ToolExceptionBase):
         )
 
 
-def get_pid_and_port_file_paths(tool_name: str) -> Tuple[Path, Path]:
+class DaemonStartError(ToolExceptionBase):
+    """Exception raised when a zygote fails to start a tool's daemon."""
+
+    def __init__(self, tool_name: str, message: str) -> None:
+        super().__init__(tool_name)
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+def get_daemon_file_paths(tool_name: str) -> Tuple[Path, Path, Path]:
+    """Get the paths of a tool daemon's pid, port and socket files."""
     service_runtime_dir_path = get_isolated_service_runtime_dir_for_tool(tool_name)
     pid_file_path = service_runtime_dir_path / f"{tool_name}.pid"
     port_file_path = service_runtime_dir_path / f"{tool_name}.port"
-    return pid_file_path, port_file_path
+    socket_file_path = service_runtime_dir_path / f"{tool_name}.sock"
+    return pid_file_path, port_file_path, socket_file_path
+
+
+def get_imports_file_path(tool_name: str) -> Path:
+    """Get the path of the file recording modules imported by a tool."""
+    service_runtime_dir_path = get_isolated_service_runtime_dir_for_tool(tool_name)
+    return service_runtime_dir_path / f"{tool_name}.imports"
+
+
+def get_control_socket_path(tool_name: str) -> Path:
+    """Get the path of a tool daemon's control socket."""
+    service_runtime_dir_path = get_isolated_service_runtime_dir_for_tool(tool_name)
+    return service_runtime_dir_path / f"{tool_name}.ctl"
+
+
+def get_env_baseline_file_path(tool_name: str) -> Path:
+    """Get the path of the file with a tool daemon's baseline env."""
+    service_runtime_dir_path = get_isolated_service_runtime_dir_for_tool(tool_name)
+    return service_runtime_dir_path / f"{tool_name}.env"
 
 
-def remove_pid_and_port_files(tool_name: str) -> None:
-    for file_path in get_pid_and_port_file_paths(tool_name):
-        if file_path.exists():
+def get_all_daemon_file_paths(tool_name: str) -> List[Path]:
+    """Get the paths of all files a tool's daemon writes while running."""
+    return [
+        *get_daemon_file_paths(tool_name),
+        get_control_socket_path(tool_name),
+        get_env_baseline_file_path(tool_name),
+    ]
+
+
+def remove_daemon_files(tool_name: str) -> None:
+    for file_path in get_all_daemon_file_paths(tool_name):
+        if file_path.is_symlink() or file_path.exists():
             try:
                 file_path.unlink()
             except Exception:
@@ -56,51 +143,206 @@ def remove_pid_and_port_files(tool_name: str) -> None:
 
 
 def daemon_teardown(
-    sock: socket.socket, pid: int, pid_file_path: Path, port_file_path: Path
+    socks: List[socket.socket],
+    pid: int,
+    pid_file_path: Path,
+    other_file_paths: List[Path],
 ) -> None:
-    """Close socket and remove pid and port files upon daemon shutdown."""
-    sock.close()
+    """Close sockets and remove pid, port and socket files upon daemon shutdown."""
+    for sock in socks:
+        sock.close()
     if pid_file_path.exists():
         file_pid = int(pid_file_path.read_text())
         if file_pid == pid:
             pid_file_path.unlink(missing_ok=True)
-            port_file_path.unlink(missing_ok=True)
+            for file_path in other_file_paths:
+                file_path.unlink(missing_ok=True)
+
+
+def link_daemon_files(tool_name: str, other_tool_name: str) -> List[Path]:
+    """Have clients of another tool use a tool's daemon.
+
+    This makes the other tool's daemon files symlinks to this tool's daemon's
+    files.  Returns the paths of the symlinks.
+    """
+    link_paths = get_all_daemon_file_paths(other_tool_name)
+    for file_path, link_path in zip(get_all_daemon_file_paths(tool_name), link_paths):
+        # Replace files atomically, since clients may be reading them.
+        temp_link_path = link_path.with_name(f"{link_path.name}.{os.getpid()}.tmp")
+        temp_link_path.unlink(missing_ok=True)
+        os.symlink(file_path.name, temp_link_path)
+        os.replace(temp_link_path, link_path)
+    return link_paths
+
+
+def unlink_daemon_files(tool_name: str, other_tool_name: str) -> None:
+    """Remove another tool's symlinks to a tool's daemon files.
+
+    This undoes link_daemon_files(), leaving alone any files of a daemon of
+    the other tool's own.
+    """
+    link_paths = get_all_daemon_file_paths(other_tool_name)
+    for file_path, link_path in zip(get_all_daemon_file_paths(tool_name), link_paths):
+        try:
+            if os.readlink(link_path) == file_path.name:
+                link_path.unlink()
+        except OSError:
+            pass
+
+
+def listen_on_unix_socket(socket_file_path: Path) -> Optional[socket.socket]:
+    """Open a listening Unix domain socket, if possible.
+
+    Returns None if this isn't supported, e.g. if the path is too long.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    # Remove a socket file left behind by a daemon which didn't exit cleanly.
+    socket_file_path.unlink(missing_ok=True)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.bind(str(socket_file_path))
+    except OSError:
+        sock.close()
+        return None
+    sock.listen()
+    return sock
+
+
+def start(
+    tool_name: str,
+    daemonize: bool = True,
+    inherited_fds: Optional[Dict[str, int]] = None,
+    on_started: Optional[Callable[[], None]] = None,
+) -> None:
+    """Start a daemon for a tool.
 
+    inherited_fds is given when a daemon re-executes itself; see
+    reexec_daemon().  If not daemonizing, on_started is called once the tool
+    is imported and no other daemon is running for it.
 
-def start(tool_name: str, daemonize: bool = True) -> None:
+    If the tool is in a group of tools (see get_tool_group()), the daemon is
+    started for the group's main tool, and also serves the group's other
+    tools which are installed alongside it.
+    """
     config = read_config()
+    tool_name, other_tool_names = get_tool_group(tool_name, config.tool_groups)
+    if config.zygote and daemonize and inherited_fds is None:
+        start_via_zygote(tool_name)
+        return
 
-    # Import the tool and get its entrypoint function.
+    # Import the tools and get their entrypoint functions.
     #
     # Override sys.stdout and sys.stderr while loading the tool runner,
     # so that any references to them kept during module imports (e.g for
     # setting up logging) already reference the overrides.
     output_redirector = SocketOutputRedirector()
-    with output_redirector.override_outputs_for_imports():
-        tool_entrypoint = get_tool_entrypoint(tool_name)
-        env_before = dict(os.environ)
-        tool_runner = tool_entrypoint.load()
-        env_after = dict(os.environ)
-        env_diff = calc_env_diff(env_before, env_after)
+    import_trainer: Optional[ImportTrainer] = None
+    try:
+        with output_redirector.override_outputs_for_imports():
+            tool_entrypoints = {tool_name: get_tool_entrypoint(tool_name)}
+            # Serve the group's other tools which are installed alongside
+            # this one, skipping those which aren't.
+            for other_tool_name in other_tool_names:
+                try:
+                    other_dir = get_isolated_service_runtime_dir_for_tool(
+                        other_tool_name
+                    )
+                    if other_dir != get_isolated_service_runtime_dir_for_tool(
+                        tool_name
+                    ):
+                        continue
+                    tool_entrypoints[other_tool_name] = get_tool_entrypoint(
+                        other_tool_name
+                    )
+                except ToolExceptionBase:
+                    pass
+            env_before = dict(os.environ)
+            tool_runners = {
+                name: entrypoint.load() for name, entrypoint in tool_entrypoints.items()
+            }
+            if config.import_training:
+                import_trainer = ImportTrainer(get_imports_file_path(tool_name))
+                import_trainer.preimport()
+            env_after = dict(os.environ)
+            env_diff = calc_env_diff(env_before, env_after)
+            env_baseline = EnvBaseline.from_env(env_before)
+
+            # Run the tools' warm-ups, if any, so that caches they populate
+            # are inherited by forked sub-processes.
+            for name, tool_runner in tool_runners.items():
+                tool_warm_up = get_tool_warm_up(name, config.warm_ups)
+                if tool_warm_up is not None:
+                    with output_redirector.discard_outputs():
+                        run_warm_up(name, tool_warm_up, tool_runner)
+    except BaseException:
+        if inherited_fds is not None:
+            # A restarting daemon failed to import the tool's new code.  Have
+            # clients run the tool directly rather than try to connect.
+            remove_daemon_files(tool_name)
+        raise
 
-    pid_file_path, port_file_path = get_pid_and_port_file_paths(tool_name)
+    # Record the files of the modules imported so far, to notice changes.
+    code_fingerprint: Optional[ModuleFilesFingerprint] = None
+    if config.code_check_interval_seconds is not None:
+        code_fingerprint = ModuleFilesFingerprint()
+
+    def preimport() -> None:
+        # Import modules recorded by sub-processes since the daemon started,
+        # so that later sub-processes needn't import them.
+        assert import_trainer is not None
+        with output_redirector.override_outputs_for_imports():
+            imported = import_trainer.preimport()
+        if imported:
+            if code_fingerprint is not None:
+                code_fingerprint.update()
+            if config.gc_freeze:
+                freeze_gc()
+
+    pid_file_path, port_file_path, socket_file_path = get_daemon_file_paths(tool_name)
+
+    if inherited_fds is not None:
+        for fd in inherited_fds.values():
+            os.set_inheritable(fd, False)
 
     if pid_file_path.exists():
         file_pid = int(pid_file_path.read_text())
-        if pid_exists(file_pid):
+        # A re-executed daemon finds its own pid.
+        if pid_exists(file_pid) and file_pid != os.getpid():
             raise DaemonAlreadyExistsError(tool_name=tool_name)
 
     if daemonize:
         print(f'"jumpthegun {tool_name}" daemon process starting...')
         daemonize_func()
+    elif on_started is not None:
+        on_started()
+
+    # Remove symlinks left by a daemon which served this tool along with
+    # others, so that this daemon's files don't overwrite theirs.
+    for file_path in get_all_daemon_file_paths(tool_name):
+        if file_path.is_symlink():
+            file_path.unlink()
 
     # Write pid file.
     pid = os.getpid()
     pid_file_path.write_bytes(b"%d\n" % pid)
 
-    # Open socket.
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.bind(("127.0.0.1", 0))
+    # Write the baseline env file, so that clients can send only env vars
+    # which differ from it.  This is written atomically, since clients must
+    # not read a partial baseline.
+    env_baseline_file_path = get_env_baseline_file_path(tool_name)
+    env_baseline_temp_file_path = env_baseline_file_path.with_name(
+        f"{env_baseline_file_path.name}.{pid}.tmp"
+    )
+    env_baseline_temp_file_path.write_bytes(env_baseline.encode())
+    os.replace(env_baseline_temp_file_path, env_baseline_file_path)
+
+    # Open socket, or use the one of the daemon which re-executed itself.
+    if inherited_fds is not None:
+        sock = socket.socket(fileno=inherited_fds["tcp"])
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
 
     # Write port file.
     host, port = sock.getsockname()
@@ -109,72 +351,281 @@ def start(tool_name: str, daemonize: bool = True) -> None:
     # Listen for connections.
     sock.listen()
     print(f"Listening on {host}:{port} (pid={pid}) ...")
-    sock.settimeout(config.idle_timeout_seconds)
-    subproc_pids: set[int] = set()
+    socks = [sock]
+
+    # Open a Unix domain socket, for clients which support it.  This binds
+    # the socket file directly, so no separate file needs to be written.
+    if config.unix_socket:
+        if inherited_fds is not None:
+            unix_sock = (
+                socket.socket(fileno=inherited_fds["unix"])
+                if "unix" in inherited_fds
+                else None
+            )
+        else:
+            unix_sock = listen_on_unix_socket(socket_file_path)
+        if unix_sock is not None:
+            print(f"Listening on {socket_file_path} (pid={pid}) ...")
+            socks.append(unix_sock)
+
+    # Tune the cyclic GC for sub-processes, and keep it from touching objects
+    # created so far, which sub-processes share with the daemon.
+    if config.gc_thresholds is not None:
+        gc.set_threshold(*config.gc_thresholds)
+    if config.gc_freeze:
+        freeze_gc()
+
+    # Open the control socket, used for querying and controlling the daemon.
+    control_socket_path = get_control_socket_path(tool_name)
+    if inherited_fds is not None:
+        control_sock = (
+            socket.socket(fileno=inherited_fds["control"])
+            if "control" in inherited_fds
+            else None
+        )
+    else:
+        control_sock = listen_on_unix_socket(control_socket_path)
+
+    # Have clients of the other tools served by this daemon connect to it,
+    # unless they have a daemon of their own.
+    link_paths: List[Path] = []
+    for other_tool_name in tool_runners:
+        if other_tool_name == tool_name:
+            continue
+        other_pid_file_path = get_daemon_file_paths(other_tool_name)[0]
+        if other_pid_file_path.exists():
+            file_pid = int(other_pid_file_path.read_text())
+            if pid_exists(file_pid) and file_pid != pid:
+                print(f'"jumpthegun {other_tool_name}" has a daemon of its own.')
+                continue
+        link_paths.extend(link_daemon_files(tool_name, other_tool_name))
+        print(f'Serving "{other_tool_name}" too (pid={pid}) ...')
+
+    child_registry = ChildRegistry()
+    server = DaemonServer(
+        socks=socks,
+        control_sock=control_sock,
+        pid_file_path=pid_file_path,
+        child_registry=child_registry,
+        idle_timeout_seconds=config.idle_timeout_seconds,
+        pool_size=config.pool_size,
+        preimport=None if import_trainer is None else preimport,
+        max_concurrent_children=config.get_max_concurrent_children(),
+        max_queued_connections=config.max_queued_connections,
+        code_changed=None if code_fingerprint is None else code_fingerprint.changed,
+        code_check_interval_seconds=config.code_check_interval_seconds,
+    )
+    daemon_files = [
+        port_file_path,
+        socket_file_path,
+        control_socket_path,
+        env_baseline_file_path,
+        *link_paths,
+    ]
     try:
-        while True:
-            conn, address = sock.accept()
-            print(f"Got connection from: {address}")
-            newpid = os.fork()
-            if newpid == 0:
-                break
-
-            # Avoid "zombie" processes: Reap completed sub-processes.
-            done_subproc_pids = {
-                x for x in subproc_pids if os.waitpid(x, os.WNOHANG)[0] != 0
-            }
-            subproc_pids -= done_subproc_pids
-            subproc_pids.add(newpid)
-    except BaseException as exc:
+        conn = server.serve()
+    except BaseException:
         # Server is exiting: Clean up as needed.
-        sock.close()
-        if pid_file_path.exists():
-            file_pid = int(pid_file_path.read_text())
-            if file_pid == pid:
-                pid_file_path.unlink(missing_ok=True)
-                port_file_path.unlink(missing_ok=True)
-        if isinstance(exc, socket.timeout):
-            print(
-                f"Exiting after receiving no connections for {config.idle_timeout_seconds} seconds."
-            )
-            return
+        if os.getpid() == pid:
+            child_registry.close()
+            if control_sock is not None:
+                control_sock.close()
+        daemon_teardown(socks, pid, pid_file_path, daemon_files)
         raise
-
-    # Send pid.
-    conn.sendall(b"%d\n" % os.getpid())
+    if conn is None:
+        child_registry.close()
+        if server.restart_requested:
+            print(server.exit_reason)
+            reexec_daemon(tool_name, socks, control_sock, env_before)
+        if control_sock is not None:
+            control_sock.close()
+        daemon_teardown(socks, pid, pid_file_path, daemon_files)
+        print(server.exit_reason)
+        return
+
+    # Send pid, along with the baseline env's hash.
+    conn.sendall(b"%d %b\n" % (os.getpid(), env_baseline.hash.encode()))
 
     rfile = conn.makefile("rb", 0)
 
-    # Read and set argv
-    argv_bytes = rfile.read(int(rfile.readline()))
+    # Read headers, replying with the protocol version to be used if the
+    # client requested one.
+    request_headers, argv_length_line = read_request_headers(rfile, conn)
+    if request_headers.protocol_version is not None:
+        conn.sendall(b"v%d\n" % request_headers.protocol_version)
+    protocol_version = request_headers.protocol_version or 1
+
+    # Run the tool requested by the client, for daemons serving several tools.
+    if request_headers.tool_name is not None:
+        if request_headers.tool_name not in tool_runners:
+            raise Exception(
+                f"Tool not served by this daemon: {request_headers.tool_name}"
+            )
+        tool_name = request_headers.tool_name
+    tool_runner = tool_runners[tool_name]
+
+    # Read argv and cwd, or those of each command of a batch.
+    batch_jobs: Optional[List[Tuple[bytes, bytes]]] = None
+    if request_headers.batch is not None:
+        if protocol_version < 2:
+            raise Exception("Batches require protocol version 2.")
+        batch_jobs = read_batch_jobs(rfile, int(argv_length_line))
+    else:
+        argv_bytes = rfile.read(int(argv_length_line))
+        pwd = rfile.read(int(rfile.readline()))
+
+    # Read and set env vars
+    if request_headers.env_entries:
+        changed, deleted = parse_env_entries(read_env_entries(rfile))
+        request_received_us = now_us()
+        if request_headers.env_baseline_hash is None:
+            apply_env_with_diff(changed, env_diff)
+        elif request_headers.env_baseline_hash == env_baseline.hash:
+            apply_env_delta(changed, deleted, env_diff)
+        else:
+            raise Exception("Received env vars relative to a different baseline.")
+    else:
+        env_vars_str: str = (rfile.read(int(rfile.readline())) or b"").decode()
+        request_received_us = now_us()
+        split_lines = (line.split("=", 1) for line in env_vars_str.split("\0"))
+        env: Dict[str, str] = dict(line for line in split_lines if len(line) == 2)
+        env.pop("_", None)
+        apply_env_with_diff(env, env_diff)
+
+    if batch_jobs is not None:
+        # Run each command of the batch in a forked process, which continues
+        # from here with a socket pair to this process instead of the
+        # connection.
+        max_parallel = config.get_max_concurrent_children() or os.cpu_count() or 1
+        if request_headers.batch:
+            max_parallel = min(max_parallel, request_headers.batch)
+        batch_job = BatchRunner(conn, batch_jobs, max_parallel).run()
+        if batch_job is None:
+            conn.close()
+            sys.exit(0)
+        rfile.close()
+        conn, argv_bytes, pwd = batch_job
+
+    # Set argv and cwd
     sys.argv[1:] = shlex.split(argv_bytes.decode()) if argv_bytes else []
     sys.argv[0] = tool_name
-
-    # Read and set cwd
-    pwd = rfile.read(int(rfile.readline()))
+    child_registry.report_args(sys.argv)
     if not pwd:
         raise Exception("Did not receive pwd from client.")
     os.chdir(pwd)
 
-    # Read and set env vars
-    env_vars_str: str = (rfile.read(int(rfile.readline())) or b"").decode()
-    split_lines = (line.split("=", 1) for line in env_vars_str.split("\0"))
-    env: Dict[str, str] = dict(line for line in split_lines if len(line) == 2)
-    env.pop("_", None)
-    apply_env_with_diff(env, env_diff)
+    # Trace the phases of running the command, if the client requested it.
+    trace_file_path = os.environ.get(TRACE_ENV_VAR)
+    trace: Optional[Trace] = None
+    if trace_file_path:
+        trace = Trace(f"jumpthegun {tool_name} daemon sub-process")
+        assert server.accept_time is not None
+        trace.mark("accept", monotonic_to_us(server.accept_time))
+        trace.mark("request_received", request_received_us)
+        trace.mark("env_applied")
+
+    stdin_wrapper: Optional[StdinWrapper] = None
+    if batch_jobs is not None:
+        # Commands of a batch get no input.
+        output_redirector.set_socket(conn, protocol_version=protocol_version)
+        sys.stdin.close()
+        sys.stdin = open(os.devnull)
+    elif len(request_headers.fds) == 3:
+        # The client passed its stdin, stdout and stderr, so use them directly
+        # rather than relaying all input and output via the connection.
+        # Output still buffered in the daemon's streams mustn't be written
+        # to the client's.
+        sys.stdout.flush()
+        sys.stderr.flush()
+        stdin_encoding = sys.stdin.encoding
+        sys.stdin.close()
+        for target_fd, fd in enumerate(request_headers.fds):
+            if fd != target_fd:
+                os.dup2(fd, target_fd)
+                os.close(fd)
+        output_redirector.set_std_fds(conn, protocol_version=protocol_version)
+        sys.stdin = io.TextIOWrapper(
+            io.open(0, "rb", closefd=False), encoding=stdin_encoding
+        )
+    else:
+        for fd in request_headers.fds:
+            os.close(fd)
+        output_redirector.set_socket(conn, protocol_version=protocol_version)
+        sys.stdin.close()
+        stdin_wrapper = StdinWrapper(
+            conn,
+            protocol_version=protocol_version,
+            output_buffer=output_redirector.output_buffer,
+        )
+        sys.stdin = io.TextIOWrapper(cast(BinaryIO, stdin_wrapper))
+    output_redirector.flush_on_sigterm()
+
+    if import_trainer is not None:
+        import_trainer.snapshot_modules()
+
+    if trace is not None:
+        trace.mark("tool_runner_entry")
+
+    # Split file arguments between several processes, if configured to.
+    shards_args = None
+    sharding_options = config.get_sharding_options(tool_name)
+    if sharding_options is not None:
+        shards_args = split_file_args(
+            sys.argv[1:],
+            sharding_options.shards,
+            sharding_options.file_suffixes,
+            sharding_options.value_options,
+        )
+
+    exit_code = 1
+    try:
+        if shards_args is not None:
+            assert sharding_options is not None
+            exit_code = run_sharded(
+                lambda: call_tool_runner(tool_runner),
+                shards_args,
+                sharding_options.exit_code,
+            )
+        else:
+            exit_code = call_tool_runner(tool_runner)
+    finally:
+        output_redirector.flush()
+        output_redirector.output_buffer.send(
+            encode_exit_code(exit_code, protocol_version)
+        )
+        exit_time = time.monotonic()
+        if trace is not None:
+            trace.mark("rc_sent")
+            first_output_time = output_redirector.output_buffer.first_output_time
+            if first_output_time is not None:
+                trace.mark("first_output", monotonic_to_us(first_output_time))
+        # print(f"Goodbye! rc={exit_code}", file=sys.__stdout__)
+
+        sys.stdin.close()
+        sys.stdout.close()
+        sys.stderr.close()
+        conn.shutdown(socket.SHUT_WR)
+        report_stats(
+            child_registry,
+            server,
+            output_redirector,
+            stdin_wrapper,
+            exit_time,
+        )
+        if trace is not None and trace_file_path:
+            trace.write(trace_file_path)
+        if import_trainer is not None:
+            # This is done after the client has the exit code, to not delay it.
+            import_trainer.record_imports()
+        sys.exit(0)
 
-    sys.stdin.close()
-    sys.stdin = io.TextIOWrapper(cast(BinaryIO, StdinWrapper(conn)))
-    output_redirector.set_socket(conn)
 
-    # start_time = time.monotonic()
+def call_tool_runner(tool_runner: Callable[[], Any]) -> int:
+    """Run a tool, returning its exit code."""
     exit_code: int
     try:
         retval = tool_runner()
     except BaseException as exc:
-        # end_time = time.monotonic()
-        # print(f"Time: {end_time - start_time}", file=sys.__stdout__)
-        # print("EXCEPTION", str(exc), file=sys.__stderr__)
         if isinstance(exc, SystemExit):
             exit_code = exc.code if isinstance(exc.code, int) else 1
         else:
@@ -190,25 +641,201 @@ def start(tool_name: str, daemonize: bool = True) -> None:
             exit_code = retval
         else:
             exit_code = 0
+    return exit_code
+
+
+def start_via_zygote(tool_name: str) -> None:
+    """Have the zygote for this environment start a tool's daemon.
+
+    The zygote is started first if it isn't running.
+    """
+    service_runtime_dir_path = get_isolated_service_runtime_dir_for_tool(tool_name)
+    zygote_name = get_zygote_name()
+    socket_path = service_runtime_dir_path / f"{zygote_name}.sock"
+    reply = send_start_request(socket_path, tool_name)
+    if reply is None:
+        # Avoid concurrently starting multiple zygotes.
+        with FileLock(service_runtime_dir_path / f"{zygote_name}.lock"):
+            if not zygote_is_listening(socket_path):
+                spawn_zygote(socket_path)
+        reply = send_start_request(socket_path, tool_name)
+        if reply is None:
+            raise DaemonStartError(tool_name, "Failed to start the zygote.")
+    if "error" in reply:
+        raise DaemonStartError(tool_name, reply["error"])
+    print(f'"jumpthegun {tool_name}" daemon process starting...')
+
+
+def spawn_zygote(socket_path: Path) -> None:
+    """Start a zygote in the background.
+
+    The zygote's socket is opened here and passed to it, so that requests
+    may be sent right away, to be handled once the zygote is ready.
+    """
+    sock = listen_on_unix_socket(socket_path)
+    if sock is None:
+        raise Exception(f"Failed to listen on the zygote's socket: {socket_path}")
+    with sock:
+        subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                "import sys; from jumpthegun.jumpthegunctl import run_zygote;"
+                " run_zygote(int(sys.argv[1]), sys.argv[2])",
+                str(sock.fileno()),
+                str(socket_path),
+            ],
+            pass_fds=[sock.fileno()],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+
+
+def run_zygote(socket_fd: int, socket_path: str) -> None:
+    """Run a zygote, listening on an inherited socket; see zygote.py."""
+    config = read_config()
+    sock = socket.socket(fileno=socket_fd)
+    preimport_common_modules()
+    if config.gc_freeze:
+        freeze_gc()
+
+    zygote_pid = os.getpid()
+    zygote = Zygote(sock, idle_timeout_seconds=config.idle_timeout_seconds)
+    try:
+        result = zygote.serve()
     finally:
-        conn.sendall(b"rc=%d\n" % exit_code)
-        # print(f"Goodbye! rc={exit_code}", file=sys.__stdout__)
+        if os.getpid() == zygote_pid:
+            # Remove the socket file before closing the socket, so that a new
+            # zygote's socket file isn't removed.
+            Path(socket_path).unlink(missing_ok=True)
+            sock.close()
+    if result is None:
+        return
+
+    # In a forked process: Start the daemon as the requesting process would.
+    conn, (tool_name, cwd, env) = result
+    os.chdir(cwd)
+    os.environ.clear()
+    os.environ.update(env)
+    replied = False
+
+    def on_started() -> None:
+        nonlocal replied
+        replied = True
+        send_reply(conn, {"pid": os.getpid()})
 
-        sys.stdin.close()
-        sys.stdout.close()
-        sys.stderr.close()
-        conn.shutdown(socket.SHUT_WR)
-        sys.exit(0)
+    try:
+        start(tool_name, daemonize=False, on_started=on_started)
+    except Exception as exc:
+        if replied:
+            raise
+        if isinstance(exc, ToolExceptionBase):
+            send_reply(conn, {"error": str(exc)})
+        else:
+            send_reply(conn, {"error": f"Failed to start the daemon: {exc!r}"})
+
+
+def reexec_daemon(
+    tool_name: str,
+    socks: List[socket.socket],
+    control_sock: Optional[socket.socket],
+    env: Dict[str, str],
+) -> NoReturn:
+    """Replace the daemon process with a fresh one, which imports the tool anew.
+
+    The new daemon keeps the pid and the listening sockets, so clients
+    connecting meanwhile wait until it is ready rather than failing.
+    Sub-processes which are running continue, and are reaped by the new
+    daemon.  It is run with the env the daemon was started with, so that its
+    baseline env is the same.
+    """
+    fds = {
+        "tcp" if sock.family != getattr(socket, "AF_UNIX", None) else "unix": sock
+        for sock in socks
+    }
+    if control_sock is not None:
+        fds["control"] = control_sock
+    for sock in fds.values():
+        sock.set_inheritable(True)
+    inherit_fds_option = "--inherit-fds=" + ",".join(
+        f"{name}={sock.fileno()}" for name, sock in fds.items()
+    )
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execve(
+        sys.executable,
+        [
+            sys.executable,
+            "-c",
+            "from jumpthegun.jumpthegunctl import main; main()",
+            "start",
+            tool_name,
+            inherit_fds_option,
+        ],
+        env,
+    )
+
+
+def report_stats(
+    child_registry: ChildRegistry,
+    server: DaemonServer,
+    output_redirector: SocketOutputRedirector,
+    stdin_wrapper: Optional[StdinWrapper],
+    exit_time: float,
+) -> None:
+    """Report statistics about a sub-process's run to the daemon."""
+    assert server.accept_time is not None
+    output_buffer = output_redirector.output_buffer
+    time_to_first_output = None
+    if output_buffer.first_output_time is not None:
+        time_to_first_output = output_buffer.first_output_time - server.accept_time
+    memory_bytes = None
+    if os.environ.get("JUMPTHEGUN_MEMORY_REPORT"):
+        memory_usage = get_memory_usage()
+        if memory_usage is not None:
+            memory_bytes = {
+                kind: kib * 1024
+                for kind, kib in dataclasses.asdict(memory_usage).items()
+            }
+    child_registry.report_stats(
+        time_to_first_output=time_to_first_output,
+        time_to_exit=exit_time - server.accept_time,
+        relayed_bytes={
+            "stdin": 0 if stdin_wrapper is None else stdin_wrapper.bytes_received,
+            "stdout": output_buffer.bytes_written.get(b"1", 0),
+            "stderr": output_buffer.bytes_written.get(b"2", 0),
+        },
+        memory_bytes=memory_bytes,
+    )
 
 
 def stop(tool_name: str) -> None:
+    """Stop the daemon serving a tool.
+
+    If the tool is in a group of tools (see get_tool_group()) and hasn't a
+    daemon of its own, the daemon of the group's main tool is stopped.
+    """
+    config = read_config()
     try:
         get_tool_entrypoint(tool_name)
+        main_tool_name, other_tool_names = get_tool_group(tool_name, config.tool_groups)
+        own_pid_file_path = get_daemon_file_paths(tool_name)[0]
+        if (
+            main_tool_name != tool_name
+            and own_pid_file_path.exists()
+            and not own_pid_file_path.is_symlink()
+            and pid_exists(int(own_pid_file_path.read_text()))
+        ):
+            main_tool_name, other_tool_names = tool_name, []
+        pid_file_path, _port_file_path, _socket_file_path = get_daemon_file_paths(
+            main_tool_name
+        )
     except ToolExceptionBase:
         raise DaemonDoesNotExistError(tool_name)
 
     try:
-        pid_file_path, _port_file_path = get_pid_and_port_file_paths(tool_name)
         if not pid_file_path.exists():
             raise DaemonDoesNotExistError(tool_name)
 
@@ -224,20 +851,74 @@ def stop(tool_name: str) -> None:
         else:
             os.kill(file_pid, signal.SIGKILL)
 
-        print(f'"jumpthegun {tool_name}" daemon process stopped.')
+        print(f'"jumpthegun {main_tool_name}" daemon process stopped.')
 
     finally:
-        remove_pid_and_port_files(tool_name)
+        remove_daemon_files(main_tool_name)
+        for other_tool_name in other_tool_names:
+            try:
+                unlink_daemon_files(main_tool_name, other_tool_name)
+            except ToolExceptionBase:
+                pass
+
+
+def send_control_command(tool_name: str, command: str) -> Dict[str, Any]:
+    """Send a command to a tool's daemon via its control socket.
+
+    Returns the daemon's reply.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        raise DaemonDoesNotExistError(tool_name)
+    control_socket_path = get_control_socket_path(tool_name)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(5)
+        try:
+            sock.connect(str(control_socket_path))
+        except OSError:
+            raise DaemonDoesNotExistError(tool_name)
+        sock.sendall(command.encode() + b"\n")
+        reply = sock.makefile("rb").readline()
+    return json.loads(reply)
+
+
+def status(tool_name: str) -> None:
+    print(json.dumps(send_control_command(tool_name, "status"), indent=2))
+
+
+def stats(tool_name: str, prometheus: bool = False) -> None:
+    daemon_stats = send_control_command(tool_name, "stats")
+    if prometheus:
+        print(format_prometheus(tool_name, daemon_stats), end="")
+    else:
+        print(json.dumps(daemon_stats, indent=2))
 
 
 def print_usage() -> None:
     """Print a message about how to run jumpthegunctl."""
-    print(f"Usage: {sys.argv[0]} start|stop tool_name")
+    print(f"Usage: {sys.argv[0]} start|stop|restart|status tool_name")
+    print(f"       {sys.argv[0]} stats tool_name [--prometheus]")
 
 
-def do_action(tool_name: str, action: str) -> None:
+def do_action(tool_name: str, action: str, options: Sequence[str] = ()) -> None:
     """Apply an action (e.g. start or stop) for a given tool."""
-    if action == "start":
+    if action == "stats" and set(options) <= {"--prometheus"}:
+        stats(tool_name, prometheus="--prometheus" in options)
+    elif (
+        action == "start"
+        and len(options) == 1
+        and options[0].startswith("--inherit-fds=")
+    ):
+        # Used by reexec_daemon().
+        inherited_fds = {
+            name: int(fd)
+            for name, fd in (
+                item.split("=") for item in options[0].split("=", 1)[1].split(",")
+            )
+        }
+        start(tool_name, daemonize=False, inherited_fds=inherited_fds)
+    elif options:
+        raise InvalidCommand(" ".join([action, *options]))
+    elif action == "start":
         start(tool_name)
     elif action == "stop":
         stop(tool_name)
@@ -247,6 +928,8 @@ def do_action(tool_name: str, action: str) -> None:
         except DaemonDoesNotExistError:
             pass
         start(tool_name)
+    elif action == "status":
+        status(tool_name)
     else:
         raise InvalidCommand(action)
 
@@ -263,12 +946,12 @@ def main() -> None:
         if cmd == "version" or cmd == "--version":
             print(f"jumpthegun v{__version__}")
             sys.exit(0)
-    elif len(args) == 2:
-        (cmd, tool_name) = args
+    elif len(args) >= 2:
+        cmd, tool_name, *options = args
         tool_name = tool_name.strip().lower()
 
         try:
-            do_action(tool_name=tool_name, action=cmd)
+            do_action(tool_name=tool_name, action=cmd, options=options)
         except ToolExceptionBase as exc:
             print(str(exc))
             sys.exit(1)
@@ -0,0 +1,63 @@
+import gc
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+__all__ = [
+    "freeze_gc",
+    "MemoryUsage",
+    "get_memory_usage",
+]
+
+
+@dataclass
+class MemoryUsage:
+    """A process's memory usage, in KiB.
+
+    Shared memory is shared with other processes, e.g. pages of a forked
+    sub-process not yet written to since the fork (copy-on-write), while
+    private memory is used only by this process.
+    """
+
+    rss: int
+    pss: int
+    shared: int
+    private: int
+
+
+def get_memory_usage() -> Optional[MemoryUsage]:
+    """Get the current process's memory usage.
+
+    This is only supported on Linux; returns None where not supported.
+    """
+    fields: Dict[str, int] = {}
+    # smaps_rollup is much faster to read, but requires Linux 4.14+.
+    for file_path in ("/proc/self/smaps_rollup", "/proc/self/smaps"):
+        try:
+            with open(file_path, "rb") as f:
+                for line in f:
+                    name, sep, value = line.partition(b":")
+                    if not sep or not value.endswith(b" kB\n"):
+                        continue
+                    key = name.decode()
+                    fields[key] = fields.get(key, 0) + int(value[:-4])
+        except OSError:
+            continue
+        break
+    if "Rss" not in fields:
+        return None
+    return MemoryUsage(
+        rss=fields["Rss"],
+        pss=fields.get("Pss", 0),
+        shared=fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        private=fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    )
+
+
+def freeze_gc() -> None:
+    """Collect garbage, then make the cyclic GC ignore all existing objects.
+
+    Otherwise, the GC would write to these objects in forked sub-processes,
+    copying memory pages which would otherwise stay shared with the daemon.
+    """
+    gc.collect()
+    gc.freeze()
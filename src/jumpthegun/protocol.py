@@ -0,0 +1,237 @@
+"""The JumpTheGun protocol, spoken between clients and daemons.
+
+Upon connecting, the daemon sends the pid of the process handling the
+connection, as a line.  The pid may be followed by a space and the hash of
+the daemon's baseline env (see below).  The client then sends optional
+header lines, each beginning with a letter, followed by the argv, cwd and
+env vars, each preceded by a line with its length.  The env vars are sent
+as NUL-separated "NAME=value" entries.
+
+Alternatively, after an "e" header line, the env vars are sent as a line
+with the number of entries, followed by each entry preceded by a line with
+its length.  If the header has the hash of the daemon's baseline env, e.g.
+"e0123456789abcdef", the entries are only those which differ from the
+baseline: "NAME=value" entries set env vars, and "NAME" entries delete them.
+Daemons write their baseline env to a file, so that clients can send only
+the differences.  Since no NUL separators are needed, this is also simple to
+implement in Bash without writing temporary files.
+
+A daemon may serve several tools, e.g. console scripts of the same package.
+A "t<tool name>" header line selects which of them to run; without it, the
+daemon runs the tool it is named after.
+
+A daemon which is too busy to handle a connection sends a "busy" line
+instead of the pid, and closes the connection.  The client should then run
+the tool directly.
+
+Version 1 of the protocol is line-based, to be simple to implement in
+Bash.  Output is sent as a line with the channel ("1" for stdout or "2" for
+stderr) followed by the number of newlines in the data, then the data and a
+final newline.  A "3" line requests a line of input, which the client
+answers with a line with its length followed by the line, a length of zero
+signaling EOF.  "rc=<exit code>" ends the session.
+
+Version 2 is requested by the client sending a "v2" header line; the daemon
+replies with a "v<version>" line with the version it will use.  Everything
+the daemon sends after that is in frames: a channel byte, the payload
+length as a 32-bit unsigned big-endian integer, and the payload.  Output
+payloads are the data as written, so clients can copy them as-is.  Input
+is streamed with credit-based flow control: a stdin frame grants the client
+credit to send a number of bytes of input, as chunks of a length followed
+by that many bytes, whenever input is available.  The total length of the
+chunks mustn't exceed the credit granted so far.  A chunk with a length of
+zero signals EOF, and may be sent without credit.  An exit frame holds the
+exit code as a 32-bit signed big-endian integer.
+
+Over Unix domain sockets, a client may instead pass its stdin, stdout and
+stderr file descriptors to the daemon, by sending an "f" header line
+followed by a single byte carrying the file descriptors as SCM_RIGHTS
+ancillary data.  The command then reads and writes them directly, and only
+the exit code is sent over the connection.  If the daemon doesn't receive
+the file descriptors, e.g. over TCP, it uses the protocol as usual.
+
+A client may send a batch of commands to run over a single connection, by
+sending a "b" header line, optionally with the maximum number of commands
+to run at once, e.g. "b4".  This requires protocol version 2.  Instead of
+the argv and cwd, the client sends the number of commands as a line,
+followed by the argv and cwd of each, preceded by their lengths as usual.
+The env vars are sent once, for all commands.  The commands get no input.
+The daemon sends frames of all commands' outputs and exit codes as they run,
+with each frame's payload prefixed by the index of the command in the batch,
+as a 32-bit unsigned big-endian integer.
+"""
+
+import array
+import io
+import socket
+import struct
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple, Union
+
+__all__ = [
+    "PROTOCOL_VERSION",
+    "BUSY",
+    "STDOUT",
+    "STDERR",
+    "STDIN",
+    "EXIT",
+    "FRAME_HEADER",
+    "U32",
+    "I32",
+    "RequestHeaders",
+    "encode_frame",
+    "encode_batch_frame",
+    "encode_batch_jobs",
+    "read_batch_jobs",
+    "encode_env_entries",
+    "read_env_entries",
+    "read_request_headers",
+    "send_fds",
+    "recv_fds",
+]
+
+PROTOCOL_VERSION = 2
+
+# Sent instead of the pid when the daemon won't handle a connection.
+BUSY = b"busy\n"
+
+# Frame channels.
+STDOUT = b"1"
+STDERR = b"2"
+STDIN = b"3"
+EXIT = b"x"
+
+FRAME_HEADER = struct.Struct("!cI")
+U32 = struct.Struct("!I")
+I32 = struct.Struct("!i")
+
+
+def encode_frame(channel: bytes, payload: Union[bytes, bytearray, memoryview]) -> bytes:
+    """Encode a version 2 frame."""
+    return FRAME_HEADER.pack(channel, len(payload)) + payload
+
+
+def encode_batch_frame(
+    channel: bytes, job_index: int, payload: Union[bytes, bytearray, memoryview]
+) -> bytes:
+    """Encode a frame of one of the commands of a batch."""
+    return (
+        FRAME_HEADER.pack(channel, U32.size + len(payload))
+        + U32.pack(job_index)
+        + payload
+    )
+
+
+@dataclass
+class RequestHeaders:
+    """Options requested by a client via header lines."""
+
+    protocol_version: Optional[int] = None
+    fds: List[int] = field(default_factory=list)
+    # Whether env vars are sent as entries, and if so, the hash of the
+    # baseline env they are relative to, if any.
+    env_entries: bool = False
+    env_baseline_hash: Optional[str] = None
+    # The tool to run, for daemons serving several tools.
+    tool_name: Optional[str] = None
+    # For batches of commands, the maximum number to run at once, or 0 for
+    # the daemon's default.
+    batch: Optional[int] = None
+
+
+def read_request_headers(
+    rfile: io.RawIOBase, sock: Optional[socket.socket] = None
+) -> Tuple[RequestHeaders, bytes]:
+    """Read a client's header lines.
+
+    Returns the requested options and the line following the headers.
+
+    If a socket is given, file descriptors passed by the client are received
+    from it.  The socket must be the one rfile reads from, and rfile must be
+    unbuffered.
+    """
+    headers = RequestHeaders()
+    while True:
+        line = rfile.readline()
+        if not line[:1].isalpha():
+            return headers, line
+        if line.startswith(b"v"):
+            headers.protocol_version = min(int(line[1:]), PROTOCOL_VERSION)
+        elif line == b"f\n" and sock is not None:
+            headers.fds = recv_fds(sock, 3)
+        elif line.startswith(b"e"):
+            headers.env_entries = True
+            headers.env_baseline_hash = line[1:].strip().decode() or None
+        elif line.startswith(b"t"):
+            headers.tool_name = line[1:].rstrip(b"\n").decode() or None
+        elif line.startswith(b"b"):
+            headers.batch = int(line[1:].strip() or 0)
+
+
+def encode_env_entries(entries: Sequence[bytes]) -> bytes:
+    """Encode env var entries, as sent after an "e" header line."""
+    return b"%d\n" % len(entries) + b"".join(
+        [b"%d\n%b" % (len(entry), entry) for entry in entries]
+    )
+
+
+def read_env_entries(rfile: io.RawIOBase) -> List[bytes]:
+    """Read env var entries, as sent after an "e" header line."""
+    n_entries = int(rfile.readline())
+    return [_read_exactly(rfile, int(rfile.readline())) for _i in range(n_entries)]
+
+
+def encode_batch_jobs(jobs: Sequence[Tuple[bytes, bytes]]) -> bytes:
+    """Encode the argv and cwd of each command of a batch."""
+    return b"%d\n" % len(jobs) + b"".join(
+        [
+            b"%d\n%b%d\n%b" % (len(argv_bytes), argv_bytes, len(cwd_bytes), cwd_bytes)
+            for argv_bytes, cwd_bytes in jobs
+        ]
+    )
+
+
+def read_batch_jobs(rfile: io.RawIOBase, n_jobs: int) -> List[Tuple[bytes, bytes]]:
+    """Read the argv and cwd of each command of a batch.
+
+    The line with the number of commands must have been read beforehand.
+    """
+    return [
+        (
+            _read_exactly(rfile, int(rfile.readline())),
+            _read_exactly(rfile, int(rfile.readline())),
+        )
+        for _i in range(n_jobs)
+    ]
+
+
+def _read_exactly(rfile: io.RawIOBase, length: int) -> bytes:
+    data = b""
+    while len(data) < length:
+        chunk = rfile.read(length - len(data))
+        if not chunk:
+            raise EOFError("Connection closed.")
+        data += chunk
+    return data
+
+
+def send_fds(sock: socket.socket, fds: Sequence[int]) -> None:
+    """Send file descriptors over a Unix domain socket, with a single byte."""
+    sock.sendmsg(
+        [b"\0"], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))]
+    )
+
+
+def recv_fds(sock: socket.socket, max_fds: int) -> List[int]:
+    """Receive file descriptors sent with send_fds().
+
+    Returns an empty list if none were received, e.g. over TCP.
+    """
+    fds = array.array("i")
+    _msg, ancdata, _flags, _addr = sock.recvmsg(
+        1, socket.CMSG_LEN(max_fds * fds.itemsize)
+    )
+    for cmsg_level, cmsg_type, cmsg_data in ancdata:
+        if cmsg_level == socket.SOL_SOCKET and cmsg_type == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg_data[: len(cmsg_data) - len(cmsg_data) % fds.itemsize])
+    return list(fds)
@@ -1,14 +1,15 @@
 import hashlib
 import os
 import random
-import shlex
 import string
-import subprocess
 import tempfile
 from pathlib import Path
 
 from jumpthegun._vendor.filelock import FileLock
 
+from .tools import ExecutableNotFound
+from .utils import find_executable
+
 
 def get_jumpthegun_runtime_dir() -> Path:
     runtime_dir = os.getenv("XDG_RUNTIME_DIR")
@@ -43,13 +44,12 @@ def get_jumpthegun_runtime_dir() -> Path:
 
 
 def get_isolated_service_runtime_dir_for_tool(tool_name: str) -> Path:
-    tool_executable_path: bytes = subprocess.run(
-        f"command -v {shlex.quote(tool_name)}",
-        shell=True,
-        check=True,
-        capture_output=True,
-    ).stdout.strip()
-    return get_isolated_service_runtime_dir_for_executable(tool_executable_path)
+    tool_executable_path = find_executable(tool_name)
+    if tool_executable_path is None:
+        raise ExecutableNotFound(tool_name)
+    return get_isolated_service_runtime_dir_for_executable(
+        os.fsencode(tool_executable_path)
+    )
 
 
 def get_isolated_service_runtime_dir_for_executable(executable_path: bytes) -> Path:
@@ -0,0 +1,442 @@
+import functools
+import json
+import os
+import select
+import signal
+import socket
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from .child_registry import ChildRegistry
+from .event_loop import EventLoop
+from .memory import get_memory_usage
+from .protocol import BUSY
+from .stats import StatsCollector
+
+__all__ = [
+    "DaemonServer",
+]
+
+
+class DaemonServer:
+    """The daemon process's main loop.
+
+    A single event loop multiplexes the listening sockets, the control
+    socket, notifications of sub-processes accepting connections and
+    exiting, and timers for housekeeping: the idle timeout, checking that
+    the daemon's pid file is still in place, checking whether the tool's
+    code has changed, pre-importing modules which sub-processes recorded
+    importing, and refilling the pool of pre-forked sub-processes.
+
+    Without a pool, the daemon accepts all pending connections whenever a
+    listening socket is readable, forking a sub-process to handle each one.
+
+    With a pool, each pooled sub-process accepts a single connection and
+    reports this to the daemon process via a pipe, upon which the daemon
+    process forks a replacement.  This keeps the cost of forking off of the
+    critical path of handling new connections.
+
+    The number of concurrently running sub-processes may be limited.
+    Without a pool, connections arriving at the limit are queued, and are
+    handed to sub-processes as running ones exit.  Connections arriving
+    when the queue is full are shed: the client is told that the daemon is
+    busy, and runs the tool directly instead.  With a pool, the pool isn't
+    refilled beyond the limit, so connections wait in the listening
+    sockets' backlog.
+    """
+
+    housekeeping_interval_seconds = 10.0
+    # Reading newly recorded imports is cheap, and the sooner they are
+    # imported, the more sub-processes are forked with them already imported.
+    preimport_interval_seconds = 1.0
+    max_control_request_size = 4096
+
+    exit_reason: Optional[str]
+    # Whether the daemon is exiting to be restarted, since the tool's code
+    # changed.
+    restart_requested: bool
+    # In sub-processes, the time.monotonic() time when the connection was
+    # accepted.
+    accept_time: Optional[float]
+
+    def __init__(
+        self,
+        socks: List[socket.socket],
+        control_sock: Optional[socket.socket],
+        pid_file_path: Path,
+        child_registry: ChildRegistry,
+        idle_timeout_seconds: Optional[int],
+        pool_size: int = 0,
+        preimport: Optional[Callable[[], None]] = None,
+        max_concurrent_children: Optional[int] = None,
+        max_queued_connections: Optional[int] = None,
+        code_changed: Optional[Callable[[], bool]] = None,
+        code_check_interval_seconds: Optional[float] = None,
+    ) -> None:
+        self._socks = socks
+        self._control_sock = control_sock
+        self._pid_file_path = pid_file_path
+        self._child_registry = child_registry
+        self._idle_timeout_seconds = idle_timeout_seconds
+        self._pool_size = pool_size
+        self._preimport = preimport
+        self._max_concurrent_children = max_concurrent_children
+        self._max_queued_connections = max_queued_connections
+        self._code_changed = code_changed
+        self._code_check_interval_seconds = code_check_interval_seconds
+
+        self._pid = os.getpid()
+        self._loop = EventLoop()
+        self._last_activity = time.monotonic()
+        self._idle_pids: Set[int] = set()
+        self._control_bufs: Dict[socket.socket, bytearray] = {}
+        self._queued_conns: Deque[Tuple[socket.socket, float]] = deque()
+        self._n_shed = 0
+        self._stats = StatsCollector()
+        self.exit_reason = None
+        self.restart_requested = False
+        self.accept_time = None
+
+    def serve(self) -> Optional[socket.socket]:
+        """Serve connections.
+
+        Returns the accepted connection in forked sub-processes.  In the
+        daemon process, returns None when the daemon should exit, with the
+        reason in .exit_reason.
+        """
+        loop = self._loop
+        for sock in self._socks:
+            sock.setblocking(False)
+        if self._pool_size > 0:
+            # The daemon process holds the only write end of this pipe, so
+            # pooled sub-processes will see EOF on its read end if the daemon
+            # exits, even if it is killed abruptly.
+            self._daemon_alive_r, self._daemon_alive_w = os.pipe()
+            # Pooled sub-processes write their pid to this pipe after
+            # accepting a connection.  Such writes are small enough to be
+            # atomic.
+            self._accepted_r, self._accepted_w = os.pipe()
+            loop.add_reader(self._accepted_r, self._on_accepted_in_pool)
+            loop.call_later(0, self._refill_pool)
+        else:
+            for sock in self._socks:
+                loop.add_reader(sock, functools.partial(self._accept, sock))
+        for fd in self._child_registry.filenos():
+            loop.add_reader(fd, self._reap)
+        if self._control_sock is not None:
+            self._control_sock.setblocking(False)
+            loop.add_reader(self._control_sock, self._accept_control)
+        if self._idle_timeout_seconds is not None:
+            loop.call_later(self._idle_timeout_seconds, self._check_idle)
+        loop.call_later(self.housekeeping_interval_seconds, self._check_pid_file)
+        if (
+            self._code_changed is not None
+            and self._code_check_interval_seconds is not None
+        ):
+            loop.call_later(self._code_check_interval_seconds, self._check_code)
+        if self._preimport is not None:
+            loop.call_later(self.preimport_interval_seconds, self._run_preimport)
+
+        try:
+            conn: Optional[socket.socket] = loop.run()
+        finally:
+            loop.close()
+            if os.getpid() == self._pid:
+                self._stop_pool()
+                # Have clients whose connections are still queued run their
+                # tools directly.
+                while self._queued_conns:
+                    self._shed(self._queued_conns.popleft()[0])
+        return conn
+
+    def _accept(self, sock: socket.socket) -> None:
+        # Accept all pending connections, so that bursts of connections are
+        # handled without waiting for the event loop in between.
+        while True:
+            try:
+                conn, address = sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            accept_time = time.monotonic()
+            setup_connection(conn)
+            print(f"Got connection from: {address}")
+            self._last_activity = accept_time
+            if self._has_free_slot():
+                if self._fork_for_connection(conn, accept_time):
+                    return
+            elif (
+                self._max_queued_connections is None
+                or len(self._queued_conns) < self._max_queued_connections
+            ):
+                self._queued_conns.append((conn, accept_time))
+            else:
+                self._shed(conn)
+
+    def _has_free_slot(self) -> bool:
+        """Whether another sub-process may be started now."""
+        return (
+            self._max_concurrent_children is None
+            or len(self._child_registry.running) < self._max_concurrent_children
+        )
+
+    def _fork_for_connection(self, conn: socket.socket, accept_time: float) -> bool:
+        """Fork a sub-process to handle a connection.
+
+        Returns True in the sub-process, after stopping the event loop.
+        """
+        fork_start_time = time.perf_counter()
+        newpid = os.fork()
+        if newpid == 0:
+            self._after_fork_in_child()
+            self.accept_time = accept_time
+            self._loop.stop(conn)
+            return True
+        fork_seconds = time.perf_counter() - fork_start_time
+        conn.close()
+        self._child_registry.add(newpid, fork_seconds=fork_seconds)
+        return False
+
+    def _start_queued(self) -> None:
+        while self._queued_conns and self._has_free_slot():
+            if self._fork_for_connection(*self._queued_conns.popleft()):
+                return
+
+    def _shed(self, conn: socket.socket) -> None:
+        # Clients wait for the daemon's first line before sending anything,
+        # so the connection can be closed right away.
+        self._n_shed += 1
+        try:
+            conn.settimeout(1)
+            conn.sendall(BUSY)
+        except OSError:
+            pass
+        conn.close()
+
+    def _on_accepted_in_pool(self) -> None:
+        for pid_bytes in os.read(self._accepted_r, 4096).split():
+            self._idle_pids.discard(int(pid_bytes))
+        self._last_activity = time.monotonic()
+        self._refill_pool()
+
+    def _refill_pool(self) -> None:
+        while len(self._idle_pids) < self._pool_size and self._has_free_slot():
+            fork_start_time = time.perf_counter()
+            newpid = os.fork()
+            if newpid == 0:
+                self._after_fork_in_child()
+                os.close(self._accepted_r)
+                os.close(self._daemon_alive_w)
+                conn = wait_for_connection_in_pool(
+                    self._socks, self._accepted_w, self._daemon_alive_r
+                )
+                self.accept_time = time.monotonic()
+                self._loop.stop(conn)
+                return
+            fork_seconds = time.perf_counter() - fork_start_time
+            self._child_registry.add(newpid, fork_seconds=fork_seconds)
+            self._idle_pids.add(newpid)
+
+    def _stop_pool(self) -> None:
+        if self._pool_size <= 0:
+            return
+        # Stop idle pooled sub-processes, so that they don't keep accepting
+        # connections after the daemon exits.
+        for idle_pid in self._idle_pids:
+            try:
+                os.kill(idle_pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for fd in (
+            self._accepted_r,
+            self._accepted_w,
+            self._daemon_alive_r,
+            self._daemon_alive_w,
+        ):
+            os.close(fd)
+
+    def _after_fork_in_child(self) -> None:
+        self._child_registry.after_fork_in_child()
+        if self._control_sock is not None:
+            self._control_sock.close()
+        for control_conn in self._control_bufs:
+            control_conn.close()
+        for queued_conn, _accept_time in self._queued_conns:
+            queued_conn.close()
+
+    def _reap(self) -> None:
+        # Avoid "zombie" processes: Reap completed sub-processes.  This also
+        # notices pooled sub-processes which exited unexpectedly, so that
+        # they will be replaced.
+        exited = self._child_registry.reap()
+        self._stats.record(exited)
+        if self._pool_size > 0:
+            for info in exited:
+                self._idle_pids.discard(info.pid)
+            self._refill_pool()
+        else:
+            self._start_queued()
+
+    def _check_idle(self) -> None:
+        assert self._idle_timeout_seconds is not None
+        remaining = self._last_activity + self._idle_timeout_seconds - time.monotonic()
+        if remaining <= 0:
+            self._exit(
+                "Exiting after receiving no connections for"
+                f" {self._idle_timeout_seconds} seconds."
+            )
+        else:
+            self._loop.call_later(remaining, self._check_idle)
+
+    def _check_pid_file(self) -> None:
+        # Exit if the pid file was removed or replaced, e.g. by `jumpthegun
+        # stop` after failing to stop this daemon, or by another daemon.
+        try:
+            file_pid = int(self._pid_file_path.read_text())
+        except (OSError, ValueError):
+            file_pid = None
+        if file_pid != self._pid:
+            self._exit("Exiting since the pid file was removed or replaced.")
+        else:
+            self._loop.call_later(
+                self.housekeeping_interval_seconds, self._check_pid_file
+            )
+
+    def _check_code(self) -> None:
+        assert self._code_changed is not None
+        assert self._code_check_interval_seconds is not None
+        if self._code_changed():
+            self.restart_requested = True
+            self._exit("Restarting since the tool's code changed.")
+        else:
+            self._loop.call_later(self._code_check_interval_seconds, self._check_code)
+
+    def _run_preimport(self) -> None:
+        assert self._preimport is not None
+        self._preimport()
+        self._loop.call_later(self.preimport_interval_seconds, self._run_preimport)
+
+    def _exit(self, reason: str) -> None:
+        self.exit_reason = reason
+        self._loop.stop(None)
+
+    def _accept_control(self) -> None:
+        assert self._control_sock is not None
+        while True:
+            try:
+                control_conn, _address = self._control_sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            control_conn.setblocking(False)
+            self._control_bufs[control_conn] = bytearray()
+            self._loop.add_reader(
+                control_conn, functools.partial(self._read_control, control_conn)
+            )
+
+    def _read_control(self, control_conn: socket.socket) -> None:
+        buf = self._control_bufs[control_conn]
+        try:
+            data = control_conn.recv(self.max_control_request_size)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        buf += data
+        if b"\n" not in buf:
+            if data and len(buf) < self.max_control_request_size:
+                return
+            self._close_control(control_conn)
+            return
+
+        command = buf[: buf.index(b"\n")].decode(errors="replace").strip()
+        reply, should_exit = self._handle_control_command(command)
+        try:
+            control_conn.setblocking(True)
+            control_conn.settimeout(1)
+            control_conn.sendall(json.dumps(reply).encode() + b"\n")
+        except OSError:
+            pass
+        self._close_control(control_conn)
+        if should_exit:
+            self._exit("Exiting upon request.")
+
+    def _close_control(self, control_conn: socket.socket) -> None:
+        self._loop.remove_reader(control_conn)
+        del self._control_bufs[control_conn]
+        control_conn.close()
+
+    def _handle_control_command(self, command: str) -> Tuple[Dict[str, Any], bool]:
+        """Handle a control command, returning the reply and whether to exit."""
+        if command == "status":
+            return self._get_status(), False
+        elif command == "stats":
+            return self._get_stats(), False
+        elif command == "stop":
+            return {"stopping": True}, True
+        else:
+            return {"error": f"Unknown command: {command}"}, False
+
+    def _get_status(self) -> Dict[str, Any]:
+        return {
+            "pid": self._pid,
+            "pool_size": self._pool_size,
+            "idle_pool_processes": len(self._idle_pids),
+            "running_processes": len(self._child_registry.running),
+            "started_processes": self._child_registry.n_started,
+            "max_concurrent_children": self._max_concurrent_children,
+            "queued_connections": len(self._queued_conns),
+            "shed_connections": self._n_shed,
+            "seconds_since_last_connection": round(
+                time.monotonic() - self._last_activity, 3
+            ),
+        }
+
+    def _get_stats(self) -> Dict[str, Any]:
+        memory_usage = get_memory_usage()
+        return {
+            "pid": self._pid,
+            "invocations": self._child_registry.n_started - len(self._idle_pids),
+            "active_invocations": (
+                len(self._child_registry.running) - len(self._idle_pids)
+            ),
+            **self._stats.to_dict(),
+            "rss_bytes": None if memory_usage is None else memory_usage.rss * 1024,
+        }
+
+
+def setup_connection(conn: socket.socket) -> None:
+    """Set up an accepted connection for handling a command."""
+    # On some platforms, accepted sockets inherit the listening socket's
+    # non-blocking mode.
+    conn.setblocking(True)
+    if conn.family in (socket.AF_INET, socket.AF_INET6):
+        # Send small messages, e.g. requests for input, immediately.
+        # Otherwise, Nagle's algorithm together with delayed ACKs may delay
+        # each of them by tens of milliseconds.
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def wait_for_connection_in_pool(
+    socks: List[socket.socket], accepted_w: int, daemon_alive_r: int
+) -> socket.socket:
+    """Wait for a connection in a pooled sub-process."""
+    socks_by_fd = {sock.fileno(): sock for sock in socks}
+    while True:
+        readable, _, _ = select.select([*socks_by_fd, daemon_alive_r], [], [])
+        if daemon_alive_r in readable:
+            # The daemon process has exited.
+            os._exit(0)
+        try:
+            conn, address = socks_by_fd[readable[0]].accept()
+        except BlockingIOError:
+            # Another pooled sub-process accepted this connection.
+            continue
+        break
+    setup_connection(conn)
+
+    os.write(accepted_w, b"%d\n" % os.getpid())
+    os.close(accepted_w)
+    os.close(daemon_alive_r)
+    print(f"Got connection from: {address}")
+    return conn
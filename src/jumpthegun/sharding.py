@@ -0,0 +1,200 @@
+"""Splitting a tool's file arguments between several forked processes.
+
+For tools given many files, e.g. linters, the sub-process handling a
+connection may fork several processes, each running the tool with a share
+of the files, so that they are processed in parallel.  The processes'
+outputs are written in order: the first one's as it is written, and each of
+the others' once all of those before it have exited, so the output doesn't
+depend on which finishes first.
+"""
+
+import io
+import os
+import selectors
+import signal
+import sys
+from typing import Callable, Dict, List, NoReturn, Optional, Sequence, TextIO, Union
+
+__all__ = [
+    "combine_exit_codes",
+    "run_sharded",
+    "split_file_args",
+]
+
+
+def split_file_args(
+    args: Sequence[str],
+    n_shards: int,
+    file_suffixes: Sequence[str],
+    value_options: Optional[Sequence[str]] = None,
+) -> Optional[List[List[str]]]:
+    """Split a tool's file arguments into the arguments of several runs.
+
+    File arguments are those which are paths of existing files with one of
+    the given suffixes.  Each run gets the other arguments and a contiguous
+    share of the files, in place of the first file argument.  Returns None
+    if there aren't enough files for more than one run.
+
+    value_options are the tool's options which take a separate value, e.g.
+    "--config x.py", whose values are never split.  If not given, which
+    options take values is unknown, so None is also returned if a file may
+    be the value of an option, i.e. directly follows an option without "=".
+    """
+    if "--" in args:
+        # Arguments after "--" may be files beginning with "-", which can't
+        # be moved before it.
+        return None
+    other_args: List[str] = []
+    files: List[str] = []
+    files_index = None
+    prev_arg = ""
+    for arg in args:
+        if value_options is not None and prev_arg in value_options:
+            other_args.append(arg)
+        elif (
+            not arg.startswith("-")
+            and arg.endswith(tuple(file_suffixes))
+            and os.path.isfile(arg)
+        ):
+            if (
+                value_options is None
+                and prev_arg.startswith("-")
+                and "=" not in prev_arg
+            ):
+                return None
+            if files_index is None:
+                files_index = len(other_args)
+            files.append(arg)
+        else:
+            other_args.append(arg)
+        prev_arg = arg
+    n_shards = min(n_shards, len(files))
+    if n_shards < 2:
+        return None
+    assert files_index is not None
+
+    bounds = [len(files) * i // n_shards for i in range(n_shards + 1)]
+    return [
+        [*other_args[:files_index], *files[start:end], *other_args[files_index:]]
+        for start, end in zip(bounds, bounds[1:])
+    ]
+
+
+def combine_exit_codes(exit_codes: Sequence[int], rule: str) -> int:
+    """Combine the exit codes of the runs of a tool, as per a config rule."""
+    if rule == "max":
+        return max(exit_codes)
+    elif rule == "any_nonzero":
+        return int(any(exit_codes))
+    else:
+        raise ValueError(f"Unknown exit code rule: {rule!r}")
+
+
+class _Shard:
+    def __init__(self, pid: int, stdout_fd: int, stderr_fd: int) -> None:
+        self.pid = pid
+        self.fds = {stdout_fd, stderr_fd}
+        self.buffered_outputs = {stdout_fd: bytearray(), stderr_fd: bytearray()}
+
+
+def run_sharded(
+    run_tool: Callable[[], int], shards_args: Sequence[Sequence[str]], rule: str
+) -> int:
+    """Run a tool in a forked process for each of the given args.
+
+    run_tool() is called in each process, with sys.argv set to the args, and
+    must return the exit code.  The processes get no input.  Their outputs
+    are written to sys.stdout and sys.stderr in order, and their exit codes
+    are combined as per rule.
+    """
+    output_streams: Dict[int, TextIO] = {}
+    shards: List[_Shard] = []
+    sys.stdout.flush()
+    sys.stderr.flush()
+    for args in shards_args:
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            for fd in [stdout_r, stderr_r, *output_streams]:
+                os.close(fd)
+            _run_shard(run_tool, args, stdout_w, stderr_w)
+        os.close(stdout_w)
+        os.close(stderr_w)
+        output_streams[stdout_r] = sys.stdout
+        output_streams[stderr_r] = sys.stderr
+        shards.append(_Shard(pid, stdout_r, stderr_r))
+
+    with selectors.DefaultSelector() as selector:
+        for shard in shards:
+            for fd in shard.fds:
+                selector.register(fd, selectors.EVENT_READ, shard)
+        current = 0
+        while current < len(shards):
+            for key, _events in selector.select():
+                shard = key.data
+                data = os.read(key.fd, 65536)
+                if not data:
+                    selector.unregister(key.fd)
+                    os.close(key.fd)
+                    shard.fds.remove(key.fd)
+                elif shard is shards[current]:
+                    _write(output_streams[key.fd], data)
+                else:
+                    shard.buffered_outputs[key.fd] += data
+            # Once a process is done, continue with the next one's output.
+            while current < len(shards) and not shards[current].fds:
+                current += 1
+                if current < len(shards):
+                    for fd, buffered in shards[current].buffered_outputs.items():
+                        if buffered:
+                            _write(output_streams[fd], buffered)
+                            buffered.clear()
+
+    exit_codes = []
+    for shard in shards:
+        _pid, status = os.waitpid(shard.pid, 0)
+        if os.WIFSIGNALED(status):
+            # As reported by shells, e.g. 137 for SIGKILL.
+            exit_codes.append(128 + os.WTERMSIG(status))
+        else:
+            exit_codes.append(os.WEXITSTATUS(status))
+    return combine_exit_codes(exit_codes, rule)
+
+
+def _write(stream: TextIO, data: Union[bytes, bytearray]) -> None:
+    stream.buffer.write(data)
+    stream.buffer.flush()
+
+
+def _run_shard(
+    run_tool: Callable[[], int], args: Sequence[str], stdout_fd: int, stderr_fd: int
+) -> NoReturn:
+    exit_code = 1
+    try:
+        # Exit quietly if the process relaying the output exits.
+        signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+        sys.argv[1:] = args
+        devnull_fd = os.open(os.devnull, os.O_RDONLY)
+        for fd, target_fd in [(devnull_fd, 0), (stdout_fd, 1), (stderr_fd, 2)]:
+            os.dup2(fd, target_fd)
+            os.close(fd)
+        sys.stdin.close()
+        sys.stdin = io.TextIOWrapper(io.open(0, "rb", closefd=False))
+        # These mimic how Python sets up the standard streams.
+        sys.stdout = io.TextIOWrapper(
+            io.open(1, "wb", closefd=False),
+            encoding=sys.stdout.encoding,
+            errors=sys.stdout.errors,
+        )
+        sys.stderr = io.TextIOWrapper(
+            io.open(2, "wb", closefd=False),
+            encoding=sys.stderr.encoding,
+            errors="backslashreplace",
+            line_buffering=True,
+        )
+        exit_code = run_tool()
+        sys.stdout.flush()
+        sys.stderr.flush()
+    finally:
+        os._exit(exit_code)
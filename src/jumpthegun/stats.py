@@ -0,0 +1,184 @@
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+from .child_registry import ChildInfo
+
+__all__ = [
+    "StatsCollector",
+    "format_prometheus",
+]
+
+
+def percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    """Get a percentile of sorted values, using the nearest-rank method."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(len(sorted_values) * p / 100))
+    return sorted_values[rank - 1]
+
+
+class Distribution:
+    """Keep the count and sum of values, and the most recent values.
+
+    Percentiles are calculated over the most recent values only, while the
+    count and sum are of all values.
+    """
+
+    percentiles = (50, 95, 99)
+
+    def __init__(self, history_size: int) -> None:
+        self.count = 0
+        self.sum = 0.0
+        self._recent: Deque[float] = deque(maxlen=history_size)
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        self._recent.append(value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        sorted_values = sorted(self._recent)
+        result: Dict[str, Any] = {"count": self.count, "sum": round(self.sum, 6)}
+        for p in self.percentiles:
+            value = percentile(sorted_values, p)
+            result[f"p{p}"] = None if value is None else round(value, 6)
+        return result
+
+
+class StatsCollector:
+    """Aggregate statistics about a daemon's sub-processes as they exit."""
+
+    history_size = 1000
+
+    def __init__(self) -> None:
+        self.start_time = time.time()
+        self.n_finished = 0
+        self.time_to_first_output = Distribution(self.history_size)
+        self.time_to_exit = Distribution(self.history_size)
+        self.fork_seconds = Distribution(self.history_size)
+        self.relayed_bytes: Dict[str, int] = {"stdin": 0, "stdout": 0, "stderr": 0}
+        # Of sub-processes run with JUMPTHEGUN_MEMORY_REPORT set.
+        self.child_memory_bytes = {
+            kind: Distribution(self.history_size) for kind in ("shared", "private")
+        }
+
+    def record(self, exited: Iterable[ChildInfo]) -> None:
+        for info in exited:
+            self.n_finished += 1
+            if info.fork_seconds is not None:
+                self.fork_seconds.add(info.fork_seconds)
+            if info.time_to_first_output is not None:
+                self.time_to_first_output.add(info.time_to_first_output)
+            if info.time_to_exit is not None:
+                self.time_to_exit.add(info.time_to_exit)
+            for channel, n_bytes in (info.relayed_bytes or {}).items():
+                self.relayed_bytes[channel] = (
+                    self.relayed_bytes.get(channel, 0) + n_bytes
+                )
+            if info.memory_bytes is not None:
+                for kind, distribution in self.child_memory_bytes.items():
+                    distribution.add(info.memory_bytes[kind])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "uptime_seconds": round(time.time() - self.start_time, 3),
+            "finished_invocations": self.n_finished,
+            "time_to_first_output_seconds": self.time_to_first_output.to_dict(),
+            "time_to_exit_seconds": self.time_to_exit.to_dict(),
+            "fork_seconds": self.fork_seconds.to_dict(),
+            "relayed_bytes": dict(self.relayed_bytes),
+            "child_memory_bytes": {
+                kind: distribution.to_dict()
+                for kind, distribution in self.child_memory_bytes.items()
+            },
+        }
+
+
+def format_prometheus(tool_name: str, stats: Dict[str, Any]) -> str:
+    """Format a daemon's stats in the Prometheus text exposition format."""
+    lines: List[str] = []
+
+    def add_metric(
+        name: str,
+        metric_type: str,
+        help_text: str,
+        samples: List[Tuple[str, Dict[str, str], Any]],
+    ) -> None:
+        """Add a metric, given its samples' name suffixes, labels and values."""
+        lines.append(f"# HELP jumpthegun_{name} {help_text}")
+        lines.append(f"# TYPE jumpthegun_{name} {metric_type}")
+        for suffix, extra_labels, value in samples:
+            if value is None:
+                continue
+            labels = ",".join(
+                f'{key}="{label_value}"'
+                for key, label_value in {"tool": tool_name, **extra_labels}.items()
+            )
+            lines.append(f"jumpthegun_{name}{suffix}{{{labels}}} {value}")
+
+    def add_summary(name: str, help_text: str, distribution: Dict[str, Any]) -> None:
+        samples: List[Tuple[str, Dict[str, str], Any]] = [
+            ("", {"quantile": str(p / 100)}, distribution[f"p{p}"])
+            for p in Distribution.percentiles
+        ]
+        samples.append(("_sum", {}, distribution["sum"]))
+        samples.append(("_count", {}, distribution["count"]))
+        add_metric(name, "summary", help_text, samples)
+
+    add_metric(
+        "uptime_seconds",
+        "gauge",
+        "Seconds since the daemon started.",
+        [("", {}, stats["uptime_seconds"])],
+    )
+    add_metric(
+        "invocations_total",
+        "counter",
+        "Sub-processes started by the daemon.",
+        [("", {}, stats["invocations"])],
+    )
+    add_metric(
+        "active_invocations",
+        "gauge",
+        "Sub-processes currently running.",
+        [("", {}, stats["active_invocations"])],
+    )
+    add_summary(
+        "time_to_first_output_seconds",
+        "Seconds from accepting a connection until the tool's first output.",
+        stats["time_to_first_output_seconds"],
+    )
+    add_summary(
+        "time_to_exit_seconds",
+        "Seconds from accepting a connection until sending the exit code.",
+        stats["time_to_exit_seconds"],
+    )
+    add_summary(
+        "fork_seconds",
+        "Seconds taken by forking sub-processes.",
+        stats["fork_seconds"],
+    )
+    add_metric(
+        "relayed_bytes_total",
+        "counter",
+        "Bytes of input and output relayed via connections.",
+        [
+            ("", {"channel": channel}, n_bytes)
+            for channel, n_bytes in stats["relayed_bytes"].items()
+        ],
+    )
+    for kind, distribution in stats["child_memory_bytes"].items():
+        add_summary(
+            f"child_{kind}_memory_bytes",
+            f"{kind.capitalize()} memory of sub-processes when they finish.",
+            distribution,
+        )
+    add_metric(
+        "daemon_rss_bytes",
+        "gauge",
+        "Resident memory of the daemon process.",
+        [("", {}, stats["rss_bytes"])],
+    )
+    return "".join(f"{line}\n" for line in lines)
@@ -1,16 +1,28 @@
+import hashlib
+import json
+import os
 import sys
-from importlib.metadata import EntryPoint, entry_points
-from typing import Dict
+from importlib.metadata import EntryPoint, distributions
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Tuple, Union
 
 __all__ = [
     "get_tool_entrypoint",
+    "get_tool_group",
+    "get_tool_warm_up",
+    "WarmUp",
     "ToolExceptionBase",
     "EntrypointNotFound",
     "MultipleEntrypointFound",
+    "ExecutableNotFound",
 ]
 
 testing_tools: Dict[str, str] = {
     "__test_sleep_and_exit_on_signal": "sleep_and_exit_on_signal:main",
+    "__test_write_output": "write_output:main",
+    "__test_lazy_import": "lazy_import:main",
+    "__test_print_env": "print_env:main",
+    "__test_code_version": "code_version:main",
 }
 
 well_known_tools: Dict[str, str] = {
@@ -19,6 +31,21 @@ well_known_tools: Dict[str, str] = {
 
 all_known_tools = {**well_known_tools, **testing_tools}
 
+# A warm-up is either a "module:callable" reference to a function called with
+# no arguments, or the arguments for a dry invocation of the tool.
+WarmUp = Union[str, List[str]]
+
+well_known_warm_ups: Dict[str, WarmUp] = {
+    "aws": ["--version"],
+    "black": "jumpthegun.warm_up:warm_up_black",
+    "flake8": ["--version"],
+}
+
+# Tools whose daemons also serve other console scripts of the same package.
+well_known_tool_groups: Dict[str, List[str]] = {
+    "pytest": ["py.test"],
+}
+
 
 class ToolExceptionBase(Exception):
     """Exception raised for CLI tool-related exceptions."""
@@ -44,6 +71,13 @@ class MultipleEntrypointFound(ToolExceptionBase):
         return f"Multiple console entrypoints: {self.tool_name}"
 
 
+class ExecutableNotFound(ToolExceptionBase):
+    """Exception raised for CLI tools not found in PATH."""
+
+    def __str__(self) -> str:
+        return f"Command not found: {self.tool_name}"
+
+
 def get_tool_entrypoint(tool_name: str) -> EntryPoint:
     """Get an entrypoint function for a CLI tool."""
     tool_entrypoint_str = all_known_tools.get(tool_name)
@@ -55,20 +89,124 @@ def get_tool_entrypoint(tool_name: str) -> EntryPoint:
         )
         return entrypoint
 
-    entrypoints: tuple[EntryPoint, ...]
-    all_entrypoints = entry_points()
-    if sys.version_info < (3, 10):
-        entrypoints = tuple(
-            ep for ep in all_entrypoints["console_scripts"] if ep.name == tool_name
-        )
-    else:
-        entrypoints = tuple(
-            all_entrypoints.select(group="console_scripts", name=tool_name)
-        )
-
-    if not entrypoints:
+    entrypoint_values = get_console_scripts().get(tool_name, [])
+    if not entrypoint_values:
         raise EntrypointNotFound(tool_name)
-    elif len(entrypoints) == 1:
-        return next(iter(entrypoints))
+    elif len(entrypoint_values) == 1:
+        return EntryPoint(
+            name=tool_name, value=entrypoint_values[0], group="console_scripts"
+        )
     else:
         raise MultipleEntrypointFound(tool_name)
+
+
+def get_console_scripts() -> Dict[str, List[str]]:
+    """Get the values of all console_scripts entrypoints, by name.
+
+    Finding these requires reading the metadata of every installed
+    distribution, which can take hundreds of milliseconds in large
+    environments.  They are therefore cached in a file, which is used as long
+    as the directories in sys.path haven't been modified, e.g. by installing,
+    upgrading or removing packages.
+    """
+    cache_file_path = get_entrypoints_cache_file_path()
+    fingerprint = get_sys_path_fingerprint()
+    try:
+        cached = json.loads(cache_file_path.read_bytes())
+        if cached["fingerprint"] == fingerprint:
+            return cached["console_scripts"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    console_scripts = find_console_scripts()
+
+    # Write the cache file atomically, since other processes may be reading it.
+    try:
+        cache_file_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_file_path = cache_file_path.with_name(
+            f"{cache_file_path.name}.{os.getpid()}.tmp"
+        )
+        temp_file_path.write_text(
+            json.dumps({"fingerprint": fingerprint, "console_scripts": console_scripts})
+        )
+        os.replace(temp_file_path, cache_file_path)
+    except OSError:
+        pass
+
+    return console_scripts
+
+
+def find_console_scripts() -> Dict[str, List[str]]:
+    """Find the values of all console_scripts entrypoints, by name."""
+    console_scripts: Dict[str, List[str]] = {}
+    for dist in distributions():
+        # Avoid parsing entrypoints of distributions without console scripts.
+        entry_points_text = dist.read_text("entry_points.txt")
+        if not entry_points_text or "console_scripts" not in entry_points_text:
+            continue
+        for entrypoint in dist.entry_points:
+            if entrypoint.group == "console_scripts":
+                values = console_scripts.setdefault(entrypoint.name, [])
+                # The same distribution may be found more than once, e.g. if
+                # its directory appears in sys.path twice.
+                if entrypoint.value not in values:
+                    values.append(entrypoint.value)
+    return console_scripts
+
+
+def get_sys_path_fingerprint() -> Dict[str, int]:
+    """Get the modification times of the directories in sys.path."""
+    fingerprint = {}
+    for path in sys.path:
+        # The current directory, e.g. with `python -c`, is modified too often
+        # to be useful, and rarely has installed distributions.
+        if not path:
+            continue
+        try:
+            fingerprint[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            pass
+    return fingerprint
+
+
+def get_entrypoints_cache_file_path() -> Path:
+    """Get the path of the entrypoints cache file for this Python environment."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    # The file name is unique to the interpreter and sys.path.
+    key = hashlib.sha256(
+        "\0".join([sys.executable, *sys.path]).encode("utf-8", "surrogateescape")
+    ).hexdigest()[:16]
+    return Path(cache_home) / "jumpthegun" / f"entrypoints-{key}.json"
+
+
+def get_tool_warm_up(
+    tool_name: str, configured_warm_ups: Mapping[str, Optional[WarmUp]]
+) -> Optional[WarmUp]:
+    """Get the warm-up for a CLI tool, if any.
+
+    Configured warm-ups take precedence over well-known ones, and may be None
+    to disable a well-known warm-up.
+    """
+    if tool_name in configured_warm_ups:
+        return configured_warm_ups[tool_name]
+    return well_known_warm_ups.get(tool_name)
+
+
+def get_tool_group(
+    tool_name: str, configured_groups: Mapping[str, Optional[List[str]]]
+) -> Tuple[str, List[str]]:
+    """Get the tool whose daemon serves a CLI tool, and the others it serves.
+
+    Returns the name of the tool the daemon is named after, and the names of
+    the other tools it serves.  Configured groups take precedence over
+    well-known ones, and may be None to disable a well-known group.
+    """
+    groups = {**well_known_tool_groups, **configured_groups}
+    for main_tool_name, other_tool_names in groups.items():
+        if other_tool_names is None:
+            continue
+        if tool_name == main_tool_name or tool_name in other_tool_names:
+            return main_tool_name, [
+                name for name in other_tool_names if name != main_tool_name
+            ]
+    return tool_name, []
@@ -0,0 +1,100 @@
+"""Opt-in tracing of the phases of running a command.
+
+When the JUMPTHEGUN_TRACE environment variable is set to a file path, the
+client and the daemon's sub-process each record when the phases of running
+a command happen, and append them to that file as Chrome trace events.
+The file can be loaded in chrome://tracing or https://ui.perfetto.dev.
+
+Each phase is shown as a span from the end of the process's previous phase.
+Timestamps are taken from the wall clock, so those of different processes
+are comparable.
+
+The file is written in the JSON Array Format, which allows omitting the
+closing bracket, so that events may be appended by any number of processes
+and runs.
+
+This is used by the Python client, so it deliberately imports as little as
+possible.
+"""
+
+import os
+import time
+from typing import List, Optional, Tuple
+
+__all__ = [
+    "TRACE_ENV_VAR",
+    "Trace",
+    "monotonic_to_us",
+    "now_us",
+]
+
+TRACE_ENV_VAR = "JUMPTHEGUN_TRACE"
+
+
+def now_us() -> int:
+    """Get the current wall clock time, in microseconds."""
+    return time.time_ns() // 1000
+
+
+def monotonic_to_us(monotonic_time: float) -> int:
+    """Convert a time.monotonic() time to a wall clock time, in microseconds."""
+    return now_us() - int((time.monotonic() - monotonic_time) * 1_000_000)
+
+
+class Trace:
+    """Record the times of phases in a process."""
+
+    def __init__(self, process_name: str) -> None:
+        self._process_name = process_name
+        self._marks: List[Tuple[str, int]] = []
+
+    def mark(self, phase: str, timestamp_us: Optional[int] = None) -> None:
+        """Record that a phase ended, by default now."""
+        self._marks.append((phase, now_us() if timestamp_us is None else timestamp_us))
+
+    def format_events(self) -> bytes:
+        pid = os.getpid()
+        common = f'"cat": "jumpthegun", "pid": {pid}, "tid": {pid}'
+        events = [
+            f'{{"name": "process_name", "ph": "M", {common},'
+            f' "args": {{"name": "{self._process_name}"}}}}'
+        ]
+        marks = sorted(self._marks, key=lambda mark: mark[1])
+        if marks:
+            first_phase, first_timestamp = marks[0]
+            events.append(
+                f'{{"name": "{first_phase}", "ph": "i", "s": "p",'
+                f' "ts": {first_timestamp}, {common}}}'
+            )
+        for (_prev_phase, prev_timestamp), (phase, timestamp) in zip(marks, marks[1:]):
+            events.append(
+                f'{{"name": "{phase}", "ph": "X", "ts": {prev_timestamp},'
+                f' "dur": {timestamp - prev_timestamp}, {common}}}'
+            )
+        return "".join(f"{event},\n" for event in events).encode()
+
+    def write(self, file_path: str) -> None:
+        """Append the recorded phases to a trace file."""
+        try:
+            # Whichever process creates the file writes the opening bracket.
+            fd = os.open(
+                file_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_EXCL, 0o644
+            )
+        except FileExistsError:
+            prefix = b""
+            try:
+                fd = os.open(file_path, os.O_WRONLY | os.O_APPEND)
+            except OSError:
+                return
+        except OSError:
+            return
+        else:
+            prefix = b"[\n"
+        try:
+            # A single write in append mode, so that events written by
+            # concurrently running processes aren't interleaved.
+            os.write(fd, prefix + self.format_events())
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
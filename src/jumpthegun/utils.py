@@ -1,6 +1,23 @@
 import errno
 import os
 import sys
+from typing import Optional
+
+
+def find_executable(name: str, path: Optional[str] = None) -> Optional[str]:
+    """Find an executable in PATH, like `command -v`.
+
+    If path is given, it is searched instead of PATH.
+    """
+    if "/" in name:
+        return name if os.access(name, os.X_OK) else None
+    if path is None:
+        path = os.environ.get("PATH", "")
+    for dir_path in path.split(os.pathsep):
+        file_path = os.path.join(dir_path, name)
+        if os.path.isfile(file_path) and os.access(file_path, os.X_OK):
+            return file_path
+    return None
 
 
 def pid_exists(pid: int):
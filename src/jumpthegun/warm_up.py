@@ -0,0 +1,44 @@
+import importlib
+import os
+import sys
+from importlib.metadata import EntryPoint
+from typing import Callable
+
+from .tools import WarmUp
+
+__all__ = [
+    "run_warm_up",
+]
+
+
+def run_warm_up(tool_name: str, warm_up: WarmUp, tool_runner: Callable) -> None:
+    """Run a tool's warm-up, e.g. to populate caches before forking.
+
+    Any errors are ignored, as is the exit code of a dry invocation.  Input is
+    empty; outputs are left for the caller to discard.
+    """
+    prev_argv = sys.argv[:]
+    prev_stdin = sys.stdin
+    sys.stdin = open(os.devnull)
+    try:
+        if isinstance(warm_up, str):
+            warm_up_func = EntryPoint(
+                name=tool_name, value=warm_up, group="jumpthegun.warm_up"
+            ).load()
+            warm_up_func()
+        else:
+            sys.argv[:] = [tool_name, *warm_up]
+            tool_runner()
+    except (Exception, SystemExit):
+        pass
+    finally:
+        sys.stdin.close()
+        sys.stdin = prev_stdin
+        sys.argv[:] = prev_argv
+
+
+def warm_up_black() -> None:
+    """Format a bit of code, initializing black's parser and formatter."""
+    # Imported dynamically, since black needn't be installed with jumpthegun.
+    black = importlib.import_module("black")
+    black.format_str("x = ( 1 )\n", mode=black.Mode())
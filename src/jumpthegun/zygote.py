@@ -0,0 +1,239 @@
+"""A process which starts tools' daemons, sharing what they import in common.
+
+Normally, each tool's daemon is a separate Python process, which starts the
+interpreter and imports everything on its own.  In zygote mode, there is a
+single "zygote" process per Python interpreter and environment, which
+imports commonly used modules once.  Starting a tool's daemon is then done
+by forking the zygote, and having the forked process import only the tool
+itself.  Daemons forked from the same zygote share the memory pages of the
+interpreter and of the modules imported by the zygote.
+
+Requests to start a daemon are sent via a Unix domain socket, as a JSON
+line with the tool's name and the cwd and env vars of the process making the
+request.  The forked process takes on that cwd and those env vars, so that
+it starts the daemon as the requesting process would have.  It replies
+with a JSON line when the daemon has started, or with the error if it
+failed to start.
+
+The zygote exits after no daemons it started have been running for a
+period of time.
+"""
+
+import hashlib
+import importlib
+import json
+import os
+import socket
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .__version__ import __version__
+from .child_registry import ChildRegistry
+from .event_loop import EventLoop
+
+__all__ = [
+    "Zygote",
+    "ZygoteRequest",
+    "get_zygote_name",
+    "preimport_common_modules",
+    "send_reply",
+    "send_start_request",
+    "zygote_is_listening",
+]
+
+# Standard library modules which many tools import.  Third-party modules
+# aren't imported, since importing them may have side effects which
+# differ between tools.
+common_modules: List[str] = [
+    "argparse",
+    "ast",
+    "collections",
+    "configparser",
+    "contextlib",
+    "dataclasses",
+    "datetime",
+    "difflib",
+    "email.parser",
+    "enum",
+    "fnmatch",
+    "functools",
+    "glob",
+    "importlib.metadata",
+    "inspect",
+    "io",
+    "itertools",
+    "json",
+    "logging",
+    "pathlib",
+    "platform",
+    "re",
+    "shutil",
+    "string",
+    "subprocess",
+    "tempfile",
+    "textwrap",
+    "tokenize",
+    "traceback",
+    "typing",
+    "urllib.parse",
+    "uuid",
+    "warnings",
+]
+
+# The tool name, cwd and env vars sent with a request to start a daemon.
+ZygoteRequest = Tuple[str, str, Dict[str, str]]
+
+
+def get_zygote_name() -> str:
+    """Get the name of the zygote for this interpreter and environment.
+
+    Tools installed in the same directory may use different interpreters,
+    so these get separate zygotes.
+    """
+    key = "\0".join([sys.executable, __version__, *sys.path])
+    return (
+        "zygote-"
+        + hashlib.sha256(key.encode("utf-8", "surrogateescape")).hexdigest()[:8]
+    )
+
+
+def preimport_common_modules() -> None:
+    """Import commonly used modules, ignoring failures."""
+    for module_name in common_modules:
+        try:
+            importlib.import_module(module_name)
+        except Exception:
+            pass
+
+
+def zygote_is_listening(socket_path: Path) -> bool:
+    """Check whether a zygote is listening on a socket."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with sock:
+        try:
+            sock.connect(str(socket_path))
+        except OSError:
+            return False
+    return True
+
+
+def send_start_request(
+    socket_path: Path, tool_name: str, timeout: float = 60
+) -> Optional[Dict[str, Any]]:
+    """Have a zygote start a tool's daemon, returning its reply.
+
+    Returns None if no zygote is listening on the socket, or if it closed the
+    connection without replying, e.g. since it was exiting.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with sock:
+        try:
+            sock.connect(str(socket_path))
+        except OSError:
+            return None
+        sock.settimeout(timeout)
+        request = {"tool_name": tool_name, "cwd": os.getcwd(), "env": dict(os.environ)}
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        reply = sock.makefile("rb").readline()
+    if not reply:
+        return None
+    return json.loads(reply)
+
+
+def send_reply(conn: socket.socket, reply: Dict[str, Any]) -> None:
+    """Reply to a request to start a daemon, and close the connection."""
+    with conn:
+        try:
+            conn.sendall(json.dumps(reply).encode() + b"\n")
+        except OSError:
+            pass
+
+
+class Zygote:
+    """The zygote process's main loop.
+
+    This forks a process for each request.  In forked processes, .serve()
+    returns the request and the connection to reply on.
+    """
+
+    max_request_size = 1024 * 1024
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        idle_timeout_seconds: Optional[int],
+    ) -> None:
+        self._sock = sock
+        self._idle_timeout_seconds = idle_timeout_seconds
+        self._pid = os.getpid()
+        self._loop = EventLoop()
+        self._child_registry = ChildRegistry()
+        self._last_activity = time.monotonic()
+
+    def serve(self) -> Optional[Tuple[socket.socket, ZygoteRequest]]:
+        """Serve requests.
+
+        Returns the connection and the request in forked processes.  In the
+        zygote process, returns None when the zygote should exit.
+        """
+        loop = self._loop
+        self._sock.setblocking(False)
+        loop.add_reader(self._sock, self._accept)
+        for fd in self._child_registry.filenos():
+            loop.add_reader(fd, self._reap)
+        if self._idle_timeout_seconds is not None:
+            loop.call_later(self._idle_timeout_seconds, self._check_idle)
+        try:
+            return loop.run()
+        finally:
+            loop.close()
+            if os.getpid() == self._pid:
+                self._child_registry.close()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                conn, _address = self._sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            self._last_activity = time.monotonic()
+            request = self._read_request(conn)
+            if request is None:
+                conn.close()
+                continue
+            newpid = os.fork()
+            if newpid == 0:
+                self._child_registry.after_fork_in_child()
+                self._sock.close()
+                self._loop.stop((conn, request))
+                return
+            conn.close()
+            self._child_registry.add(newpid)
+
+    def _read_request(self, conn: socket.socket) -> Optional[ZygoteRequest]:
+        # Requests are sent right after connecting, so they are read with
+        # blocking calls, with a timeout in case a client misbehaves.
+        conn.setblocking(True)
+        conn.settimeout(5)
+        try:
+            line = conn.makefile("rb").readline(self.max_request_size)
+            request = json.loads(line)
+            return request["tool_name"], request["cwd"], request["env"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _reap(self) -> None:
+        if self._child_registry.reap():
+            self._last_activity = time.monotonic()
+
+    def _check_idle(self) -> None:
+        assert self._idle_timeout_seconds is not None
+        if self._child_registry.running:
+            self._last_activity = time.monotonic()
+        remaining = self._last_activity + self._idle_timeout_seconds - time.monotonic()
+        if remaining <= 0:
+            self._loop.stop(None)
+        else:
+            self._loop.call_later(remaining, self._check_idle)
@@ -0,0 +1,6 @@
+VERSION = 1
+
+
+def main():
+    """Print the version of this module's code."""
+    print(VERSION)
@@ -0,0 +1,7 @@
+import sys
+
+
+def main():
+    """Print whether a module was imported already, then import it."""
+    print("colorsys" in sys.modules)
+    import colorsys  # noqa: F401
@@ -0,0 +1,8 @@
+import json
+import os
+import sys
+
+
+def main():
+    """Print the values of the given env vars as JSON, with null if unset."""
+    print(json.dumps({name: os.environ.get(name) for name in sys.argv[1:]}))
@@ -0,0 +1,28 @@
+import os
+import socket
+import time
+
+import pytest
+
+from jumpthegun.batch import BatchRunner
+from jumpthegun.protocol import STDOUT, encode_frame
+
+
+def test_batch_runner_stops_jobs_when_client_is_gone():
+    conn, client_conn = socket.socketpair()
+    client_conn.close()
+    runner = BatchRunner(conn, [(b"a", b"/"), (b"b", b"/")], max_parallel=2)
+    with pytest.raises(SystemExit) as exc_info:
+        result = runner.run()
+        if result is not None:
+            # A job's process: write some output, then wait to be stopped.
+            try:
+                job_sock, _argv_bytes, _cwd_bytes = result
+                job_sock.sendall(encode_frame(STDOUT, b"output"))
+                time.sleep(60)
+            finally:
+                os._exit(1)
+    assert exc_info.value.code == 0
+    # The jobs' processes were reaped.
+    with pytest.raises(ChildProcessError):
+        os.waitpid(-1, os.WNOHANG)
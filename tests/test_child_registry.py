@@ -0,0 +1,42 @@
+import os
+import select
+
+from jumpthegun.child_registry import ChildRegistry
+
+
+def test_child_registry():
+    registry = ChildRegistry()
+    try:
+        pid = os.fork()
+        if pid == 0:
+            registry.after_fork_in_child()
+            registry.report_args(["tool", "--arg"])
+            registry.report_stats(
+                time_to_first_output=0.5,
+                time_to_exit=1.5,
+                relayed_bytes={"stdin": 0, "stdout": 10, "stderr": 2},
+            )
+            os._exit(3)
+        registry.add(pid, fork_seconds=0.001)
+        assert list(registry.running) == [pid]
+
+        exited = []
+        while not exited:
+            readable, _, _ = select.select(registry.filenos(), [], [], 5)
+            assert readable
+            exited = registry.reap()
+
+        assert [info.pid for info in exited] == [pid]
+        info = exited[0]
+        assert info.args == ["tool", "--arg"]
+        assert info.exit_code == 3
+        assert info.fork_seconds == 0.001
+        assert info.time_to_first_output == 0.5
+        assert info.time_to_exit == 1.5
+        assert info.relayed_bytes == {"stdin": 0, "stdout": 10, "stderr": 2}
+        assert info.duration is not None and info.duration >= 0
+        assert not registry.running
+        assert list(registry.finished) == [info]
+        assert registry.n_started == 1
+    finally:
+        registry.close()
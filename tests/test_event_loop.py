@@ -0,0 +1,30 @@
+import os
+
+from jumpthegun.event_loop import EventLoop
+
+
+def test_timers():
+    loop = EventLoop()
+    calls = []
+    loop.call_later(0.02, lambda: calls.append(2))
+    loop.call_later(0.01, lambda: calls.append(1))
+    loop.call_later(0.015, lambda: calls.append("cancelled")).cancel()
+    loop.call_later(0.03, lambda: loop.stop("done"))
+    try:
+        assert loop.run() == "done"
+    finally:
+        loop.close()
+    assert calls == [1, 2]
+
+
+def test_reader():
+    loop = EventLoop()
+    r, w = os.pipe()
+    try:
+        loop.add_reader(r, lambda: loop.stop(os.read(r, 100)))
+        loop.call_later(0.01, lambda: os.write(w, b"data"))
+        assert loop.run() == b"data"
+    finally:
+        loop.close()
+        os.close(r)
+        os.close(w)
@@ -0,0 +1,254 @@
+import io
+import os
+import signal
+import socket
+import sys
+import threading
+
+from jumpthegun.io_redirect import (
+    OutputBuffer,
+    SocketOutputRedirector,
+    SocketWriter,
+    StdinWrapper,
+    encode_exit_code,
+)
+from jumpthegun.protocol import (
+    EXIT,
+    FRAME_HEADER,
+    STDERR,
+    STDIN,
+    STDOUT,
+    U32,
+    RequestHeaders,
+    encode_batch_frame,
+    encode_batch_jobs,
+    encode_env_entries,
+    encode_frame,
+    read_batch_jobs,
+    read_env_entries,
+    read_request_headers,
+    send_fds,
+)
+
+
+def recv_all(sock: socket.socket) -> bytes:
+    sock.settimeout(5)
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+def test_socket_writer_protocol_v1():
+    sock, client_sock = socket.socketpair()
+    with sock, client_sock:
+        writer = SocketWriter(prefix=b"1", output_buffer=OutputBuffer(sock))
+        writer.write(b"a\nb")
+        writer.flush()
+        sock.shutdown(socket.SHUT_WR)
+        assert recv_all(client_sock) == b"11\na\nb\n"
+
+
+def test_socket_writer_protocol_v2():
+    sock, client_sock = socket.socketpair()
+    with sock, client_sock:
+        output_buffer = OutputBuffer(sock, protocol_version=2)
+        writer = SocketWriter(prefix=STDOUT, output_buffer=output_buffer)
+        data = bytes(range(256)) * 3
+        assert writer.write(data) == len(data)
+        output_buffer.send(encode_exit_code(3, protocol_version=2))
+        sock.shutdown(socket.SHUT_WR)
+        assert recv_all(client_sock) == (
+            FRAME_HEADER.pack(STDOUT, len(data))
+            + data
+            + FRAME_HEADER.pack(EXIT, 4)
+            + b"\0\0\0\3"
+        )
+
+
+def test_output_buffer_coalesces_writes_in_order():
+    sock, client_sock = socket.socketpair()
+    with sock, client_sock:
+        output_buffer = OutputBuffer(sock, protocol_version=2)
+        for data in [b"a", b"b", b"c"]:
+            output_buffer.write(STDOUT, data)
+        output_buffer.write(STDERR, b"d")
+        output_buffer.write(STDOUT, b"e")
+        output_buffer.send(encode_exit_code(0, protocol_version=2))
+        sock.shutdown(socket.SHUT_WR)
+        assert recv_all(client_sock) == (
+            encode_frame(STDOUT, b"abc")
+            + encode_frame(STDERR, b"d")
+            + encode_frame(STDOUT, b"e")
+            + encode_exit_code(0, protocol_version=2)
+        )
+
+
+def test_output_buffer_flushes_after_delay():
+    sock, client_sock = socket.socketpair()
+    with sock, client_sock:
+        output_buffer = OutputBuffer(sock, protocol_version=2)
+        output_buffer.write(STDOUT, b"abc")
+        client_sock.settimeout(5)
+        assert client_sock.recv(100) == encode_frame(STDOUT, b"abc")
+
+
+def test_flush_on_sigterm():
+    sock, client_sock = socket.socketpair()
+    with sock, client_sock:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                client_sock.close()
+                output_redirector = SocketOutputRedirector()
+                output_redirector.set_socket(sock, protocol_version=2)
+                output_redirector.output_buffer.flush_delay_seconds = 60
+                output_redirector.flush_on_sigterm()
+                sys.stdout.write("abc")
+                os.kill(os.getpid(), signal.SIGTERM)
+            finally:
+                os._exit(1)
+        sock.close()
+        assert recv_all(client_sock) == encode_frame(STDOUT, b"abc")
+        _pid, status = os.waitpid(pid, 0)
+        assert os.WIFSIGNALED(status)
+        assert os.WTERMSIG(status) == signal.SIGTERM
+
+
+def test_stdin_wrapper_protocol_v1():
+    sock, client_sock = socket.socketpair()
+    input_lines = [b"line 1\n", b"line 2\n", b"no newline"]
+
+    def answer_stdin_requests():
+        rfile = client_sock.makefile("rb", 0)
+        for line in [*input_lines, b""]:
+            assert rfile.readline() == b"3\n"
+            client_sock.sendall(b"%d\n%b" % (len(line), line))
+
+    thread = threading.Thread(target=answer_stdin_requests)
+    thread.start()
+    with sock, client_sock:
+        stdin = StdinWrapper(sock, protocol_version=1)
+        assert stdin.readline() == b"line 1\n"
+        assert stdin.read(3) == b"lin"
+        assert stdin.read() == b"e 2\nno newline"
+        assert stdin.read() == b""
+        thread.join(5)
+
+
+def test_stdin_wrapper_protocol_v2():
+    sock, client_sock = socket.socketpair()
+    input_data = b"line 1\nline 2\n\0binary\xff" * 10000
+
+    def stream_stdin():
+        # Send input in small chunks whenever credit is available, as a client
+        # streaming stdin would.
+        rfile = client_sock.makefile("rb", 0)
+        credit = 0
+        pos = 0
+        while pos < len(input_data):
+            if not credit:
+                channel, length = FRAME_HEADER.unpack(rfile.read(FRAME_HEADER.size))
+                assert channel == STDIN
+                (grant,) = U32.unpack(rfile.read(length))
+                credit += grant
+            chunk = input_data[pos : pos + min(credit, 1000)]
+            client_sock.sendall(U32.pack(len(chunk)) + chunk)
+            credit -= len(chunk)
+            pos += len(chunk)
+        client_sock.sendall(U32.pack(0))
+
+    thread = threading.Thread(target=stream_stdin)
+    thread.start()
+    with sock, client_sock:
+        stdin = StdinWrapper(sock, protocol_version=2)
+        assert stdin.readline() == b"line 1\n"
+        assert stdin.readline(3) == b"lin"
+        assert stdin.read() == input_data[10:]
+        assert stdin.read() == b""
+        thread.join(5)
+
+
+def test_read_request_headers():
+    assert read_request_headers(io.BytesIO(b"12\n")) == (RequestHeaders(), b"12\n")
+    assert read_request_headers(io.BytesIO(b"v2\n5\n")) == (
+        RequestHeaders(protocol_version=2),
+        b"5\n",
+    )
+    assert read_request_headers(io.BytesIO(b"v99\nxyz\n0\n")) == (
+        RequestHeaders(protocol_version=2),
+        b"0\n",
+    )
+
+
+def test_read_request_headers_with_env_entries():
+    assert read_request_headers(io.BytesIO(b"v2\ne\n5\n")) == (
+        RequestHeaders(protocol_version=2, env_entries=True),
+        b"5\n",
+    )
+    assert read_request_headers(io.BytesIO(b"e0123abcd\n5\n")) == (
+        RequestHeaders(env_entries=True, env_baseline_hash="0123abcd"),
+        b"5\n",
+    )
+
+
+def test_read_request_headers_with_tool_name():
+    assert read_request_headers(io.BytesIO(b"v2\ntpy.test\n5\n")) == (
+        RequestHeaders(protocol_version=2, tool_name="py.test"),
+        b"5\n",
+    )
+
+
+def test_read_request_headers_with_batch():
+    assert read_request_headers(io.BytesIO(b"v2\nb4\n2\n")) == (
+        RequestHeaders(protocol_version=2, batch=4),
+        b"2\n",
+    )
+    assert read_request_headers(io.BytesIO(b"v2\nb\n2\n"))[0].batch == 0
+
+
+def test_batch_jobs():
+    jobs = [(b"a.py", b"/proj"), (b"'two\nlines'", b"/"), (b"", b"/proj")]
+    encoded = encode_batch_jobs(jobs)
+    assert encoded.startswith(b"3\n4\na.py5\n/proj11\n")
+    rfile = io.BytesIO(encoded + b"rest")
+    n_jobs = int(rfile.readline())
+    assert read_batch_jobs(rfile, n_jobs) == jobs
+    assert rfile.read() == b"rest"
+
+
+def test_encode_batch_frame():
+    frame = encode_batch_frame(STDOUT, 3, b"data")
+    assert frame == FRAME_HEADER.pack(STDOUT, 8) + U32.pack(3) + b"data"
+
+
+def test_env_entries():
+    entries = [b"A=1", b"B=two\nlines", b"C", b"D="]
+    encoded = encode_env_entries(entries)
+    assert encoded == b"4\n3\nA=111\nB=two\nlines1\nC2\nD="
+    assert read_env_entries(io.BytesIO(encoded + b"rest")) == entries
+    assert read_env_entries(io.BytesIO(encode_env_entries([]))) == []
+
+
+def test_read_request_headers_with_fds():
+    sock, client_sock = socket.socketpair()
+    with sock, client_sock:
+        client_sock.sendall(b"v2\nf\n")
+        send_fds(client_sock, [0, 1, 2])
+        client_sock.sendall(b"5\n")
+        headers, line = read_request_headers(sock.makefile("rb", 0), sock)
+        try:
+            assert headers.protocol_version == 2
+            assert len(headers.fds) == 3
+            for fd, received_fd in zip([0, 1, 2], headers.fds):
+                assert os.path.sameopenfile(fd, received_fd)
+            assert line == b"5\n"
+        finally:
+            for fd in headers.fds:
+                os.close(fd)
+
+
+def test_encode_frame():
+    assert encode_frame(STDOUT, b"abc") == b"1\0\0\0\3abc"
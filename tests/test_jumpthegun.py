@@ -1,20 +1,19 @@
+import json
 import os
-import re
-import shutil
 import signal
 import subprocess
-import sys
 import textwrap
+import time
 from pathlib import Path
-from typing import List, Union
+from typing import Any, Dict, List
 
 import pytest
 
+from .testenvs import get_bin_path, get_site_packages_path, run, setup_test_project
 
-def get_bin_path(project_path: Path) -> Path:
-    venv_path = project_path.with_name(project_path.name + "_venv")
-    bin_dir_name = "Scripts" if sys.platform == "win32" else "bin"
-    return venv_path / bin_dir_name
+
+def write_config(config_home: Path, config: Dict[str, Any]) -> None:
+    (config_home / "jumpthegun.json").write_text(json.dumps(config))
 
 
 @pytest.fixture
@@ -30,75 +29,12 @@ def testproj(request, testproj_with_jumpthegun, testproj_without_jumpthegun) ->
 
 @pytest.fixture(scope="session")
 def testproj_with_jumpthegun() -> Path:
-    return _setup_test_project("testproj_with_jumpthegun", with_jumpthegun=True)
+    return setup_test_project("testproj_with_jumpthegun", with_jumpthegun=True)
 
 
 @pytest.fixture(scope="session")
 def testproj_without_jumpthegun() -> Path:
-    return _setup_test_project("testproj_without_jumpthegun", with_jumpthegun=False)
-
-
-def _setup_test_project(name: str, with_jumpthegun: bool) -> Path:
-    root_dir = Path(__file__).parent.parent
-    testenvs_dir = root_dir / ".testenvs"
-    testenvs_dir.mkdir(exist_ok=True)
-    ver_dir = testenvs_dir / sys.version.split()[0]
-    ver_dir.mkdir(exist_ok=True)
-
-    proj_dir = ver_dir / name
-    if not proj_dir.exists():
-        sources_dir = Path(__file__).parent / "testproj"
-        shutil.copytree(sources_dir, proj_dir)
-        venv_path = get_bin_path(proj_dir).parent
-        subprocess.run(
-            [sys.executable, "-m", "venv", str(venv_path.resolve())],
-            check=True,
-        )
-        bin_path = get_bin_path(proj_dir)
-        if with_jumpthegun:
-            # Need pip >= 21.3 for editable installation without setup.py.
-            # See: https://pip.pypa.io/en/stable/news/#v21-3
-            subprocess.run(
-                [str(bin_path / "pip"), "install", "--upgrade", "pip >= 21.3"],
-                cwd=str(root_dir),
-                check=True,
-            )
-        subprocess.run(
-            [str(bin_path / "pip"), "install", "black", "flake8", "isort"],
-            cwd=str(root_dir),
-            check=True,
-        )
-        if with_jumpthegun:
-            subprocess.run(
-                [str(bin_path / "pip"), "install", "-e", "."],
-                cwd=str(root_dir),
-                check=True,
-            )
-        sleep_and_exit_on_signal_script = textwrap.dedent(
-            """\
-            #!/usr/bin/env python
-            import sleep_and_exit_on_signal
-
-            sleep_and_exit_on_signal.main()
-            """
-        )
-        script_path = bin_path / "__test_sleep_and_exit_on_signal"
-        script_path.write_text(sleep_and_exit_on_signal_script)
-        script_path.chmod(0o755)
-
-        module_file_path = (
-            bin_path.parent
-            / "lib"
-            / f"python{'.'.join(map(str, sys.version_info[:2]))}"
-            / "site-packages"
-            / "sleep_and_exit_on_signal.py"
-        )
-        shutil.copyfile(
-            Path(__file__).parent / "sleep_and_exit_on_signal.py",
-            module_file_path,
-        )
-
-    return proj_dir
+    return setup_test_project("testproj_without_jumpthegun", with_jumpthegun=False)
 
 
 @pytest.mark.parametrize(
@@ -168,6 +104,734 @@ def test_jumpthegun_autorun(testproj: Path) -> None:
     assert proc3.returncode == without_jumpthegun_proc.returncode
 
 
+@pytest.mark.parametrize(
+    "testproj",
+    ["testproj_with_jumpthegun", "testproj_without_jumpthegun"],
+    ids=["testproj_with_jumpthegun", "testproj_without_jumpthegun"],
+    indirect=True,
+)
+@pytest.mark.parametrize(
+    "tool_cmd",
+    [
+        ["black", "--check", "."],
+        ["flake8"],
+    ],
+    ids=lambda tool_cmd: tool_cmd[0],
+)
+def test_python_client(testproj: Path, tool_cmd: List[str]) -> None:
+    without_jumpthegun_proc = run(tool_cmd, proj_path=testproj)
+    assert without_jumpthegun_proc.returncode != 0
+
+    # Without a daemon, this falls back to running the tool directly.
+    proc1 = run(["jumpthegun-client", "--no-autorun", *tool_cmd], proj_path=testproj)
+
+    run(["jumpthegun", "start", tool_cmd[0]], proj_path=testproj, check=True)
+    try:
+        proc2 = run(
+            ["jumpthegun-client", "--no-autorun", *tool_cmd], proj_path=testproj
+        )
+    finally:
+        run(["jumpthegun", "stop", tool_cmd[0]], proj_path=testproj, check=True)
+
+    for proc in [proc1, proc2]:
+        assert proc.stdout == without_jumpthegun_proc.stdout
+        assert proc.stderr == without_jumpthegun_proc.stderr
+        assert proc.returncode == without_jumpthegun_proc.returncode
+
+
+@pytest.mark.parametrize(
+    "client_cmd",
+    [["jumpthegun", "run"], ["jumpthegun-client"], ["jumpthegun-client", "--pass-fds"]],
+    ids=["bash_client", "python_client", "python_client_pass_fds"],
+)
+def test_large_output(testproj: Path, client_cmd: List[str]) -> None:
+    tool_cmd = ["__test_write_output", "500000"]
+
+    without_jumpthegun_proc = run(tool_cmd, proj_path=testproj)
+    assert len(without_jumpthegun_proc.stdout) == 500000
+
+    run(["jumpthegun", "start", tool_cmd[0]], proj_path=testproj, check=True)
+    try:
+        proc = run([*client_cmd, "--no-autorun", *tool_cmd], proj_path=testproj)
+    finally:
+        run(["jumpthegun", "stop", tool_cmd[0]], proj_path=testproj, check=True)
+
+    assert proc.stdout == without_jumpthegun_proc.stdout
+    assert proc.stderr == without_jumpthegun_proc.stderr
+    assert proc.returncode == without_jumpthegun_proc.returncode
+
+
+@pytest.mark.parametrize(
+    "client_cmd",
+    [
+        ["jumpthegun", "run"],
+        ["jumpthegun-client"],
+        ["jumpthegun-client", "--pass-fds"],
+    ],
+    ids=["bash_client", "python_client", "python_client_pass_fds"],
+)
+def test_stdin(testproj: Path, client_cmd: List[str]) -> None:
+    tool_cmd = ["black", "-"]
+    # The last line deliberately has no trailing newline.
+    input_code = b"".join(b"x%d = ( %d )\n" % (i, i) for i in range(1000)) + b"y=1"
+
+    without_jumpthegun_proc = run(tool_cmd, proj_path=testproj, input=input_code)
+    assert without_jumpthegun_proc.returncode == 0
+
+    run(["jumpthegun", "start", tool_cmd[0]], proj_path=testproj, check=True)
+    try:
+        proc = run(
+            [*client_cmd, "--no-autorun", *tool_cmd],
+            proj_path=testproj,
+            input=input_code,
+        )
+    finally:
+        run(["jumpthegun", "stop", tool_cmd[0]], proj_path=testproj, check=True)
+
+    assert proc.stdout == without_jumpthegun_proc.stdout
+    assert proc.stderr == without_jumpthegun_proc.stderr
+    assert proc.returncode == without_jumpthegun_proc.returncode
+
+
+def test_warm_up(testproj: Path, tmp_path: Path, monkeypatch) -> None:
+    # A dry invocation of this tool imports a module and prints to stdout.
+    write_config(tmp_path, {"warm_ups": {"__test_lazy_import": ["dry-run"]}})
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path))
+    tool_cmd = ["__test_lazy_import"]
+
+    run(["jumpthegun", "start", tool_cmd[0]], proj_path=testproj, check=True)
+    try:
+        proc = run(["jumpthegun", "run", "--no-autorun", *tool_cmd], proj_path=testproj)
+    finally:
+        run(["jumpthegun", "stop", tool_cmd[0]], proj_path=testproj, check=True)
+
+    # The module was imported by the warm-up, whose output was discarded.
+    assert proc.stdout == b"True\n"
+    assert proc.returncode == 0
+
+
+def test_memory_report(testproj: Path, monkeypatch) -> None:
+    monkeypatch.setenv("JUMPTHEGUN_MEMORY_REPORT", "1")
+    tool_cmd = ["__test_write_output", "800"]
+
+    run(["jumpthegun", "start", tool_cmd[0]], proj_path=testproj, check=True)
+    try:
+        proc = run(["jumpthegun", "run", "--no-autorun", *tool_cmd], proj_path=testproj)
+        # Sub-processes' stats are collected once they have exited.
+        for _i in range(50):
+            stats_proc = run(["jumpthegun", "stats", tool_cmd[0]], proj_path=testproj)
+            stats = json.loads(stats_proc.stdout)
+            if stats["finished_invocations"] == 1:
+                break
+            time.sleep(0.1)
+    finally:
+        run(["jumpthegun", "stop", tool_cmd[0]], proj_path=testproj, check=True)
+
+    # The report doesn't affect the tool's output.
+    assert proc.returncode == 0
+    assert len(proc.stdout) == 800
+    assert proc.stderr == b""
+    for kind in ["shared", "private"]:
+        assert stats["child_memory_bytes"][kind]["count"] == 1
+        assert stats["child_memory_bytes"][kind]["p50"] > 0
+
+
+def test_trace(testproj: Path, tmp_path: Path, monkeypatch) -> None:
+    trace_file_path = tmp_path / "trace.json"
+    monkeypatch.setenv("JUMPTHEGUN_TRACE", str(trace_file_path))
+    tool_cmd = ["flake8"]
+
+    run(["jumpthegun", "start", tool_cmd[0]], proj_path=testproj, check=True)
+    try:
+        for client_cmd in [
+            ["jumpthegun", "run", "--no-autorun"],
+            ["jumpthegun-client", "--no-autorun"],
+        ]:
+            run([*client_cmd, *tool_cmd], proj_path=testproj)
+        # Sub-processes write their events after the client has the exit code.
+        for _i in range(50):
+            events = json.loads(trace_file_path.read_text().rstrip().rstrip(",") + "]")
+            if sum(event["name"] == "rc_sent" for event in events) == 2:
+                break
+            time.sleep(0.1)
+    finally:
+        run(["jumpthegun", "stop", tool_cmd[0]], proj_path=testproj, check=True)
+
+    phases_by_process: Dict[str, List[str]] = {}
+    process_names = {
+        event["pid"]: event["args"]["name"]
+        for event in events
+        if event["name"] == "process_name"
+    }
+    for event in events:
+        if event["ph"] != "M":
+            process_name = process_names[event["pid"]]
+            phases_by_process.setdefault(process_name, []).append(event["name"])
+
+    assert phases_by_process["jumpthegun-client"] == [
+        "client_start",
+        "connect",
+        "pid_received",
+        "request_sent",
+        "exit_code_received",
+    ]
+    assert phases_by_process["jumpthegun flake8 daemon sub-process"] == 2 * [
+        "accept",
+        "request_received",
+        "env_applied",
+        "tool_runner_entry",
+        "first_output",
+        "rc_sent",
+    ]
+
+
+@pytest.mark.parametrize(
+    "client_cmd",
+    [
+        ["jumpthegun", "run", "--no-autorun"],
+        ["jumpthegun-client", "--no-autorun"],
+    ],
+    ids=["bash_client", "python_client"],
+)
+def test_env_vars(testproj: Path, client_cmd: List[str], monkeypatch) -> None:
+    tool_name = "__test_print_env"
+    names = [
+        "JUMPTHEGUN_TEST_UNCHANGED",
+        "JUMPTHEGUN_TEST_CHANGED",
+        "JUMPTHEGUN_TEST_DELETED",
+        "JUMPTHEGUN_TEST_ADDED",
+        "JUMPTHEGUN_TEST_EMPTY",
+    ]
+    monkeypatch.setenv("JUMPTHEGUN_TEST_UNCHANGED", "same")
+    monkeypatch.setenv("JUMPTHEGUN_TEST_CHANGED", "before")
+    monkeypatch.setenv("JUMPTHEGUN_TEST_DELETED", "deleted")
+    run(["jumpthegun", "start", tool_name], proj_path=testproj, check=True)
+    try:
+        monkeypatch.setenv("JUMPTHEGUN_TEST_CHANGED", "after = \u00e9\nline 2")
+        monkeypatch.delenv("JUMPTHEGUN_TEST_DELETED")
+        monkeypatch.setenv("JUMPTHEGUN_TEST_ADDED", "added")
+        monkeypatch.setenv("JUMPTHEGUN_TEST_EMPTY", "")
+        # Run twice, so that env vars set by one run don't leak into the next.
+        proc1 = run([*client_cmd, tool_name, *names], proj_path=testproj)
+        monkeypatch.delenv("JUMPTHEGUN_TEST_ADDED")
+        proc2 = run([*client_cmd, tool_name, *names], proj_path=testproj)
+    finally:
+        run(["jumpthegun", "stop", tool_name], proj_path=testproj, check=True)
+
+    expected = {
+        "JUMPTHEGUN_TEST_UNCHANGED": "same",
+        "JUMPTHEGUN_TEST_CHANGED": "after = \u00e9\nline 2",
+        "JUMPTHEGUN_TEST_DELETED": None,
+        "JUMPTHEGUN_TEST_ADDED": "added",
+        "JUMPTHEGUN_TEST_EMPTY": "",
+    }
+    assert proc1.returncode == 0, proc1.stderr
+    assert json.loads(proc1.stdout) == expected
+    assert proc2.returncode == 0, proc2.stderr
+    assert json.loads(proc2.stdout) == {**expected, "JUMPTHEGUN_TEST_ADDED": None}
+
+
+def test_bash_client_lookup_cache(testproj: Path, tmp_path: Path, monkeypatch) -> None:
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    tool_cmd = ["flake8"]
+    lookup_cache_file_path = tmp_path / "jumpthegun" / "flake8.lookup"
+    without_jumpthegun_proc = run(tool_cmd, proj_path=testproj)
+
+    run(["jumpthegun", "start", tool_cmd[0]], proj_path=testproj, check=True)
+    try:
+        proc1 = run(
+            ["jumpthegun", "run", "--no-autorun", *tool_cmd], proj_path=testproj
+        )
+        cached_root = lookup_cache_file_path.read_text().splitlines()[0]
+        assert Path(cached_root) == get_bin_path(testproj).resolve()
+        # A cache entry for a different directory is ignored, and replaced.
+        lookup_cache_file_path.write_text("/nonexistent\n01234567\n")
+        proc2 = run(
+            ["jumpthegun", "run", "--no-autorun", *tool_cmd], proj_path=testproj
+        )
+        assert lookup_cache_file_path.read_text().splitlines()[0] == cached_root
+    finally:
+        run(["jumpthegun", "stop", tool_cmd[0]], proj_path=testproj, check=True)
+
+    for proc in [proc1, proc2]:
+        assert proc.stdout == without_jumpthegun_proc.stdout
+        assert proc.stderr == without_jumpthegun_proc.stderr
+
+
+def test_restart_on_code_change(testproj: Path, tmp_path: Path, monkeypatch) -> None:
+    write_config(tmp_path, {"code_check_interval_seconds": 1})
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path))
+    tool_cmd = ["__test_code_version"]
+    client_cmd = ["jumpthegun", "run", "--no-autorun"]
+    module_path = get_site_packages_path(testproj) / "code_version.py"
+    module_code = module_path.read_text()
+
+    run(["jumpthegun", "start", tool_cmd[0]], proj_path=testproj, check=True)
+    try:
+        pid = json.loads(
+            run(["jumpthegun", "status", tool_cmd[0]], proj_path=testproj).stdout
+        )["pid"]
+        assert run([*client_cmd, *tool_cmd], proj_path=testproj).stdout == b"1\n"
+
+        module_path.write_text(module_code.replace("VERSION = 1", "VERSION = 2"))
+        for _i in range(50):
+            proc = run([*client_cmd, *tool_cmd], proj_path=testproj)
+            if proc.stdout == b"2\n":
+                break
+            assert proc.stdout == b"1\n"
+            time.sleep(0.1)
+        assert proc.stdout == b"2\n"
+
+        # The daemon re-executed itself, keeping its pid.
+        status_proc = run(["jumpthegun", "status", tool_cmd[0]], proj_path=testproj)
+        assert json.loads(status_proc.stdout)["pid"] == pid
+        proc = run(["jumpthegun-client", "--no-autorun", *tool_cmd], proj_path=testproj)
+        assert proc.stdout == b"2\n"
+    finally:
+        module_path.write_text(module_code)
+        run(["jumpthegun", "stop", tool_cmd[0]], proj_path=testproj, check=True)
+
+
+def test_zygote(testproj: Path, tmp_path: Path, monkeypatch) -> None:
+    write_config(tmp_path, {"zygote": True, "idle_timeout_seconds": 10})
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path))
+    # Use a fresh runtime directory, so that no zygote is already running.
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    tool_cmds = [["black", "--check", "."], ["flake8"]]
+    without_jumpthegun_procs = [
+        run(tool_cmd, proj_path=testproj) for tool_cmd in tool_cmds
+    ]
+
+    for tool_cmd in tool_cmds:
+        run(["jumpthegun", "start", tool_cmd[0]], proj_path=testproj, check=True)
+    try:
+        procs = [
+            run(["jumpthegun", "run", "--no-autorun", *tool_cmd], proj_path=testproj)
+            for tool_cmd in tool_cmds
+        ]
+        daemon_pids = [
+            json.loads(
+                run(["jumpthegun", "status", tool_cmd[0]], proj_path=testproj).stdout
+            )["pid"]
+            for tool_cmd in tool_cmds
+        ]
+        parent_pids = [
+            int(
+                subprocess.run(
+                    ["ps", "-o", "ppid=", "-p", str(pid)], capture_output=True
+                ).stdout
+                or 0
+            )
+            for pid in daemon_pids
+        ]
+    finally:
+        for tool_cmd in tool_cmds:
+            run(["jumpthegun", "stop", tool_cmd[0]], proj_path=testproj)
+
+    for proc, without_jumpthegun_proc in zip(procs, without_jumpthegun_procs):
+        assert proc.stdout == without_jumpthegun_proc.stdout
+        assert proc.stderr == without_jumpthegun_proc.stderr
+        assert proc.returncode == without_jumpthegun_proc.returncode
+
+    # Both daemons were forked from the same zygote.
+    assert parent_pids[0] == parent_pids[1]
+    assert parent_pids[0] not in (0, 1, os.getpid())
+
+
+def test_tool_groups(testproj: Path, tmp_path: Path, monkeypatch) -> None:
+    write_config(
+        tmp_path, {"tool_groups": {"__test_write_output": ["__test_print_env"]}}
+    )
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path))
+    monkeypatch.setenv("JUMPTHEGUN_TEST_GROUP", "value")
+    tool_cmds = [
+        ["__test_write_output", "160"],
+        ["__test_print_env", "JUMPTHEGUN_TEST_GROUP"],
+    ]
+    without_jumpthegun_procs = [
+        run(tool_cmd, proj_path=testproj) for tool_cmd in tool_cmds
+    ]
+
+    # Starting any tool of the group starts the daemon serving all of them.
+    run(["jumpthegun", "start", tool_cmds[1][0]], proj_path=testproj, check=True)
+    try:
+        procs = [
+            run([*client_cmd, *tool_cmd], proj_path=testproj)
+            for client_cmd in [
+                ["jumpthegun", "run", "--no-autorun"],
+                ["jumpthegun-client", "--no-autorun"],
+            ]
+            for tool_cmd in tool_cmds
+        ]
+        daemon_pids = [
+            json.loads(
+                run(["jumpthegun", "status", tool_cmd[0]], proj_path=testproj).stdout
+            )["pid"]
+            for tool_cmd in tool_cmds
+        ]
+    finally:
+        run(["jumpthegun", "stop", tool_cmds[0][0]], proj_path=testproj, check=True)
+
+    for proc, without_jumpthegun_proc in zip(procs, without_jumpthegun_procs * 2):
+        assert proc.stdout == without_jumpthegun_proc.stdout
+        assert proc.stderr == without_jumpthegun_proc.stderr
+        assert proc.returncode == without_jumpthegun_proc.returncode
+    assert daemon_pids[0] == daemon_pids[1]
+
+    # Stopping the daemon removes the files of all tools it served.
+    for tool_cmd in tool_cmds:
+        proc = run(["jumpthegun", "status", tool_cmd[0]], proj_path=testproj)
+        assert proc.returncode != 0
+
+
+def test_tool_groups_stop_via_other_tool(
+    testproj: Path, tmp_path: Path, monkeypatch
+) -> None:
+    write_config(
+        tmp_path, {"tool_groups": {"__test_write_output": ["__test_print_env"]}}
+    )
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path))
+    tool_cmd = ["__test_write_output", "160"]
+    without_jumpthegun_proc = run(tool_cmd, proj_path=testproj)
+
+    run(["jumpthegun", "start", tool_cmd[0]], proj_path=testproj, check=True)
+    try:
+        proc = run(
+            ["jumpthegun", "stop", "__test_print_env"], proj_path=testproj, check=True
+        )
+        assert f'"jumpthegun {tool_cmd[0]}" daemon process stopped.' in (
+            proc.stdout.decode()
+        )
+    except BaseException:
+        run(["jumpthegun", "stop", tool_cmd[0]], proj_path=testproj)
+        raise
+
+    # The group's daemon and all of its files are gone, so the main tool is
+    # run directly.
+    for tool_name in [tool_cmd[0], "__test_print_env"]:
+        proc = run(["jumpthegun", "status", tool_name], proj_path=testproj)
+        assert proc.returncode != 0
+    for client_cmd in [
+        ["jumpthegun", "run", "--no-autorun"],
+        ["jumpthegun-client", "--no-autorun"],
+    ]:
+        proc = run([*client_cmd, *tool_cmd], proj_path=testproj)
+        assert proc.stdout == without_jumpthegun_proc.stdout
+        assert proc.stderr == without_jumpthegun_proc.stderr
+        assert proc.returncode == 0
+
+
+def test_sharding(testproj: Path, tmp_path: Path, monkeypatch) -> None:
+    write_config(
+        tmp_path,
+        {"sharding": {"flake8": {"shards": 2, "value_options": ["--exclude"]}}},
+    )
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path))
+    tool_cmds = [
+        ["flake8", "bad.py", "good.py"],
+        ["flake8", "--max-line-length", "10", "bad.py", "good.py"],
+        ["flake8", "good.py", "good.py"],
+        ["flake8", "--exclude", "bad.py", "bad.py", "good.py"],
+    ]
+    without_jumpthegun_procs = [
+        run(tool_cmd, proj_path=testproj) for tool_cmd in tool_cmds
+    ]
+
+    run(["jumpthegun", "start", "flake8"], proj_path=testproj, check=True)
+    try:
+        procs = [
+            run([*client_cmd, *tool_cmd], proj_path=testproj)
+            for client_cmd in [
+                ["jumpthegun", "run", "--no-autorun"],
+                ["jumpthegun-client", "--no-autorun"],
+            ]
+            for tool_cmd in tool_cmds
+        ]
+    finally:
+        run(["jumpthegun", "stop", "flake8"], proj_path=testproj, check=True)
+
+    for proc, without_jumpthegun_proc in zip(procs, without_jumpthegun_procs * 2):
+        assert proc.stdout == without_jumpthegun_proc.stdout
+        assert proc.stderr == without_jumpthegun_proc.stderr
+        assert proc.returncode == without_jumpthegun_proc.returncode
+
+
+def test_api(testproj_with_jumpthegun: Path) -> None:
+    testproj = testproj_with_jumpthegun
+    tool_cmds = [["black", "--check", "."], ["flake8"]]
+    input_code = b"".join(b"x%d = ( %d )\n" % (i, i) for i in range(1000))
+    without_jumpthegun_procs = [
+        run(tool_cmd, proj_path=testproj) for tool_cmd in tool_cmds
+    ]
+    without_jumpthegun_stdin_proc = run(
+        ["black", "-"], proj_path=testproj, input=input_code
+    )
+    script = textwrap.dedent(
+        """\
+        import json, sys
+        from jumpthegun.api import ToolRunner
+
+        runner = ToolRunner(autorun=False)
+        tool_cmds = json.loads(sys.argv[1])
+        results = runner.run_tools([(cmd[0], cmd[1:]) for cmd in tool_cmds] * 2)
+        results.append(runner.run_tool("black", ["-"], input=sys.stdin.buffer.read()))
+        json.dump([[rc, out.decode(), err.decode()] for rc, out, err in results], sys.stdout)
+        """
+    )
+
+    for tool_cmd in tool_cmds:
+        run(["jumpthegun", "start", tool_cmd[0]], proj_path=testproj, check=True)
+    try:
+        proc = run(
+            [
+                str(get_bin_path(testproj) / "python"),
+                "-c",
+                script,
+                json.dumps(tool_cmds),
+            ],
+            proj_path=testproj,
+            input=input_code,
+        )
+        started_processes = [
+            json.loads(
+                run(["jumpthegun", "status", tool_cmd[0]], proj_path=testproj).stdout
+            )["started_processes"]
+            for tool_cmd in tool_cmds
+        ]
+    finally:
+        for tool_cmd in tool_cmds:
+            run(["jumpthegun", "stop", tool_cmd[0]], proj_path=testproj)
+
+    assert proc.returncode == 0, proc.stderr
+    results = json.loads(proc.stdout)
+    for result, without_jumpthegun_proc in zip(
+        results, [*without_jumpthegun_procs * 2, without_jumpthegun_stdin_proc]
+    ):
+        assert result == [
+            without_jumpthegun_proc.returncode,
+            without_jumpthegun_proc.stdout.decode(),
+            without_jumpthegun_proc.stderr.decode(),
+        ]
+    # All runs were done via the daemons.
+    assert started_processes == [3, 2]
+
+
+def test_api_batch(testproj_with_jumpthegun: Path) -> None:
+    testproj = testproj_with_jumpthegun
+    jobs = [
+        [["good.py"], None],
+        [["bad.py"], str(testproj)],
+        [[f"{testproj.name}/bad.py"], str(testproj.parent)],
+        [["--version"], None],
+        [["missing.py"], None],
+    ]
+    without_jumpthegun_procs = [
+        run(["flake8", *args], proj_path=testproj, cwd=cwd) for args, cwd in jobs
+    ]
+    script = textwrap.dedent(
+        """\
+        import json, sys
+        from jumpthegun.api import BatchJob, ToolRunner
+
+        runner = ToolRunner(autorun=False)
+        jobs = [BatchJob(args, cwd) for args, cwd in json.loads(sys.argv[1])]
+        results = runner.run_batch("flake8", jobs, max_parallel=2)
+        json.dump([[rc, out.decode(), err.decode()] for rc, out, err in results], sys.stdout)
+        """
+    )
+
+    run(["jumpthegun", "start", "flake8"], proj_path=testproj, check=True)
+    try:
+        proc = run(
+            [str(get_bin_path(testproj) / "python"), "-c", script, json.dumps(jobs)],
+            proj_path=testproj,
+        )
+        status = json.loads(
+            run(["jumpthegun", "status", "flake8"], proj_path=testproj).stdout
+        )
+    finally:
+        run(["jumpthegun", "stop", "flake8"], proj_path=testproj)
+
+    assert proc.returncode == 0, proc.stderr
+    results = json.loads(proc.stdout)
+    assert results == [
+        [
+            without_jumpthegun_proc.returncode,
+            without_jumpthegun_proc.stdout.decode(),
+            without_jumpthegun_proc.stderr.decode(),
+        ]
+        for without_jumpthegun_proc in without_jumpthegun_procs
+    ]
+    # The whole batch was run via a single connection.
+    assert status["started_processes"] == 1
+
+
+def test_status(testproj: Path) -> None:
+    tool_cmd = ["flake8"]
+
+    run(["jumpthegun", "start", tool_cmd[0]], proj_path=testproj, check=True)
+    try:
+        run(["jumpthegun", "run", "--no-autorun", *tool_cmd], proj_path=testproj)
+        proc = run(["jumpthegun", "status", tool_cmd[0]], proj_path=testproj)
+    finally:
+        run(["jumpthegun", "stop", tool_cmd[0]], proj_path=testproj, check=True)
+
+    assert proc.returncode == 0
+    status = json.loads(proc.stdout)
+    assert status["started_processes"] == 1
+    assert status["pool_size"] == 0
+
+
+def test_stats(testproj: Path) -> None:
+    tool_cmd = ["flake8"]
+
+    run(["jumpthegun", "start", tool_cmd[0]], proj_path=testproj, check=True)
+    try:
+        for _i in range(2):
+            run(["jumpthegun", "run", "--no-autorun", *tool_cmd], proj_path=testproj)
+        # Sub-processes' stats are collected once they have exited.
+        for _i in range(50):
+            proc = run(["jumpthegun", "stats", tool_cmd[0]], proj_path=testproj)
+            stats = json.loads(proc.stdout)
+            if stats["finished_invocations"] == 2:
+                break
+            time.sleep(0.1)
+        prometheus_proc = run(
+            ["jumpthegun", "stats", tool_cmd[0], "--prometheus"], proj_path=testproj
+        )
+    finally:
+        run(["jumpthegun", "stop", tool_cmd[0]], proj_path=testproj, check=True)
+
+    assert stats["invocations"] == 2
+    assert stats["active_invocations"] == 0
+    assert stats["time_to_exit_seconds"]["count"] == 2
+    assert stats["time_to_first_output_seconds"]["count"] == 2
+    assert stats["fork_seconds"]["p50"] > 0
+    assert stats["relayed_bytes"]["stdout"] > 0
+
+    assert prometheus_proc.returncode == 0
+    assert b'jumpthegun_invocations_total{tool="flake8"} 2\n' in prometheus_proc.stdout
+
+
+def test_max_concurrent_children(testproj: Path, tmp_path: Path, monkeypatch) -> None:
+    write_config(tmp_path, {"max_concurrent_children": 1, "max_queued_connections": 1})
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path))
+    tool_cmd = ["__test_sleep_and_exit_on_signal"]
+
+    def get_status() -> Dict[str, Any]:
+        proc = run(["jumpthegun", "status", tool_cmd[0]], proj_path=testproj)
+        return json.loads(proc.stdout)
+
+    def wait_for_status(key: str, value: int) -> Dict[str, Any]:
+        for _i in range(50):
+            status = get_status()
+            if status[key] == value:
+                break
+            time.sleep(0.1)
+        return status
+
+    run(["jumpthegun", "start", tool_cmd[0]], proj_path=testproj, check=True)
+    procs: List[subprocess.Popen] = []
+
+    def run_in_background(client_cmd: List[str]) -> subprocess.Popen:
+        proc = run([*client_cmd, *tool_cmd], proj_path=testproj, background=True)
+        assert isinstance(proc, subprocess.Popen)
+        procs.append(proc)
+        return proc
+
+    try:
+        running_proc = run_in_background(["jumpthegun", "run", "--no-autorun"])
+        assert running_proc.stdout is not None
+        assert running_proc.stdout.readline() == b"Sleeping...\n"
+
+        queued_proc = run_in_background(["jumpthegun", "run", "--no-autorun"])
+        assert wait_for_status("queued_connections", 1)["queued_connections"] == 1
+
+        # These are run directly, since the queue is full.
+        for client_cmd in [
+            ["jumpthegun", "run", "--no-autorun"],
+            ["jumpthegun-client", "--no-autorun"],
+        ]:
+            proc = run_in_background(client_cmd)
+            assert proc.stdout is not None
+            assert proc.stdout.readline() == b"Sleeping...\n"
+        status = get_status()
+        assert status["running_processes"] == 1
+        assert status["queued_connections"] == 1
+        assert status["shed_connections"] == 2
+
+        # The queued connection is handled once the running one is done.
+        running_proc.send_signal(signal.SIGTERM)
+        running_proc.wait(5)
+        assert queued_proc.stdout is not None
+        assert queued_proc.stdout.readline() == b"Sleeping...\n"
+        status = get_status()
+        assert status["running_processes"] == 1
+        assert status["queued_connections"] == 0
+    finally:
+        for proc in procs:
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGTERM)
+                proc.wait(5)
+        run(["jumpthegun", "stop", tool_cmd[0]], proj_path=testproj, check=True)
+
+
+def test_worker_pool(testproj: Path, tmp_path: Path, monkeypatch) -> None:
+    write_config(tmp_path, {"pool_size": 2})
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path))
+    tool_cmd = ["flake8"]
+
+    without_jumpthegun_proc = run(tool_cmd, proj_path=testproj)
+    assert without_jumpthegun_proc.returncode != 0
+
+    run(["jumpthegun", "start", tool_cmd[0]], proj_path=testproj, check=True)
+    try:
+        # Run more times than the pool size, to use replacement sub-processes.
+        procs = [
+            run(["jumpthegun", "run", "--no-autorun", *tool_cmd], proj_path=testproj)
+            for _i in range(5)
+        ]
+    finally:
+        run(["jumpthegun", "stop", tool_cmd[0]], proj_path=testproj, check=True)
+
+    for proc in procs:
+        assert proc.stdout == without_jumpthegun_proc.stdout
+        assert proc.stderr == without_jumpthegun_proc.stderr
+        assert proc.returncode == without_jumpthegun_proc.returncode
+
+
+def test_import_training(testproj: Path, tmp_path: Path, monkeypatch) -> None:
+    write_config(tmp_path, {"import_training": True})
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path))
+    # Use a fresh runtime directory, so no imports were recorded previously.
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    tool_cmd = ["__test_lazy_import"]
+    client_cmd = ["jumpthegun", "run", "--no-autorun"]
+
+    run(["jumpthegun", "start", tool_cmd[0]], proj_path=testproj, check=True)
+    try:
+        proc = run([*client_cmd, *tool_cmd], proj_path=testproj)
+        assert proc.stdout == b"False\n"
+        # Sub-processes record imports after the client exits, so the daemon
+        # may only import the module for a later run.
+        for _i in range(50):
+            proc = run([*client_cmd, *tool_cmd], proj_path=testproj)
+            if proc.stdout == b"True\n":
+                break
+            time.sleep(0.1)
+        assert proc.stdout == b"True\n"
+    finally:
+        run(["jumpthegun", "stop", tool_cmd[0]], proj_path=testproj, check=True)
+
+    # Recorded imports are imported when the daemon starts.
+    run(["jumpthegun", "start", tool_cmd[0]], proj_path=testproj, check=True)
+    try:
+        proc = run([*client_cmd, *tool_cmd], proj_path=testproj)
+    finally:
+        run(["jumpthegun", "stop", tool_cmd[0]], proj_path=testproj, check=True)
+    assert proc.stdout == b"True\n"
+
+
 @pytest.mark.parametrize(
     "testproj",
     ["testproj_with_jumpthegun", "testproj_without_jumpthegun"],
@@ -194,43 +858,3 @@ def test_signal_forwarding(testproj: Path, signum: int) -> None:
         assert b"Received signal" in proc.stdout.read()
     finally:
         run(["jumpthegun", "stop", subcmd[0]], proj_path=testproj, check=True)
-
-
-def run(
-    cmd: List[str], proj_path: Path, background: bool = False, check: bool = False
-) -> Union[subprocess.CompletedProcess, subprocess.Popen]:
-    if background and check:
-        raise ValueError("Must not set both background=True and check=True.")
-
-    pass_through_env_vars = {
-        key: value
-        for key, value in os.environ.items()
-        if re.fullmatch(r"HOME|TMPDIR|USER|XDG_.*", key)
-    }
-
-    bin_path = get_bin_path(proj_path).resolve()
-    proc_kwargs = dict(
-        cwd=str(proj_path),
-        env={
-            **pass_through_env_vars,
-            "PATH": f"{str(bin_path)}:{os.getenv('PATH', '')}".strip(":"),
-            "VIRTUAL_ENV": str(bin_path.parent),
-        },
-        stdin=subprocess.DEVNULL,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-
-    if background:
-        return subprocess.Popen(cmd, **proc_kwargs)
-    else:
-        try:
-            return subprocess.run(cmd, check=check, **proc_kwargs)
-        except subprocess.CalledProcessError as proc_exc:
-            if proc_exc.stdout:
-                print("Stdout:")
-                print(proc_exc.stdout.decode())
-            if proc_exc.stdout:
-                print("Stderr:")
-                print(proc_exc.stderr.decode())
-            raise
@@ -0,0 +1,113 @@
+import io
+import os
+import signal
+import sys
+import time
+
+import pytest
+
+from jumpthegun.sharding import combine_exit_codes, run_sharded, split_file_args
+
+
+@pytest.fixture
+def files_dir(tmp_path, monkeypatch):
+    for name in ["a.py", "b.py", "c.py", "d.pyi", "e.py", "setup.cfg"]:
+        (tmp_path / name).write_text("")
+    (tmp_path / "dir.py").mkdir()
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_split_file_args(files_dir):
+    args = ["--check=1", "a.py", "b.py", "c.py", "d.pyi", "e.py", "-v"]
+    assert split_file_args(args, 2, [".py", ".pyi"]) == [
+        ["--check=1", "a.py", "b.py", "-v"],
+        ["--check=1", "c.py", "d.pyi", "e.py", "-v"],
+    ]
+    assert split_file_args(args, 5, [".py"]) == [
+        ["--check=1", "a.py", "d.pyi", "-v"],
+        ["--check=1", "b.py", "d.pyi", "-v"],
+        ["--check=1", "c.py", "d.pyi", "-v"],
+        ["--check=1", "e.py", "d.pyi", "-v"],
+    ]
+
+
+def test_split_file_args_not_files(files_dir):
+    # Options, option values, directories and missing files aren't split.
+    args = ["--config", "setup.cfg", "-x.py", "dir.py", "missing.py", "a.py"]
+    assert split_file_args(args, 4, [".py"]) is None
+    assert split_file_args([*args, "b.py"], 4, [".py"]) == [
+        ["--config", "setup.cfg", "-x.py", "dir.py", "missing.py", "a.py"],
+        ["--config", "setup.cfg", "-x.py", "dir.py", "missing.py", "b.py"],
+    ]
+    assert split_file_args(["a.py", "b.py"], 1, [".py"]) is None
+    assert split_file_args(["--opt=1", "a.py", "b.py"], 2, [".py"]) == [
+        ["--opt=1", "a.py"],
+        ["--opt=1", "b.py"],
+    ]
+    assert split_file_args(["a.py", "--", "b.py"], 2, [".py"]) is None
+
+
+def test_split_file_args_option_values(files_dir):
+    # Files which may be option values aren't split from their options.
+    assert split_file_args(["--config", "a.py", "b.py", "c.py"], 2, [".py"]) is None
+    assert split_file_args(["b.py", "c.py", "-p", "a.py"], 2, [".py"]) is None
+    assert split_file_args(["-v", "a.py", "b.py"], 2, [".py"]) is None
+
+    # With the options which take values given, others are known not to.
+    args = ["-v", "--config", "a.py", "b.py", "c.py", "-p", "d.pyi"]
+    assert split_file_args(args, 2, [".py", ".pyi"], ["--config", "-p"]) == [
+        ["-v", "--config", "a.py", "b.py", "-p", "d.pyi"],
+        ["-v", "--config", "a.py", "c.py", "-p", "d.pyi"],
+    ]
+
+
+def test_combine_exit_codes():
+    assert combine_exit_codes([0, 0, 0], "max") == 0
+    assert combine_exit_codes([0, 2, 1], "max") == 2
+    assert combine_exit_codes([0, 137, 1], "max") == 137
+    assert combine_exit_codes([0, 137, 1], "any_nonzero") == 1
+    assert combine_exit_codes([0, 0, 0], "any_nonzero") == 0
+    assert combine_exit_codes([0, 2, 1], "any_nonzero") == 1
+    with pytest.raises(ValueError):
+        combine_exit_codes([0], "min")
+
+
+def test_run_sharded(monkeypatch):
+    stdout = io.TextIOWrapper(io.BytesIO(), write_through=True)
+    stderr = io.TextIOWrapper(io.BytesIO(), write_through=True)
+    monkeypatch.setattr(sys, "stdout", stdout)
+    monkeypatch.setattr(sys, "stderr", stderr)
+    monkeypatch.setattr(sys, "argv", ["tool"])
+
+    def run_tool():
+        # Later shards finish first, but their outputs come later.
+        shard_index = int(sys.argv[1])
+        time.sleep(0.1 * (2 - shard_index))
+        print(f"out {shard_index}: " + " ".join(sys.argv[1:]))
+        print(f"err {shard_index}", file=sys.stderr)
+        if sys.stdin.read():
+            return 100
+        return shard_index
+
+    exit_code = run_sharded(run_tool, [["0", "a"], ["1", "b"], ["2", "c"]], "max")
+
+    assert exit_code == 2
+    assert stdout.buffer.getvalue() == b"out 0: 0 a\nout 1: 1 b\nout 2: 2 c\n"
+    assert stderr.buffer.getvalue() == b"err 0\nerr 1\nerr 2\n"
+    assert sys.argv == ["tool"]
+
+
+def test_run_sharded_killed_by_signal(monkeypatch):
+    monkeypatch.setattr(sys, "stdout", io.TextIOWrapper(io.BytesIO()))
+    monkeypatch.setattr(sys, "stderr", io.TextIOWrapper(io.BytesIO()))
+    monkeypatch.setattr(sys, "argv", ["tool"])
+
+    def run_tool():
+        if sys.argv[1] == "kill":
+            os.kill(os.getpid(), signal.SIGKILL)
+        return 1
+
+    shards_args = [["a"], ["kill"], ["b"]]
+    assert run_sharded(run_tool, shards_args, "max") == 128 + signal.SIGKILL
+    assert run_sharded(run_tool, shards_args, "any_nonzero") == 1
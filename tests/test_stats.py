@@ -0,0 +1,76 @@
+from jumpthegun.child_registry import ChildInfo
+from jumpthegun.stats import StatsCollector, format_prometheus, percentile
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([1.0], 99) == 1.0
+    values = [float(x) for x in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 95) == 95.0
+    assert percentile(values, 99) == 99.0
+
+
+def test_stats_collector():
+    collector = StatsCollector()
+    collector.record(
+        [
+            ChildInfo(
+                pid=1,
+                start_time=0.0,
+                fork_seconds=0.002,
+                time_to_first_output=0.1,
+                time_to_exit=0.3,
+                relayed_bytes={"stdin": 5, "stdout": 100, "stderr": 0},
+                memory_bytes={"rss": 30, "pss": 20, "shared": 10, "private": 20},
+            ),
+            # E.g. a sub-process which exited without reporting.
+            ChildInfo(pid=2, start_time=0.0, fork_seconds=0.004),
+        ]
+    )
+    stats = collector.to_dict()
+    assert stats["finished_invocations"] == 2
+    assert stats["fork_seconds"] == {
+        "count": 2,
+        "sum": 0.006,
+        "p50": 0.002,
+        "p95": 0.004,
+        "p99": 0.004,
+    }
+    assert stats["time_to_first_output_seconds"]["count"] == 1
+    assert stats["time_to_exit_seconds"]["p50"] == 0.3
+    assert stats["relayed_bytes"] == {"stdin": 5, "stdout": 100, "stderr": 0}
+    assert stats["child_memory_bytes"]["shared"]["p50"] == 10
+    assert stats["child_memory_bytes"]["private"]["count"] == 1
+
+
+def test_format_prometheus():
+    stats = {
+        "uptime_seconds": 12.5,
+        "invocations": 3,
+        "active_invocations": 1,
+        **{
+            name: {"count": 2, "sum": 0.5, "p50": 0.2, "p95": 0.3, "p99": None}
+            for name in [
+                "time_to_first_output_seconds",
+                "time_to_exit_seconds",
+                "fork_seconds",
+            ]
+        },
+        "relayed_bytes": {"stdin": 0, "stdout": 10, "stderr": 2},
+        "child_memory_bytes": {
+            "shared": {"count": 1, "sum": 10, "p50": 10, "p95": 10, "p99": None},
+            "private": {"count": 0, "sum": 0, "p50": None, "p95": None, "p99": None},
+        },
+        "rss_bytes": None,
+    }
+    lines = format_prometheus("flake8", stats).splitlines()
+    assert "# TYPE jumpthegun_invocations_total counter" in lines
+    assert 'jumpthegun_invocations_total{tool="flake8"} 3' in lines
+    assert 'jumpthegun_fork_seconds{tool="flake8",quantile="0.95"} 0.3' in lines
+    assert 'jumpthegun_fork_seconds_count{tool="flake8"} 2' in lines
+    assert 'jumpthegun_relayed_bytes_total{tool="flake8",channel="stdout"} 10' in lines
+    assert 'jumpthegun_child_shared_memory_bytes_sum{tool="flake8"} 10' in lines
+    # Missing values are omitted.
+    assert not any(line.startswith("jumpthegun_daemon_rss_bytes{") for line in lines)
+    assert not any('quantile="0.99"' in line for line in lines)
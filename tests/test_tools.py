@@ -1,6 +1,14 @@
+import json
+
 import pytest
 
-from jumpthegun.tools import ToolExceptionBase, get_tool_entrypoint
+from jumpthegun.tools import (
+    ToolExceptionBase,
+    get_console_scripts,
+    get_entrypoints_cache_file_path,
+    get_tool_entrypoint,
+    get_tool_group,
+)
 
 
 def test_find_pip():
@@ -12,3 +20,42 @@ def test_find_nonexistent_entrypoint():
     """Test failing to find an entrypoint for a non-existent script."""
     with pytest.raises(ToolExceptionBase):
         get_tool_entrypoint("DOES_NOT_EXIST")
+
+
+def test_console_scripts_cache(tmp_path, monkeypatch):
+    """Test that console scripts are cached until sys.path changes."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    cache_file_path = get_entrypoints_cache_file_path()
+    assert cache_file_path.parent.parent == tmp_path
+
+    console_scripts = get_console_scripts()
+    assert "pip" in console_scripts
+    cached = json.loads(cache_file_path.read_text())
+    assert cached["console_scripts"] == console_scripts
+
+    # The cached entrypoints are used while the fingerprint matches.
+    cached["console_scripts"]["__cached_tool"] = ["cached_module:main"]
+    cache_file_path.write_text(json.dumps(cached))
+    assert get_tool_entrypoint("__cached_tool").value == "cached_module:main"
+
+    # Otherwise, they are found again.
+    cached["fingerprint"] = {str(tmp_path): 0}
+    cache_file_path.write_text(json.dumps(cached))
+    assert "__cached_tool" not in get_console_scripts()
+    assert (
+        "__cached_tool"
+        not in json.loads(cache_file_path.read_text())["console_scripts"]
+    )
+
+
+def test_tool_group():
+    groups = {"tool": ["tool-helper", "tool-other"], "pytest": None}
+    assert get_tool_group("tool", groups) == ("tool", ["tool-helper", "tool-other"])
+    assert get_tool_group("tool-other", groups) == (
+        "tool",
+        ["tool-helper", "tool-other"],
+    )
+    assert get_tool_group("other", groups) == ("other", [])
+    # Well-known groups may be disabled.
+    assert get_tool_group("py.test", {}) == ("pytest", ["py.test"])
+    assert get_tool_group("py.test", groups) == ("py.test", [])
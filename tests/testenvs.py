@@ -0,0 +1,156 @@
+"""Test environments, shared by the tests and the benchmarks.
+
+Each is a copy of the test project with a venv of its own, set up under
+.testenvs/ in the repository root.
+"""
+
+import os
+import re
+import shutil
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+__all__ = [
+    "testing_tools",
+    "get_bin_path",
+    "get_site_packages_path",
+    "setup_test_project",
+    "run",
+]
+
+# Scripts installed into test environments, and the modules they run.
+testing_tools: Dict[str, str] = {
+    "__test_sleep_and_exit_on_signal": "sleep_and_exit_on_signal",
+    "__test_write_output": "write_output",
+    "__test_lazy_import": "lazy_import",
+    "__test_print_env": "print_env",
+    "__test_code_version": "code_version",
+}
+
+
+def get_bin_path(project_path: Path) -> Path:
+    venv_path = project_path.with_name(project_path.name + "_venv")
+    bin_dir_name = "Scripts" if sys.platform == "win32" else "bin"
+    return venv_path / bin_dir_name
+
+
+def get_site_packages_path(project_path: Path) -> Path:
+    return (
+        get_bin_path(project_path).parent
+        / "lib"
+        / f"python{'.'.join(map(str, sys.version_info[:2]))}"
+        / "site-packages"
+    )
+
+
+def setup_test_project(name: str, with_jumpthegun: bool) -> Path:
+    """Set up a copy of the test project with a venv, once per Python version.
+
+    The venv has black, flake8 and isort installed, along with the testing
+    tools, and jumpthegun too if requested.
+    """
+    root_dir = Path(__file__).parent.parent
+    testenvs_dir = root_dir / ".testenvs"
+    testenvs_dir.mkdir(exist_ok=True)
+    ver_dir = testenvs_dir / sys.version.split()[0]
+    ver_dir.mkdir(exist_ok=True)
+
+    proj_dir = ver_dir / name
+    if not proj_dir.exists():
+        sources_dir = Path(__file__).parent / "testproj"
+        shutil.copytree(sources_dir, proj_dir)
+        venv_path = get_bin_path(proj_dir).parent
+        subprocess.run(
+            [sys.executable, "-m", "venv", str(venv_path.resolve())],
+            check=True,
+        )
+        bin_path = get_bin_path(proj_dir)
+        if with_jumpthegun:
+            # Need pip >= 21.3 for editable installation without setup.py.
+            # See: https://pip.pypa.io/en/stable/news/#v21-3
+            subprocess.run(
+                [str(bin_path / "pip"), "install", "--upgrade", "pip >= 21.3"],
+                cwd=str(root_dir),
+                check=True,
+            )
+        subprocess.run(
+            [str(bin_path / "pip"), "install", "black", "flake8", "isort"],
+            cwd=str(root_dir),
+            check=True,
+        )
+        if with_jumpthegun:
+            subprocess.run(
+                [str(bin_path / "pip"), "install", "-e", "."],
+                cwd=str(root_dir),
+                check=True,
+            )
+        site_packages_path = get_site_packages_path(proj_dir)
+        for script_name, module_name in testing_tools.items():
+            script = textwrap.dedent(
+                f"""\
+                #!/usr/bin/env python
+                import {module_name}
+
+                {module_name}.main()
+                """
+            )
+            script_path = bin_path / script_name
+            script_path.write_text(script)
+            script_path.chmod(0o755)
+
+            shutil.copyfile(
+                Path(__file__).parent / f"{module_name}.py",
+                site_packages_path / f"{module_name}.py",
+            )
+
+    return proj_dir
+
+
+def run(
+    cmd: List[str],
+    proj_path: Path,
+    background: bool = False,
+    check: bool = False,
+    input: Optional[bytes] = None,
+    cwd: Optional[str] = None,
+) -> Union[subprocess.CompletedProcess, subprocess.Popen]:
+    if background and check:
+        raise ValueError("Must not set both background=True and check=True.")
+
+    pass_through_env_vars = {
+        key: value
+        for key, value in os.environ.items()
+        if re.fullmatch(r"HOME|TMPDIR|USER|XDG_.*|JUMPTHEGUN_.*", key)
+    }
+
+    bin_path = get_bin_path(proj_path).resolve()
+    proc_kwargs = dict(
+        cwd=str(proj_path) if cwd is None else cwd,
+        env={
+            **pass_through_env_vars,
+            "PATH": f"{str(bin_path)}:{os.getenv('PATH', '')}".strip(":"),
+            "VIRTUAL_ENV": str(bin_path.parent),
+        },
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+    if input is None:
+        proc_kwargs["stdin"] = subprocess.DEVNULL
+
+    if background:
+        return subprocess.Popen(cmd, **proc_kwargs)
+    else:
+        try:
+            return subprocess.run(cmd, check=check, input=input, **proc_kwargs)
+        except subprocess.CalledProcessError as proc_exc:
+            if proc_exc.stdout:
+                print("Stdout:")
+                print(proc_exc.stdout.decode())
+            if proc_exc.stdout:
+                print("Stderr:")
+                print(proc_exc.stderr.decode())
+            raise
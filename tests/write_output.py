@@ -0,0 +1,10 @@
+import sys
+
+
+def main():
+    """Write the given number of bytes to stdout, line by line."""
+    n_bytes = int(sys.argv[1])
+    line_length = int(sys.argv[2]) if len(sys.argv) > 2 else 80
+    line = "x" * (line_length - 1)
+    for _i in range(n_bytes // line_length):
+        print(line)